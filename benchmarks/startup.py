@@ -0,0 +1,84 @@
+"""Startup benchmark for camkes-cli.
+
+Times how long the CLI takes to get as far as printing help for a handful
+of commands, and checks that heavy dependencies are only imported by the
+commands that use them. Exits with a non-zero status if a command exceeds
+its time budget or imports a module it shouldn't, so it can be run as a CI
+check:
+
+    python benchmarks/startup.py --budget 100
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ["--help"],
+    ["clean", "--help"],
+    ["config", "--help"],
+]
+
+# modules that must not be loaded merely to start up
+HEAVY_MODULES = ["jinja2", "toml", "elftools"]
+
+IMPORT_CHECK = """
+import sys
+sys.argv = ["camkes-cli"] + %r
+from camkes_cli import cli
+try:
+    cli.main()
+except SystemExit:
+    pass
+sys.stderr.write(" ".join(sorted(set(m.split(".")[0] for m in sys.modules))))
+"""
+
+def environment():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_PATH] + [p for p in [env.get("PYTHONPATH")] if p])
+    return env
+
+def median_time(cmd, repeat):
+    samples = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.call(cmd, env=environment(), stdout=devnull, stderr=devnull)
+            samples.append(time.time() - start)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def imported_modules(argv):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, "-c", IMPORT_CHECK % argv], env=environment(),
+                                stdout=devnull, stderr=subprocess.PIPE)
+        _, err = proc.communicate()
+    return set(err.decode().split())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--budget', type=float, default=100,
+                        help="Maximum median startup time per command in milliseconds")
+    parser.add_argument('--repeat', type=int, default=10, help="Number of runs per command")
+    args = parser.parse_args()
+
+    # time the interpreter on its own so the budget only covers camkes-cli
+    baseline = median_time([sys.executable, "-c", "pass"], args.repeat)
+
+    failed = False
+    for argv in COMMANDS:
+        median = (median_time([sys.executable, "-m", "camkes_cli"] + argv, args.repeat) - baseline) * 1000
+        heavy = sorted(imported_modules(argv) & set(HEAVY_MODULES))
+        ok = median <= args.budget and len(heavy) == 0
+        failed = failed or not ok
+        print("%-20s %8.1f ms  %s%s" % (" ".join(argv), median, "ok" if ok else "FAIL",
+                                       "  (imports %s)" % ", ".join(heavy) if heavy else ""))
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""Benchmark suite for camkes-cli.
+
+Times the CLI's own overheads on a synthetic project, using a stub of the
+CAmkES parser and fake make, repo and qemu executables, so it runs
+offline. Results are written as JSON, and the suite exits with a non-zero
+status if a benchmark exceeds its threshold in benchmarks/thresholds.json,
+or is more than --tolerance percent slower than a baseline from an
+earlier run:
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline results.json --tolerance 20
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import multiprocessing
+import tempfile
+import subprocess
+import collections
+
+import startup
+import synthetic
+
+REPO_PATH = startup.REPO_PATH
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+
+sys.path.insert(0, REPO_PATH)
+
+def median(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2]
+
+def measure(function, repeat, setup=None):
+    """Returns the times taken by repeat calls to function, each after a
+       call to setup which isn't timed."""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        function()
+        samples.append(time.time() - start)
+    return samples
+
+class Suite:
+    """Benchmarks run against one synthetic project, in the order they are
+       listed in BENCHMARKS."""
+
+    def __init__(self, args, directory):
+        self.args = args
+        self.directory = directory
+        self.root = os.path.join(directory, "project")
+        self.bin_path = os.path.join(directory, "bin")
+        self.logger = logging.getLogger("benchmarks")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+        synthetic.install_fake_tools(self.bin_path)
+        self.deepest = synthetic.generate_project(self.root, args.components, args.procedures, args.depth,
+                                                  options=args.options)
+
+        os.environ["PATH"] = os.pathsep.join([self.bin_path, os.environ.get("PATH", "")])
+        os.environ["XDG_CACHE_HOME"] = os.path.join(directory, "cache")
+        os.environ["XDG_CONFIG_HOME"] = os.path.join(directory, "config")
+        os.chdir(self.root)
+
+        from camkes_cli import common
+        self.common = common
+        self.context = common.project_context()
+
+    def startup(self):
+        baseline = startup.median_time([sys.executable, "-c", "pass"], self.args.repeat)
+        return [startup.median_time([sys.executable, "-m", "camkes_cli", "--help"], 1) - baseline
+                for _ in range(self.args.repeat)]
+
+    def new_index(self, clear=False, jobs=1):
+        from camkes_cli import index
+        if clear:
+            shutil.rmtree(self.context.cache_path, ignore_errors=True)
+        self.procedure_index = index.ProcedureIndex(self.context, self.logger, jobs)
+
+    def index_scan(self):
+        """Scanning every file of a project with no index, parsing them
+           together in one session."""
+        return measure(lambda: self.procedure_index.refresh(), self.args.repeat,
+                       setup=lambda: self.new_index(clear=True))
+
+    def index_scan_parallel(self):
+        """Scanning every file of a project with no index, parsing them one
+           by one in a pool of --jobs processes."""
+        return measure(lambda: self.procedure_index.refresh(), self.args.repeat,
+                       setup=lambda: self.new_index(clear=True, jobs=self.args.jobs))
+
+    def find_procedure_cold(self):
+        """Finding the deepest procedure with no index, in parallel, which
+           stops once the file defining it is parsed."""
+        return measure(lambda: self.common.find_procedure(self.context, self.deepest, self.logger,
+                                                          self.procedure_index), self.args.repeat,
+                       setup=lambda: self.new_index(clear=True, jobs=self.args.jobs))
+
+    def find_procedure_hit(self):
+        self.new_index()
+        self.procedure_index.refresh()
+        return measure(lambda: self.common.find_procedure(self.context, self.deepest, self.logger,
+                                                          self.procedure_index), self.args.repeat)
+
+    def find_procedure_miss(self):
+        self.new_index()
+        self.procedure_index.refresh()
+
+        def miss():
+            try:
+                self.common.find_procedure(self.context, "Missing", self.logger, self.procedure_index)
+            except self.common.MissingProcedure:
+                pass
+        return measure(miss, self.args.repeat)
+
+    def new_templates(self):
+        """Instantiating the base and app templates of a new project."""
+        from camkes_cli import new
+        info = collections.OrderedDict([("name", "fresh"), ("manifest_url", "x"), ("manifest_name", "y")])
+        directory = os.path.join(self.directory, "fresh")
+
+        def setup():
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(os.path.join(directory, "src"))
+
+        def instantiate():
+            new.instantiate_base_templates(directory, info)
+            new.instantiate_app_template("hello_world", directory, info)
+        return measure(instantiate, self.args.repeat, setup)
+
+    def new_command(self):
+        """The whole new command, with the fake repo."""
+        directory = os.path.join(self.directory, "created")
+        cmd = [sys.executable, "-m", "camkes_cli", "--quiet", "new", "created", "--directory", directory]
+        env = startup.environment()
+
+        def run():
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call(cmd, env=env, cwd=self.directory, stdout=devnull, stderr=devnull)
+        return measure(run, self.args.repeat, setup=lambda: shutil.rmtree(directory, ignore_errors=True))
+
+    def publish_images(self):
+        """Publishing large images, as copy_images used to."""
+        from camkes_cli import images
+        images_path = self.context.build_images_path("x86")
+        size = self.args.image_size * 1024 * 1024
+
+        def setup():
+            try:
+                os.makedirs(images_path)
+            except OSError:
+                pass
+            # a new app each time, alongside an unchanged kernel
+            with open(os.path.join(images_path, "capdl-loader-experimental-image-ia32-pc99"), 'wb') as f:
+                f.write(os.urandom(64))
+                f.truncate(size)
+            with open(os.path.join(images_path, "kernel-ia32-pc99"), 'wb') as f:
+                f.truncate(size)
+        return measure(lambda: images.publish(self.context, "x86", self.logger), self.args.repeat, setup)
+
+    def config_changed(self):
+        """Comparing configs that differ only in comments and order."""
+        self.common.prepare_config_build(self.context, "x86")
+        synthetic.write(self.context.build_config_path("x86"), synthetic.config_source(self.args.options, seed=1))
+
+        def compare():
+            if self.common.config_changed(self.context, "x86"):
+                raise AssertionError("Reordered config reported as changed")
+        return measure(compare, self.args.repeat)
+
+    def headless_boot(self):
+        """Watching the output of a boot for the expected line."""
+        from camkes_cli import headless
+        log_path = os.path.join(self.directory, "boot.log")
+        expect = headless.pattern("All tests passed")
+
+        def boot():
+            (result, _) = headless.run(["qemu-system-x86_64"], log_path, expect=expect, timeout=30,
+                                       echo=False)
+            if result != headless.PASSED:
+                raise AssertionError("Fake boot didn't pass")
+        return measure(boot, self.args.repeat)
+
+BENCHMARKS = collections.OrderedDict([
+    ("startup", Suite.startup),
+    ("index_scan", Suite.index_scan),
+    ("index_scan_parallel", Suite.index_scan_parallel),
+    ("find_procedure_cold", Suite.find_procedure_cold),
+    ("find_procedure_hit", Suite.find_procedure_hit),
+    ("find_procedure_miss", Suite.find_procedure_miss),
+    ("new_templates", Suite.new_templates),
+    ("new_command", Suite.new_command),
+    ("publish_images", Suite.publish_images),
+    ("config_changed", Suite.config_changed),
+    ("headless_boot", Suite.headless_boot),
+])
+
+# arguments recorded with the results, since results are only comparable
+# with others run with the same ones
+PARAMETERS = ["repeat", "components", "procedures", "depth", "options", "image_size", "jobs"]
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def check(name, result, thresholds, baseline, tolerance):
+    """Returns the reasons a result counts as a regression."""
+    problems = []
+    threshold = thresholds.get(name)
+    if threshold is not None and result["median_ms"] > threshold:
+        problems.append("over threshold of %.1f ms" % threshold)
+    if baseline is not None and name in baseline["results"]:
+        limit = baseline["results"][name]["median_ms"] * (1 + tolerance / 100.0)
+        if result["median_ms"] > limit:
+            problems.append("%.1f%% slower than baseline" % (
+                (result["median_ms"] / baseline["results"][name]["median_ms"] - 1) * 100))
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--output', metavar='FILE', default=None, help="Write results as JSON to FILE")
+    parser.add_argument('--baseline', metavar='FILE', default=None,
+                        help="Compare with the results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help="Percentage by which a benchmark may be slower than the baseline (default: 20)")
+    parser.add_argument('--thresholds', metavar='FILE', default=THRESHOLDS_PATH,
+                        help="JSON file of maximum median times in milliseconds")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), default=None,
+                        help="Run only this benchmark (may be repeated)")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of runs per benchmark")
+    parser.add_argument('--components', type=int, default=100)
+    parser.add_argument('--procedures', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=10, help="Length of the chain of imports")
+    parser.add_argument('--options', type=int, default=1000, help="Options in the configs compared")
+    parser.add_argument('--image_size', type=int, default=32, metavar='MB', help="Size of published images")
+    parser.add_argument('--jobs', type=int, default=max(2, multiprocessing.cpu_count()),
+                        help="Processes parsing in parallel (default: the number of CPUs, at least 2)")
+    args = parser.parse_args()
+
+    thresholds = load_json(args.thresholds) if os.path.exists(args.thresholds) else {}
+    baseline = load_json(args.baseline) if args.baseline is not None else None
+    parameters = dict((key, getattr(args, key)) for key in PARAMETERS)
+    if baseline is not None and baseline.get("parameters") != parameters:
+        print("warning: the baseline was run with different parameters: %s"
+              % json.dumps(baseline.get("parameters"), sort_keys=True))
+
+    directory = tempfile.mkdtemp(prefix="camkes-cli-bench.")
+    cwd = os.getcwd()
+    try:
+        suite = Suite(args, directory)
+        results = collections.OrderedDict()
+        failed = False
+        for (name, benchmark) in BENCHMARKS.items():
+            if args.only is not None and name not in args.only:
+                continue
+            samples = benchmark(suite)
+            result = {
+                "median_ms": median(samples) * 1000,
+                "min_ms": min(samples) * 1000,
+                "max_ms": max(samples) * 1000,
+                "samples": len(samples),
+            }
+            problems = check(name, result, thresholds, baseline, args.tolerance)
+            result["ok"] = len(problems) == 0
+            failed = failed or not result["ok"]
+            results[name] = result
+            print("%-22s %9.1f ms  %s" % (name, result["median_ms"], "; ".join(problems) or "ok"))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "parameters": parameters,
+                "results": results,
+            }, f, indent=2)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
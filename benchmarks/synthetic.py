@@ -0,0 +1,272 @@
+"""Synthetic camkes-cli projects for benchmarking.
+
+Generates a project with a given number of components and procedures and
+a chain of .camkes files importing each other, along with a stub of the
+CAmkES parser and fake make, repo and qemu executables, so that the
+benchmarks run offline without a seL4 build system:
+
+    python benchmarks/synthetic.py /tmp/project --components 200 --procedures 50 --depth 20
+"""
+
+import os
+import sys
+import stat
+import random
+import argparse
+
+PROJECT_NAME = "bench"
+
+# The stub parser resolves imports the way the real one does, reading and
+# parsing each imported file again for every file importing it, so that
+# import resolution costs what it does in a real project.
+STUB_PARSER = r'''
+import os
+import re
+from . import ast as _ast
+
+class exception:
+    class ParseError(Exception):
+        pass
+
+IMPORT = re.compile(r'^\s*import\s+("([^"]+)"|<([^>]+)>)\s*;', re.MULTILINE)
+PROCEDURE = re.compile(r'procedure\s+(\w+)\s*\{([^}]*)\}')
+METHOD = re.compile(r'(\w+)\s+(\w+)\s*\(([^)]*)\)\s*;')
+COMPONENT = re.compile(r'component\s+(\w+)\s*\{([^}]*)\}')
+INTERFACE = re.compile(r'(provides|uses|emits|consumes|dataport)\s+(\w+)\s+(\w+)\s*;')
+
+def resolve(string, import_path, seen):
+    def include(match):
+        name = match.group(2) or match.group(3)
+        for directory in ([""] if os.path.isabs(name) else import_path):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                path = os.path.realpath(path)
+                if path in seen:
+                    return ""
+                seen.add(path)
+                with open(path) as f:
+                    return resolve(f.read(), [os.path.dirname(path)] + import_path, seen)
+        raise exception.ParseError("Failed to find import %s" % name)
+    return IMPORT.sub(include, string)
+
+def parse_string(string, opts):
+    if "SYNTAX_ERROR" in string:
+        raise exception.ParseError("syntax error")
+    string = resolve(string, list(opts.import_path), set())
+
+    class Result:
+        pass
+    result = Result()
+    result.items = []
+    for match in PROCEDURE.finditer(string):
+        methods = [_ast.Method(m.group(2), m.group(1), m.group(3)) for m in METHOD.finditer(match.group(2))]
+        result.items.append(_ast.Procedure(match.group(1), methods))
+    for match in COMPONENT.finditer(string):
+        component = _ast.Component(match.group(1))
+        for (keyword, typ, name) in INTERFACE.findall(match.group(2)):
+            getattr(component, _ast.ATTRIBUTES[keyword]).append(_ast.Interface(typ, name))
+        result.items.append(component)
+    return result, None
+'''
+
+STUB_AST = r'''
+ATTRIBUTES = {"provides": "provides", "uses": "uses", "emits": "emits",
+              "consumes": "consumes", "dataport": "dataports"}
+
+class exception:
+    class ASTError(Exception):
+        pass
+
+class Reference(object):
+    def __init__(self, name):
+        self.name = name
+
+class Parameter(object):
+    def __init__(self, declaration):
+        fields = declaration.split()
+        self.direction = fields[0] if len(fields) > 2 else None
+        self.type = Reference(fields[-2] if len(fields) > 1 else fields[0])
+        self.name = fields[-1]
+
+class Method(object):
+    def __init__(self, name, return_type, parameters):
+        self.name = name
+        self.return_type = None if return_type == "void" else Reference(return_type)
+        self.parameters = [Parameter(p) for p in parameters.split(",") if p.strip() not in ["", "void"]]
+
+class Procedure(object):
+    def __init__(self, name, methods):
+        self.name = name
+        self.methods = methods
+
+class Interface(object):
+    def __init__(self, typ, name):
+        self.type = Reference(typ)
+        self.name = name
+
+class Component(object):
+    def __init__(self, name):
+        self.name = name
+        self.control = False
+        self.hardware = False
+        for attribute in ATTRIBUTES.values():
+            setattr(self, attribute, [])
+
+class Assembly(object):
+    pass
+'''
+
+STUB_TEMPLATES = r'''
+class macros:
+    @staticmethod
+    def show_type(t):
+        return getattr(t, "name", str(t))
+'''
+
+FAKE_MAKE = r'''#!/bin/sh
+# fake make: make -C DIR [targets]. Building writes images of
+# FAKE_IMAGE_SIZE bytes into DIR/images.
+DIR=.
+TARGETS=
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -C) DIR=$2; shift 2;;
+        --jobs|-j) shift 2;;
+        -*|*=*) shift;;
+        *) TARGETS="$TARGETS $1"; shift;;
+    esac
+done
+if [ -z "$TARGETS" ]; then
+    mkdir -p "$DIR/images" "$DIR/build"
+    head -c ${FAKE_IMAGE_SIZE:-1048576} /dev/urandom > "$DIR/images/capdl-loader-experimental-image-ia32-pc99"
+    head -c ${FAKE_IMAGE_SIZE:-1048576} /dev/zero > "$DIR/images/kernel-ia32-pc99"
+fi
+exit 0
+'''
+
+FAKE_REPO = r'''#!/bin/sh
+# fake repo: init and sync create an empty checkout
+case "$1" in
+    init) mkdir -p .repo && echo "<manifest/>" > .repo/manifest.xml;;
+    sync) mkdir -p apps kernel/.git tools/camkes/.git
+          printf 'kernel\ntools/camkes\n' > .repo/project.list
+          for p in kernel tools/camkes; do echo 0000000000000000000000000000000000000000 > $p/.git/HEAD; done;;
+esac
+exit 0
+'''
+
+FAKE_QEMU = r'''#!/bin/sh
+# fake qemu: prints FAKE_QEMU_LINES lines of boot output, then the
+# FAKE_QEMU_PASS line
+i=0
+while [ $i -lt ${FAKE_QEMU_LINES:-100} ]; do
+    echo "boot message $i"
+    i=$((i + 1))
+done
+echo "${FAKE_QEMU_PASS:-All tests passed}"
+exit 0
+'''
+
+def write(path, content, executable=False):
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+    with open(path, 'w') as f:
+        f.write(content)
+    if executable:
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+def procedure_source(name, methods):
+    return "procedure %s {\n%s}\n" % (name, "".join(
+        "    int %s_%d(in int a, in int b);\n" % (name.lower(), i) for i in range(methods)))
+
+def install_stub_camkes(directory):
+    """Install a stub of the CAmkES parser where the CLI looks for it."""
+    camkes_path = os.path.join(directory, "sel4", "tools", "camkes")
+    write(os.path.join(camkes_path, "camkes", "__init__.py"), "")
+    write(os.path.join(camkes_path, "camkes", "parser.py"), STUB_PARSER)
+    write(os.path.join(camkes_path, "camkes", "ast.py"), STUB_AST)
+    write(os.path.join(camkes_path, "camkes", "templates.py"), STUB_TEMPLATES)
+    write(os.path.join(camkes_path, "include", "builtin", "std_connector.camkes"), "")
+
+def install_fake_tools(bin_path):
+    """Write fake make, repo and qemu executables into bin_path."""
+    write(os.path.join(bin_path, "make"), FAKE_MAKE, executable=True)
+    write(os.path.join(bin_path, "repo"), FAKE_REPO, executable=True)
+    write(os.path.join(bin_path, "qemu-system-x86_64"), FAKE_QEMU, executable=True)
+
+def config_source(options, seed=0):
+    """A .config with the given number of options, in an order depending on
+       seed, so configs with different seeds differ only textually."""
+    lines = ["CONFIG_OPTION_%d=%s" % (i, "y" if i % 3 else str(i)) for i in range(options)]
+    lines += ["# CONFIG_UNSET_%d is not set" % i for i in range(options // 10)]
+    random.Random(seed).shuffle(lines)
+    return "#\n# Automatically generated file; DO NOT EDIT.\n#\n%s\n" % "\n".join(lines)
+
+def assembly_source(components):
+    """The project's top level file, instantiating every component."""
+    return "import <std_connector.camkes>;\n%s\nassembly {\n    composition {\n%s    }\n}\n" % (
+        "".join('import "components/C%d/C%d.camkes";\n' % (i, i) for i in range(components)),
+        "".join("        component C%d c%d;\n" % (i, i) for i in range(components)))
+
+def generate_project(directory, components=100, procedures=20, depth=10, methods=4, options=1000):
+    """Generate a project in directory, with an assembly instantiating
+       every component. Every component imports the procedure it provides
+       and the head of a chain of depth files, each importing the next and
+       defining a procedure of its own. Returns the name of the deepest
+       procedure in the chain, or of the last procedure if there is no
+       chain."""
+    write(os.path.join(directory, "camkes.toml"),
+          'name = "%s"\nmanifest_url = "file:///dev/null"\nmanifest_name = "default.xml"\n' % PROJECT_NAME)
+
+    interfaces_path = os.path.join(directory, "src", "interfaces")
+    for i in range(procedures):
+        write(os.path.join(interfaces_path, "P%d.camkes" % i), procedure_source("P%d" % i, methods))
+
+    chain_path = os.path.join(interfaces_path, "chain")
+    for level in range(depth):
+        imports = 'import "L%d.camkes";\n' % (level + 1) if level + 1 < depth else ""
+        write(os.path.join(chain_path, "L%d.camkes" % level),
+              imports + procedure_source("Chain%d" % level, methods))
+
+    for i in range(components):
+        procedure = "P%d" % (i % procedures) if procedures > 0 else None
+        imports = ['import <std_connector.camkes>;']
+        if procedure is not None:
+            imports.append('import "../../interfaces/%s.camkes";' % procedure)
+        if depth > 0:
+            imports.append('import "../../interfaces/chain/L0.camkes";')
+        interfaces = "    provides %s p;\n" % procedure if procedure is not None else ""
+        write(os.path.join(directory, "src", "components", "C%d" % i, "C%d.camkes" % i),
+              "%s\ncomponent C%d {\n    control;\n%s}\n" % ("\n".join(imports), i, interfaces))
+    write(os.path.join(directory, "src", "%s.camkes" % PROJECT_NAME), assembly_source(components))
+
+    write(os.path.join(directory, "configs", "x86"), config_source(options))
+    install_stub_camkes(directory)
+
+    if depth > 0:
+        return "Chain%d" % (depth - 1)
+    return "P%d" % (procedures - 1) if procedures > 0 else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('directory')
+    parser.add_argument('--components', type=int, default=100)
+    parser.add_argument('--procedures', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=10, help="Length of the chain of imports")
+    parser.add_argument('--methods', type=int, default=4, help="Methods per procedure")
+    parser.add_argument('--options', type=int, default=1000, help="Options in the generated config")
+    parser.add_argument('--tools', metavar='DIR', default=None,
+                        help="Also write fake make, repo and qemu executables into DIR")
+    args = parser.parse_args()
+
+    if os.path.exists(args.directory):
+        parser.error("%s already exists" % args.directory)
+    generate_project(args.directory, args.components, args.procedures, args.depth, args.methods, args.options)
+    if args.tools is not None:
+        install_fake_tools(args.tools)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
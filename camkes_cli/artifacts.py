@@ -0,0 +1,407 @@
+import os
+import re
+import time
+import shutil
+import socket
+import hashlib
+import tarfile
+import tempfile
+
+from . import settings
+
+ARTIFACT_CACHE_ENV_VAR = "CAMKES_CLI_ARTIFACT_CACHE"
+ARTIFACT_CACHE_SIZE_ENV_VAR = "CAMKES_CLI_ARTIFACT_CACHE_SIZE"
+
+# default size of a directory cache, in megabytes
+DEFAULT_CACHE_SIZE = 10240
+
+# changes whenever the format of artifacts changes, so old ones are missed
+ARTIFACT_VERSION = 1
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class ArtifactCacheError(Exception):
+    pass
+
+APP_EXCEPTIONS = (
+    ArtifactCacheError,
+)
+
+def cache_location():
+    """Returns the directory or http(s) URL of the artifact cache, or None
+       if it is disabled. It is enabled by the artifact_cache setting or the
+       CAMKES_CLI_ARTIFACT_CACHE environment variable."""
+    return settings.get("artifact_cache", ARTIFACT_CACHE_ENV_VAR)
+
+def cache_size():
+    """Returns the size in bytes beyond which a directory cache evicts its
+       least recently used artifacts."""
+    size = settings.get("artifact_cache_size", ARTIFACT_CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE)
+    try:
+        return int(size) * 1024 * 1024
+    except ValueError:
+        raise ArtifactCacheError("artifact_cache_size must be a number of megabytes, not %r" % size)
+
+def artifact_key(fingerprint):
+    """The key of the images built for a fingerprint: a hash of the
+       configuration, sources, instantiated templates and build system
+       revision."""
+    h = hashlib.sha256(("artifact %d\n" % ARTIFACT_VERSION).encode('utf-8'))
+    for component in sorted(fingerprint):
+        h.update(("%s %s\n" % (component, fingerprint[component])).encode('utf-8'))
+    return h.hexdigest()
+
+def check_key(key):
+    if KEY_PATTERN.match(key) is None:
+        raise ArtifactCacheError("Invalid artifact key %r" % key)
+
+class DirectoryBackend:
+    """Artifacts stored as files in a directory, which may be shared between
+       hosts over NFS. Fetching an artifact marks it as recently used, and
+       storing one evicts the least recently used artifacts once the cache
+       is bigger than max_size bytes."""
+
+    def __init__(self, path, max_size):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = max_size
+
+    def describe(self):
+        return self.path
+
+    def artifact_path(self, key):
+        check_key(key)
+        return os.path.join(self.path, key[:2], "%s.tar.gz" % key)
+
+    def fetch(self, key, dest_path):
+        """Copy the artifact to dest_path. Returns False if it isn't cached."""
+        path = self.artifact_path(key)
+        try:
+            shutil.copyfile(path, dest_path)
+        except (IOError, OSError):
+            return False
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, src_path):
+        path = self.artifact_path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+        # unique across hosts sharing the directory
+        tmp_path = "%s.%s.%d.tmp" % (path, socket.gethostname(), os.getpid())
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise ArtifactCacheError("Failed to store artifact in %s: %s" % (self.path, e))
+        self.evict()
+
+    def entries(self):
+        """Returns the key, size and last use of each artifact, least
+           recently used first."""
+        entries = []
+        for (path, _, files) in os.walk(self.path):
+            for f in files:
+                if not f.endswith(".tar.gz"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(path, f))
+                except OSError:
+                    continue
+                entries.append((f[:-len(".tar.gz")], st.st_size, st.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_size=None):
+        """Delete the least recently used artifacts until the cache fits in
+           max_size bytes. Returns the keys deleted."""
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        evicted = []
+        for (key, size, _) in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(self.artifact_path(key))
+            except OSError:
+                continue
+            total -= size
+            evicted.append(key)
+        return evicted
+
+class HttpBackend:
+    """Artifacts stored on an HTTP server, fetched with GET and stored with
+       PUT at <url>/<key>.tar.gz. Eviction is left to the server, such as
+       the one run by camkes-cli artifacts serve."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def describe(self):
+        return self.url
+
+    def artifact_url(self, key):
+        check_key(key)
+        return "%s/%s.tar.gz" % (self.url, key)
+
+    def fetch(self, key, dest_path):
+        (urlopen, Request, HTTPError, URLError) = urllib_module()
+        try:
+            response = urlopen(self.artifact_url(key))
+        except HTTPError as e:
+            if e.code == 404:
+                return False
+            raise ArtifactCacheError("Failed to fetch artifact from %s: %s" % (self.url, e))
+        except (URLError, socket.error) as e:
+            raise ArtifactCacheError("Failed to fetch artifact from %s: %s" % (self.url, e))
+
+        try:
+            with open(dest_path, 'wb') as f:
+                shutil.copyfileobj(response, f)
+        except (IOError, OSError, socket.error) as e:
+            raise ArtifactCacheError("Failed to fetch artifact from %s: %s" % (self.url, e))
+        finally:
+            response.close()
+        return True
+
+    def store(self, key, src_path):
+        """Upload the artifact, streamed from its file rather than read
+           into memory."""
+        (urlopen, Request, HTTPError, URLError) = urllib_module()
+        try:
+            with open(src_path, 'rb') as f:
+                request = Request(self.artifact_url(key), data=f,
+                                  headers={"Content-Type": "application/octet-stream",
+                                           "Content-Length": str(os.fstat(f.fileno()).st_size)})
+                request.get_method = lambda: "PUT"
+                urlopen(request).close()
+        except (HTTPError, URLError, IOError, OSError, socket.error) as e:
+            raise ArtifactCacheError("Failed to store artifact on %s: %s" % (self.url, e))
+
+def urllib_module():
+    try:
+        from urllib.request import urlopen, Request
+        from urllib.error import HTTPError, URLError
+    except ImportError:
+        from urllib2 import urlopen, Request, HTTPError, URLError
+    return (urlopen, Request, HTTPError, URLError)
+
+def make_backend(location):
+    if location.startswith("http://") or location.startswith("https://"):
+        return HttpBackend(location)
+    return DirectoryBackend(location, cache_size())
+
+def open_cache():
+    """Returns the backend of the artifact cache, or None if it's disabled."""
+    location = cache_location()
+    if location is None:
+        return None
+    return make_backend(location)
+
+def pack(directory, path):
+    """Archive the images in directory."""
+    with tarfile.open(path, "w:gz") as archive:
+        for f in sorted(os.listdir(directory)):
+            archive.add(os.path.join(directory, f), arcname=f)
+
+def unpack(path, directory):
+    """Extract an archive of images into directory. Only plain files at the
+       top of the archive are extracted."""
+    try:
+        with tarfile.open(path, "r:gz") as archive:
+            for member in archive.getmembers():
+                if not member.isfile() or os.path.basename(member.name) != member.name or \
+                        member.name in ["", ".", ".."]:
+                    raise ArtifactCacheError("Unexpected entry %s in artifact" % member.name)
+                with open(os.path.join(directory, member.name), 'wb') as f:
+                    shutil.copyfileobj(archive.extractfile(member), f)
+                os.chmod(os.path.join(directory, member.name), member.mode & 0o755)
+    except (tarfile.TarError, IOError, EOFError) as e:
+        raise ArtifactCacheError("Failed to extract artifact: %s" % e)
+
+def temporary_archive(context):
+    try:
+        os.makedirs(context.cache_path)
+    except OSError:
+        pass
+    (fd, archive_path) = tempfile.mkstemp(prefix="artifact.", suffix=".tar.gz", dir=context.cache_path)
+    os.close(fd)
+    return archive_path
+
+def fetch(cache, key, context, name, logger):
+    """Fetch the images of a configuration from the cache into its build
+       directory, ready to be published. Returns whether they were found."""
+    archive_path = temporary_archive(context)
+    start = time.time()
+    try:
+        if not cache.fetch(key, archive_path):
+            return False
+
+        build_images_path = context.build_images_path(name)
+        shutil.rmtree(build_images_path, ignore_errors=True)
+        os.makedirs(build_images_path)
+        unpack(archive_path, build_images_path)
+        logger.info("Fetched images for %s from %s in %.1fs (%d bytes)"
+                    % (name, cache.describe(), time.time() - start, os.path.getsize(archive_path)))
+        return True
+    finally:
+        os.remove(archive_path)
+
+def upload(cache, key, context, name, logger):
+    """Store the images published for a configuration in the cache."""
+    from . import images
+    archive_path = temporary_archive(context)
+    try:
+        try:
+            with images.reading(context, name) as directory:
+                pack(directory, archive_path)
+        except (tarfile.TarError, IOError, OSError) as e:
+            raise ArtifactCacheError("Failed to archive images for %s: %s" % (name, e))
+        cache.store(key, archive_path)
+        logger.info("Stored images for %s in %s (%d bytes)" % (name, cache.describe(),
+                                                               os.path.getsize(archive_path)))
+    finally:
+        os.remove(archive_path)
+
+def make_request_handler(backend):
+    try:
+        from http.server import BaseHTTPRequestHandler
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        """GET and PUT of artifacts at /<key>.tar.gz in a directory cache."""
+
+        def key(self):
+            name = self.path.lstrip("/")
+            if not name.endswith(".tar.gz") or KEY_PATTERN.match(name[:-len(".tar.gz")]) is None:
+                return None
+            return name[:-len(".tar.gz")]
+
+        def do_GET(self):
+            key = self.key()
+            path = backend.artifact_path(key) if key is not None else None
+            if path is None or not os.path.isfile(path):
+                self.send_error(404)
+                return
+            with open(path, 'rb') as f:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                self.end_headers()
+                shutil.copyfileobj(f, self.wfile)
+            os.utime(path, None)
+
+        def do_PUT(self):
+            key = self.key()
+            length = self.headers.get("Content-Length")
+            if key is None or length is None:
+                self.send_error(400)
+                return
+            (fd, tmp_path) = tempfile.mkstemp(dir=backend.path)
+            with os.fdopen(fd, 'wb') as f:
+                remaining = int(length)
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            try:
+                backend.store(key, tmp_path)
+            except ArtifactCacheError:
+                self.send_error(500)
+                return
+            finally:
+                os.remove(tmp_path)
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def make_server(backend, bind, port):
+    try:
+        from http.server import HTTPServer
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from BaseHTTPServer import HTTPServer
+        from SocketServer import ThreadingMixIn
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return Server((bind, port), make_request_handler(backend))
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('artifacts', description="Manage the cache of built images shared "
+                                                            "by CI runners")
+    artifacts_subparsers = parser.add_subparsers()
+
+    list_parser = artifacts_subparsers.add_parser('list', description="List cached artifacts, least "
+                                                                      "recently used first")
+    list_parser.add_argument('--path', default=None, help="Cache directory (default: the artifact_cache setting)")
+    list_parser.set_defaults(func=handle_list)
+
+    evict_parser = artifacts_subparsers.add_parser('evict', description="Evict least recently used artifacts")
+    evict_parser.add_argument('--path', default=None, help="Cache directory (default: the artifact_cache setting)")
+    evict_parser.add_argument('--max_size', type=int, default=None, metavar='MB',
+                              help="Evict until the cache fits in MB megabytes (default: artifact_cache_size)")
+    evict_parser.set_defaults(func=handle_evict)
+
+    serve_parser = artifacts_subparsers.add_parser('serve', description="Serve a cache directory over HTTP")
+    serve_parser.add_argument('path', help="Cache directory")
+    serve_parser.add_argument('--bind', default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument('--port', type=int, default=8734, help="Port to listen on (default: 8734)")
+    serve_parser.set_defaults(func=handle_serve)
+
+def directory_backend(path):
+    location = path if path is not None else cache_location()
+    if location is None:
+        raise ArtifactCacheError("The artifact cache is disabled. Enable it by setting artifact_cache in %s "
+                                 "or %s" % (settings.user_settings_path(), ARTIFACT_CACHE_ENV_VAR))
+    backend = make_backend(location)
+    if not isinstance(backend, DirectoryBackend):
+        raise ArtifactCacheError("%s is served over HTTP, manage it on the server" % location)
+    return backend
+
+def handle_list(args):
+    backend = directory_backend(args.path)
+    entries = backend.entries()
+    for (key, size, used) in entries:
+        args.logger.info("%s  %10d  %s" % (key, size, time.strftime("%Y-%m-%d %H:%M", time.localtime(used))))
+    args.logger.info("%d artifacts, %d of %d bytes" % (len(entries), sum(size for (_, size, _) in entries),
+                                                       backend.max_size))
+
+def handle_evict(args):
+    backend = directory_backend(args.path)
+    max_size = args.max_size * 1024 * 1024 if args.max_size is not None else None
+    evicted = backend.evict(max_size)
+    args.logger.info("Evicted %d artifacts" % len(evicted))
+
+def handle_serve(args):
+    backend = DirectoryBackend(args.path, cache_size())
+    try:
+        os.makedirs(backend.path)
+    except OSError:
+        pass
+    server = make_server(backend, args.bind, args.port)
+    args.logger.info("Serving artifacts in %s on http://%s:%d" % (backend.path, args.bind, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
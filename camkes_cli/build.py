@@ -1,20 +1,225 @@
-import subprocess
+import os
+import time
+import multiprocessing.pool
 
 from . import common
+from . import artifacts
 from . import clean
+from . import fingerprint
+from . import images
+from . import kconfig
+from . import lock
+from . import trace
+from . import ccache as compiler_cache
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('build', description="Build the app")
-    parser.add_argument('config', help="Name of configuration to build", type=str,
-                        choices=common.list_configs())
+    parser.add_argument('config', help="Name of configuration to build", type=common.config_name,
+                        nargs='?')
+    parser.add_argument('--all', help="Build every configuration", action='store_true')
+    parser.add_argument('--parallel', type=int, default=None,
+                        help="Number of configurations to build at once with --all "
+                             "(default: as many as --jobs allows)")
+    parser.add_argument('--fail_fast', action='store_true',
+                        help="With --all, stop building as soon as one configuration fails")
+    parser.add_argument('--ccache', action='store_true',
+                        help="Compile through ccache, with a cache shared by all projects "
+                             "(also enabled by ccache = true in camkes.toml or the user's settings)")
+    parser.add_argument('--no_artifact_cache', action='store_true',
+                        help="Neither fetch images from nor store them in the artifact cache")
     parser.set_defaults(func=handle_build)
     common.add_argument_jobs(parser)
+    common.add_argument_force(parser)
 
-def handle_build(args):
-    if common.config_changed(args.config):
-        args.__dict__['mrproper'] = False
-        clean.handle_clean(args)
+def make_environment(context, name, logger, ccache=False):
+    """Returns the environment for make, which sends compilers through
+       ccache if requested, or None for the default environment."""
+    if not (ccache or compiler_cache.requested(context)):
+        return None
+
+    if not compiler_cache.prepare(context):
+        if ccache:
+            raise common.BuildFailed("ccache was requested but isn't installed")
+        logger.warn("ccache is enabled but isn't installed, building without it")
+        return None
+
+    compiler_cache.reset_stats(context, name)
+    return compiler_cache.environment(context, name)
+
+def clean_for_config(context, name, logger, plan, jobserver=None):
+    """Clean as much of a build as its configuration changes invalidate,
+       saying which options are responsible."""
+    if len(plan.reasons(kconfig.NONE)) > 0:
+        logger.info("Options changed without needing a clean: %s" % ", ".join(plan.reasons(kconfig.NONE)))
+
+    if plan.clean == kconfig.FULL:
+        logger.info("Full clean needed for: %s" % ", ".join(plan.reasons()))
+        with trace.span("clean"):
+            clean.clean_config(context, name, jobserver=jobserver)
+    elif plan.clean == kconfig.PARTIAL:
+        with trace.span("clean"):
+            deleted = clean.clean_subtrees(context, name, plan.subtrees)
+        logger.info("Partial clean needed for: %s (deleted %s)"
+                    % (", ".join(plan.reasons()), ", ".join(os.path.relpath(path, context.config_build_path(name))
+                                                            for path in deleted) or "nothing"))
+
+def open_artifact_cache(logger):
+    """Returns the artifact cache, or None if it's disabled or can't be
+       opened, in which case configurations are built without it."""
+    try:
+        return artifacts.open_cache()
+    except artifacts.ArtifactCacheError as e:
+        logger.warn("%s, building without the artifact cache" % e)
+        return None
+
+def fetch_artifact(cache, key, context, name, logger):
+    """Publish the configuration's images from the artifact cache. Returns
+       whether they were found."""
+    try:
+        with trace.span("fetch artifact"):
+            found = artifacts.fetch(cache, key, context, name, logger)
+    except artifacts.ArtifactCacheError as e:
+        logger.warn("%s, building instead" % e)
+        return False
+    if found:
+        with trace.span("publish images"):
+            images.publish(context, name, logger)
+    return found
+
+def store_artifact(cache, key, context, name, logger):
+    try:
+        with trace.span("store artifact"):
+            artifacts.upload(cache, key, context, name, logger)
+    except artifacts.ArtifactCacheError as e:
+        logger.warn(e)
+
+def build_config(context, name, logger, jobs=None, force=False, jobserver=None, ccache=False,
+                 artifact_cache=True):
+    """Build a configuration, unless it is up to date with its last
+       successful build or its images are in the artifact cache. Returns
+       whether make was run. Other processes building the same
+       configuration are waited for, while other configurations build
+       alongside."""
+    with lock.build_lock(context, name, logger), trace.span("build %s" % name):
+        with trace.span("fingerprint"):
+            current = fingerprint.compute(context, name)
+            reasons = fingerprint.rebuild_reasons(context, name, current)
+        if len(reasons) == 0 and not force:
+            logger.info("Configuration %s is up to date" % name)
+            return False
+
+        cache = open_artifact_cache(logger) if artifact_cache else None
+        key = artifacts.artifact_key(current)
+        if cache is not None and not force and fetch_artifact(cache, key, context, name, logger):
+            fingerprint.save(context, name, current)
+            return False
+
+        logger.info("Building %s: %s" % (name, ", ".join(reasons) or "forced"))
 
-    common.load_config(args.config)
-    subprocess.call(['make', '-C', common.build_system_path(), '--jobs', str(args.jobs)])
-    common.copy_images(args.config)
+        with trace.span("compare config"):
+            plan = kconfig.clean_plan(context, name)
+        clean_for_config(context, name, logger, plan, jobserver)
+
+        common.load_config(context, name)
+        env = make_environment(context, name, logger, ccache)
+        with trace.span("make"):
+            status = common.make(context, name, jobs=jobs, jobserver=jobserver, env=env)
+        if env is not None:
+            compiler_cache.report(context, name, logger)
+        if status != 0:
+            raise common.BuildFailed("Building %s failed: make exited with status %d" % (name, status))
+
+        with trace.span("publish images"):
+            images.publish(context, name, logger)
+        fingerprint.save(context, name, current)
+        if cache is not None:
+            store_artifact(cache, key, context, name, logger)
+        return True
+
+class MatrixBuild:
+    """Builds several configurations at once. All their makes draw jobs
+       from a single jobserver, so together they never run more than the
+       given number of jobs."""
+
+    def __init__(self, context, logger, configs, jobs, parallel, force=False, fail_fast=False, ccache=False,
+                 artifact_cache=True):
+        self.context = context
+        self.logger = logger
+        self.configs = configs
+        self.parallel = max(1, min(parallel or jobs, len(configs), jobs))
+        self.jobserver = common.JobServer(jobs, self.parallel)
+        self.force = force
+        self.fail_fast = fail_fast
+        self.ccache = ccache
+        self.artifact_cache = artifact_cache
+        self.results = {}
+
+    def build_one(self, name):
+        """Build one configuration, recording its status, how long it took
+           and the error that failed it, if any."""
+        if self.jobserver.stopped:
+            self.results[name] = ("skipped", 0, None)
+            return
+
+        start = time.time()
+        error = None
+        try:
+            built = build_config(self.context, name, self.logger, force=self.force,
+                                 jobserver=self.jobserver, ccache=self.ccache,
+                                 artifact_cache=self.artifact_cache)
+            status = "built" if built else "up to date"
+        except Exception as e:
+            # any error fails only this configuration
+            if self.jobserver.stopped:
+                status = "stopped"
+            else:
+                error = str(e) or e.__class__.__name__
+                self.logger.error("%s: %s" % (name, error))
+                status = "failed"
+                if self.fail_fast:
+                    self.jobserver.stop()
+        self.results[name] = (status, time.time() - start, error)
+
+    def run(self):
+        start = time.time()
+        pool = multiprocessing.pool.ThreadPool(self.parallel)
+        try:
+            pool.map(self.build_one, self.configs)
+        finally:
+            pool.close()
+            pool.join()
+            self.jobserver.close()
+        self.elapsed = time.time() - start
+
+    def summary(self):
+        width = max(len(name) for name in self.configs)
+        self.logger.info("")
+        for name in self.configs:
+            (status, elapsed, error) = self.results[name]
+            self.logger.info("%-*s  %-10s  %7.1fs%s" % (width, name, status, elapsed,
+                                                       "  %s" % error if error is not None else ""))
+        self.logger.info("%-*s  %-10s  %7.1fs" % (width, "total", "", self.elapsed))
+
+    def failures(self):
+        return [name for name in self.configs if self.results[name][0] != "built"
+                and self.results[name][0] != "up to date"]
+
+def handle_build(args):
+    if args.all:
+        configs = sorted(common.list_configs())
+        if len(configs) == 0:
+            raise common.BuildFailed("There are no configurations to build")
+        matrix = MatrixBuild(args.context, args.logger, configs, args.jobs, args.parallel,
+                             force=args.force, fail_fast=args.fail_fast, ccache=args.ccache,
+                             artifact_cache=not args.no_artifact_cache)
+        matrix.run()
+        matrix.summary()
+        failures = matrix.failures()
+        if len(failures) > 0:
+            raise common.BuildFailed("%d of %d configurations were not built: %s"
+                                     % (len(failures), len(configs), ", ".join(failures)))
+    elif args.config is not None:
+        build_config(args.context, args.config, args.logger, args.jobs, args.force, ccache=args.ccache,
+                     artifact_cache=not args.no_artifact_cache)
+    else:
+        raise common.BuildFailed("Name a configuration to build, or use --all")
@@ -0,0 +1,117 @@
+import os
+import re
+
+from . import settings
+
+CCACHE_DIR_ENV_VAR = "CAMKES_CLI_CCACHE_DIR"
+
+# names of compilers, possibly with a cross-compiling prefix, which are
+# sent through ccache
+COMPILER_PATTERN = re.compile(r"(^|-)(gcc|g\+\+|cc|c\+\+|clang|clang\+\+)$")
+
+def requested(context):
+    """Whether the project's camkes.toml or the user's settings ask for
+       ccache."""
+    return bool(context.info.get("ccache", settings.get("ccache", default=False)))
+
+def cache_dir():
+    """The ccache directory, shared by every project of this user."""
+    return os.path.expanduser(settings.get("ccache_dir", CCACHE_DIR_ENV_VAR,
+                                           os.path.join(settings.user_cache_path(), "ccache")))
+
+def ccache_dir():
+    return "ccache"
+
+def masquerade_path(context):
+    return os.path.join(context.cache_path, ccache_dir(), "bin")
+
+def stats_log_path(context, name):
+    return os.path.join(context.cache_path, ccache_dir(), "%s.stats" % name)
+
+def find_executable(name, exclude=None):
+    for directory in os.getenv("PATH", "").split(os.pathsep):
+        path = os.path.join(directory, name)
+        if directory and directory != exclude and os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+def find_compilers(exclude):
+    compilers = set()
+    for directory in os.getenv("PATH", "").split(os.pathsep):
+        if not directory or directory == exclude or not os.path.isdir(directory):
+            continue
+        for f in os.listdir(directory):
+            if COMPILER_PATTERN.search(f):
+                compilers.add(f)
+    return compilers
+
+def prepare(context):
+    """Fill a directory with links to ccache named after each compiler on
+       the PATH, so that putting it first on the PATH sends every compiler
+       the build system runs through ccache. Returns False if ccache isn't
+       installed."""
+    bin_path = masquerade_path(context)
+    ccache = find_executable("ccache", exclude=bin_path)
+    if ccache is None:
+        return False
+
+    try:
+        os.makedirs(bin_path)
+    except OSError:
+        pass
+
+    for compiler in find_compilers(bin_path):
+        link_path = os.path.join(bin_path, compiler)
+        if os.path.islink(link_path) and os.readlink(link_path) == ccache:
+            continue
+        try:
+            os.remove(link_path)
+        except OSError:
+            pass
+        os.symlink(ccache, link_path)
+
+    return True
+
+def environment(context, name):
+    """Environment for a make of a configuration that uses ccache. Paths
+       under the project are hashed relative to the build directory, so
+       other projects with the same sources hit the same cache entries."""
+    env = dict(os.environ)
+    env["PATH"] = os.pathsep.join([masquerade_path(context), env.get("PATH", "")])
+    env["CCACHE_DIR"] = cache_dir()
+    env["CCACHE_BASEDIR"] = context.root
+    env["CCACHE_NOHASHDIR"] = "1"
+    env["CCACHE_STATSLOG"] = stats_log_path(context, name)
+    return env
+
+def reset_stats(context, name):
+    try:
+        os.remove(stats_log_path(context, name))
+    except OSError:
+        pass
+
+def read_stats(context, name):
+    """Count the hits and misses recorded in a build's ccache stats log."""
+    hits = 0
+    misses = 0
+    try:
+        with open(stats_log_path(context, name)) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#"):
+                    continue
+                if line.endswith("_hit"):
+                    hits += 1
+                elif line == "cache_miss":
+                    misses += 1
+    except (IOError, OSError):
+        pass
+    return (hits, misses)
+
+def report(context, name, logger):
+    (hits, misses) = read_stats(context, name)
+    if hits + misses == 0:
+        logger.info("ccache: no compilations recorded")
+        return
+    logger.info("ccache: %d hits, %d misses (%.1f%% hit rate)"
+                % (hits, misses, hits * 100.0 / (hits + misses)))
@@ -1,15 +1,45 @@
-import subprocess
+import os
+import glob
+import shutil
 
 from . import common
+from . import fingerprint
+from . import lock
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('clean', description="Delete generated object and binary files")
+    parser.add_argument('config', help="Name of configuration to clean (default: all)", type=str,
+                        nargs='?')
     parser.add_argument('--mrproper', action='store_true')
     parser.set_defaults(func=handle_clean)
 
+def clean_config(context, name, mrproper=False, jobserver=None):
+    # the next build can't be skipped as up to date
+    fingerprint.remove(context, name)
+    build_path = context.config_build_path(name)
+    if os.path.isdir(build_path):
+        common.make(context, name, ['mrproper' if mrproper else 'clean'], jobserver=jobserver)
+
+def clean_subtrees(context, name, subtrees):
+    """Delete parts of a configuration's build directory, given as glob
+       patterns relative to it. Returns the paths deleted."""
+    build_path = context.config_build_path(name)
+    deleted = []
+    for subtree in subtrees:
+        for path in sorted(glob.glob(os.path.join(build_path, subtree))):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            deleted.append(path)
+    return deleted
+
 def handle_clean(args):
-    if args.mrproper:
-        subprocess.call(['make', '-C', common.build_system_path(), 'mrproper'])
+    if args.config is None:
+        configs = common.list_config_builds(args.context)
     else:
-        subprocess.call(['make', '-C', common.build_system_path(), 'clean'])
+        configs = [args.config]
 
+    for config in configs:
+        with lock.build_lock(args.context, config, args.logger):
+            clean_config(args.context, config, args.mrproper)
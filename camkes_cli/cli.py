@@ -2,19 +2,36 @@ import sys
 import os
 import argparse
 import logging
+import importlib
+import collections
 
 from . import common
-from . import new
-from . import init
-from . import info
-from . import menuconfig
-from . import build
-from . import clean
-from . import update
-from . import run
-from . import config
-from . import component
-from . import procedure
+from . import trace
+from . import output
+
+# Subcommands are only imported once chosen, so that each command only pays for
+# the dependencies it uses. Each is implemented by the module of the same name.
+SUBCOMMANDS = collections.OrderedDict([
+    ("new", "Create a new project"),
+    ("init", "Initialize an existing project"),
+    ("info", "Get information"),
+    ("menuconfig", "Configure build system"),
+    ("build", "Build the app"),
+    ("clean", "Delete generated object and binary files"),
+    ("update", "Update build system"),
+    ("run", "Run the app in qemu"),
+    ("test", "Boot configurations in qemu and check their output"),
+    ("watch", "Rebuild a configuration whenever its sources change"),
+    ("config", "Select a configuration"),
+    ("component", "Add a component"),
+    ("procedure", "Add an procedure"),
+    ("scaffold", "Add procedures and components from a spec file"),
+    ("serve", "Answer queries about the project from memory"),
+    ("query", "Query the project's procedures, components and imports"),
+    ("graph", "Print the graph of imports between .camkes files"),
+    ("mirror", "Manage the repo mirror cache shared by all projects"),
+    ("artifacts", "Manage the cache of built images shared by CI runners"),
+])
 
 def init_logger():
     logging.basicConfig(stream=open(os.devnull, 'w'))
@@ -28,47 +45,75 @@ def init_logger():
 
     return logger
 
-def make_parser():
+# options of the top level parser which take a value
+GLOBAL_OPTIONS_WITH_VALUES = ["--trace"]
+
+def chosen_command(argv):
+    args = iter(argv)
+    for arg in args:
+        if arg in GLOBAL_OPTIONS_WITH_VALUES:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg if arg in SUBCOMMANDS else None
+    return None
+
+def load_subcommand(command):
+    return importlib.import_module(".%s" % command, __package__)
+
+def make_parser(command=None):
     parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="Write a trace of the time spent in each phase of the command to FILE, "
+                             "in Chrome trace event format")
+    parser.add_argument('--quiet', action='store_true',
+                        help="Only show errors and progress from the build system and repo")
 
     subparsers = parser.add_subparsers()
 
-    new.make_subparser(subparsers)
-    init.make_subparser(subparsers)
-    info.make_subparser(subparsers)
-    menuconfig.make_subparser(subparsers)
-    build.make_subparser(subparsers)
-    clean.make_subparser(subparsers)
-    update.make_subparser(subparsers)
-    run.make_subparser(subparsers)
-    config.make_subparser(subparsers)
-    component.make_subparser(subparsers)
-    procedure.make_subparser(subparsers)
+    for name in SUBCOMMANDS:
+        if name == command:
+            load_subcommand(name).make_subparser(subparsers)
+        else:
+            subparsers.add_parser(name, help=SUBCOMMANDS[name])
 
     return parser
 
 APP_EXCEPTIONS = (
-    new.DirectoryExists,
     common.MissingTemplate,
-    new.TemplateParseError,
     common.RootNotFound,
     common.NoApp,
     common.MultipleApps,
     common.MultipleKernels,
     common.MissingProcedure,
-    run.UnknownArch,
-    run.MissingKernel,
+    common.BuildFailed,
 )
 
 def main():
-    parser = make_parser()
+    command = chosen_command(sys.argv[1:])
+    parser = make_parser(command)
     args = parser.parse_args(sys.argv[1:])
     args.logger = init_logger()
+    args.context = common.project_context()
+    output.configure(args.logger, args.quiet)
+
+    app_exceptions = APP_EXCEPTIONS
+    if command is not None:
+        app_exceptions += getattr(load_subcommand(command), 'APP_EXCEPTIONS', ())
+
+    tracer = trace.enable() if args.trace is not None else None
+
     try:
         if 'func' in args:
-            args.func(args)
+            with trace.span(command):
+                return args.func(args)
         else:
             parser.print_help()
 
-    except APP_EXCEPTIONS as e:
+    except app_exceptions as e:
         args.logger.error(e)
+        return 1
+
+    finally:
+        if tracer is not None:
+            tracer.write(args.trace)
+            tracer.summary(args.logger)
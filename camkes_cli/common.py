@@ -1,13 +1,16 @@
-import pdb
 import sys
 import os
 import shutil
 import subprocess
-import filecmp
 import multiprocessing
 import importlib
+import re
+import hashlib
+import argparse
+import threading
 
-import jinja2
+from . import trace
+from . import output
 
 APP_PREFIX = "capdl-loader-experimental-image-"
 KERNEL_PREFIX = "kernel-"
@@ -30,54 +33,92 @@ class MultipleKernels(Exception):
 class MissingProcedure(Exception):
     pass
 
+class BuildFailed(Exception):
+    pass
+
+ROOT_ENV_VAR = "CAMKES_CLI_ROOT"
+
 def markup_name():
     return "camkes.toml"
 
 def markup_path():
-    return os.path.join(find_root(), markup_name())
+    return project_context().markup_path
 
 def config_dir():
     return "configs"
 
 def config_path():
-    return os.path.join(find_root(), config_dir())
+    return project_context().config_path
 
 def image_dir():
     return "images"
 
 def image_path():
-    return os.path.join(find_root(), image_dir())
+    return project_context().image_path
 
 def src_dir():
     return "src"
 
 def src_path():
-    return os.path.join(find_root(), src_dir())
+    return project_context().src_path
 
 def procedure_dir():
     return "interfaces"
 
 def procedure_path():
-    return os.path.join(src_path(), procedure_dir())
+    return project_context().procedure_path
 
 def component_dir():
     return "components"
 
 def component_path():
-    return os.path.join(src_path(), component_dir())
+    return project_context().component_path
 
 def component_src_filename():
     return "main.c"
 
-def app_image_paths(config):
-    directory_path = os.path.join(image_path(), config)
-    app_candidates = [f for f in os.listdir(directory_path) if f.startswith(APP_PREFIX)]
+def cache_dir():
+    return ".camkes-cli"
+
+def cache_path():
+    return project_context().cache_path
+
+def build_system_dir():
+    return "sel4"
+
+def server_socket_name():
+    return "server.sock"
+
+# longest path a unix socket can be bound to on every supported system
+MAX_SOCKET_PATH = 100
+
+def builds_dir():
+    return "builds"
+
+# files and directories generated by the build system, which are kept
+# separately for each configuration
+BUILD_OUTPUTS = [
+    ".config",
+    ".config.old",
+    "build",
+    "stage",
+    "images",
+    "include",
+]
+
+def app_image_paths(context, config, directory_path=None):
+    """Returns the paths of the app and kernel images of a configuration,
+       from directory_path if given or else from where they're published."""
+    if directory_path is None:
+        directory_path = os.path.join(context.image_path, config)
+    candidates = os.listdir(directory_path)
+    app_candidates = [f for f in candidates if f.startswith(APP_PREFIX)]
     if len(app_candidates) == 0:
         raise NoApp("No app image found for config %s" % config)
     if len(app_candidates) > 1:
         raise MultipleApps("Multiple app images fonud for config %s" % config)
 
-    kernel_candidates = [f for f in os.listdir(directory_path) if f.startswith(KERNEL_PREFIX)]
+    kernel_candidates = [f for f in candidates if f.startswith(KERNEL_PREFIX)]
     if len(kernel_candidates) > 1:
         raise MultipleKernels("Multiple kernel images fonud for config %s" % config)
 
@@ -95,7 +136,14 @@ def find_root():
        looking for a directory containing a camkes markup file.
        Returns the path to the closest ancestor directory of the
        current directory containing such a file. Raises an
-       exception if no such directory is found."""
+       exception if no such directory is found. The search is
+       skipped if CAMKES_CLI_ROOT names the project root."""
+    override = os.getenv(ROOT_ENV_VAR)
+    if override:
+        if not os.path.exists(os.path.join(override, markup_name())):
+            raise RootNotFound("Failed to locate %s in %s=%s" % (markup_name(), ROOT_ENV_VAR, override))
+        return os.path.abspath(override)
+
     current_path = os.getcwd()
     while True:
         markup_path = os.path.join(current_path, markup_name())
@@ -109,6 +157,95 @@ def find_root():
 
     raise RootNotFound("Failed to locate %s" % markup_name())
 
+class ProjectContext(object):
+    """The project a command operates on. The root directory is located
+       on first use and remembered, so commands don't search the filesystem
+       for it every time they need a path. The project's markup file is
+       likewise parsed once."""
+
+    def __init__(self, root=None):
+        self._root = root
+        self._info = None
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = find_root()
+        return self._root
+
+    @property
+    def markup_path(self):
+        return os.path.join(self.root, markup_name())
+
+    @property
+    def config_path(self):
+        return os.path.join(self.root, config_dir())
+
+    @property
+    def image_path(self):
+        return os.path.join(self.root, image_dir())
+
+    @property
+    def src_path(self):
+        return os.path.join(self.root, src_dir())
+
+    @property
+    def procedure_path(self):
+        return os.path.join(self.src_path, procedure_dir())
+
+    @property
+    def component_path(self):
+        return os.path.join(self.src_path, component_dir())
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.root, cache_dir())
+
+    @property
+    def server_socket_path(self):
+        """The socket of the project's query server. Projects too deeply
+           nested for a socket path use one in the temporary directory."""
+        path = os.path.join(self.cache_path, server_socket_name())
+        if len(path) > MAX_SOCKET_PATH:
+            import tempfile
+            key = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+            path = os.path.join(tempfile.gettempdir(), "camkes-cli-%d" % os.getuid(), "%s.sock" % key)
+        return path
+
+    @property
+    def build_system_path(self):
+        return os.path.join(self.root, build_system_dir())
+
+    @property
+    def builds_path(self):
+        return os.path.join(self.build_system_path, builds_dir())
+
+    def config_build_path(self, name):
+        return os.path.join(self.builds_path, name)
+
+    def build_config_path(self, name):
+        return os.path.join(self.config_build_path(name), ".config")
+
+    def build_images_path(self, name):
+        return os.path.join(self.config_build_path(name), "images")
+
+    @property
+    def info(self):
+        if self._info is None:
+            import toml
+            with open(self.markup_path) as info_file:
+                self._info = toml.load(info_file)
+        return self._info
+
+_project_context = None
+
+def project_context():
+    """Returns the context shared by everything run in this invocation."""
+    global _project_context
+    if _project_context is None:
+        _project_context = ProjectContext()
+    return _project_context
+
 def base_path():
     return os.path.dirname(__file__)
 
@@ -128,76 +265,193 @@ def part_template_path():
     return os.path.join(template_path(), 'part_templates')
 
 def build_system_path():
-    return os.path.join(find_root(), "sel4")
+    return project_context().build_system_path
+
+def prepare_config_build(context, name):
+    """Make sure the configuration has a build directory of its own. It
+       mirrors the build system's directory through symlinks, except for
+       the build outputs, so that each configuration keeps its objects and
+       images between builds of other configurations."""
+    build_path = context.config_build_path(name)
+    try:
+        os.makedirs(build_path)
+    except OSError:
+        pass
+
+    entries = [entry for entry in os.listdir(context.build_system_path)
+               if entry not in BUILD_OUTPUTS and entry not in [builds_dir(), ".repo"]]
 
-def build_config_path():
-    return os.path.join(build_system_path(), ".config")
+    # remove links to anything no longer in the build system
+    for entry in os.listdir(build_path):
+        link_path = os.path.join(build_path, entry)
+        if entry not in entries and os.path.islink(link_path):
+            os.remove(link_path)
 
-def build_images_path():
-    return os.path.join(build_system_path(), "images")
+    for entry in entries:
+        link_path = os.path.join(build_path, entry)
+        target = os.path.relpath(os.path.join(context.build_system_path, entry), build_path)
+        if os.path.islink(link_path):
+            if os.readlink(link_path) == target:
+                continue
+            os.remove(link_path)
+        os.symlink(target, link_path)
+
+    return build_path
 
-def save_config(name):
+def list_config_builds(context):
     try:
-        os.makedirs(os.path.join(find_root(), "configs"))
+        return os.listdir(context.builds_path)
+    except OSError:
+        return []
+
+def save_config(context, name):
+    try:
+        os.makedirs(context.config_path)
     except OSError:
         pass
 
-    shutil.copyfile(build_config_path(), os.path.join(config_path(), name))
+    # replaced in one rename, so a concurrent build never reads half a config
+    tmp_path = os.path.join(context.config_path, ".%s.%d.tmp" % (name, os.getpid()))
+    shutil.copyfile(context.build_config_path(name), tmp_path)
+    os.rename(tmp_path, os.path.join(context.config_path, name))
 
-def config_changed(name):
-    if not os.path.exists(build_config_path()):
+def config_changed(context, name):
+    """Whether the configuration's options differ from those it was last
+       built with, ignoring comments and the order of options."""
+    if not os.path.exists(context.build_config_path(name)):
         return False
-    return not filecmp.cmp(os.path.join(config_path(), name), build_config_path())
+    from . import kconfig
+    return (kconfig.parse(os.path.join(context.config_path, name)) !=
+            kconfig.parse(context.build_config_path(name)))
 
-def load_config(name):
-    shutil.copyfile(os.path.join(config_path(), name), build_config_path())
+def load_config(context, name):
+    prepare_config_build(context, name)
+    # leave an equivalent config untouched, so make doesn't consider it changed
+    if os.path.exists(context.build_config_path(name)) and not config_changed(context, name):
+        return
+    shutil.copyfile(os.path.join(context.config_path, name), context.build_config_path(name))
 
 def list_configs():
     try:
-        return os.listdir(config_path())
-    except RootNotFound:
+        return os.listdir(project_context().config_path)
+    except (RootNotFound, OSError):
         return []
 
-def copy_images(name):
+def config_name(name):
+    """Argument type for configuration names. The project's configurations
+       are only listed once a command taking one has been chosen."""
+    configs = list_configs()
+    if name not in configs:
+        raise argparse.ArgumentTypeError("invalid choice: %r (choose from %s)"
+                                         % (name, ", ".join(repr(c) for c in sorted(configs))))
+    return name
+
+def add_argument_config(parser, help):
+    parser.add_argument('config', help=help, type=config_name)
+
+class JobServer:
+    """A GNU make jobserver through which several concurrent makes share
+       one budget of jobs. Each make runs one job on its own, and any
+       further job waits for a token from the shared pipe. The jobserver
+       also keeps track of the makes using it, so they can be stopped
+       together."""
+
+    def __init__(self, jobs, clients):
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, b'+' * max(0, jobs - clients))
+        self.lock = threading.Lock()
+        self.processes = []
+        self.stopped = False
+
+    def makeflags(self):
+        return "-j --jobserver-fds=%d,%d" % (self.read_fd, self.write_fd)
+
+    def start(self, cmd, **kwargs):
+        """Start a make using the jobserver, unless it has been stopped."""
+        env = dict(kwargs.pop("env", None) or os.environ)
+        env["MAKEFLAGS"] = " ".join(f for f in [env.get("MAKEFLAGS"), self.makeflags()] if f)
+        if sys.version_info[0] >= 3:
+            kwargs["pass_fds"] = (self.read_fd, self.write_fd)
+        else:
+            kwargs["close_fds"] = False
+
+        with self.lock:
+            if self.stopped:
+                return None
+            proc = subprocess.Popen(cmd, env=env, **kwargs)
+            self.processes.append(proc)
+            return proc
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            for proc in self.processes:
+                if proc.poll() is None:
+                    proc.terminate()
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+def make(context, name, targets=[], jobs=None, jobserver=None, env=None):
+    """Run make in a configuration's build directory and return its exit
+       status. If a jobserver is given, make takes its jobs from it rather
+       than from jobs."""
+    cmd = ['make', '-C', context.config_build_path(name)] + targets
+    log_path = output.log_path(context.cache_path, "-".join(["make", name] + targets))
+    if jobserver is None:
+        if jobs is not None:
+            cmd += ['--jobs', str(jobs)]
+        return output.run(cmd, log_path, env=env)
+
+    return output.run(cmd, log_path, start=jobserver.start, env=env)
+
+def get_code(directory, manifest_url, manifest_name, njobs, logger=None):
+    path = os.path.join(directory, "sel4")
     try:
-        os.makedirs(os.path.join(image_path(), name))
+        os.makedirs(path)
     except OSError:
         pass
 
-    for f in os.listdir(build_images_path()):
-        try:
-            os.remove(os.path.join(image_path(), name, f))
-        except OSError:
-            pass
-        shutil.move(os.path.join(build_images_path(), f),
-                    os.path.join(image_path(), name))
-
-def get_code(directory, manifest_url, manifest_name, njobs):
+    init_cmd = ['repo', 'init', '-u', manifest_url, '-m', manifest_name]
 
-    try:
-        os.makedirs(os.path.join(directory, "sel4"))
-    except OSError:
-        pass
+    # sync from the shared mirror, if there is one, rather than the network
+    from . import mirror
+    root = mirror.mirror_root()
+    if root is not None:
+        try:
+            init_cmd.append('--reference=%s' % mirror.sync_mirror(root, manifest_url, manifest_name, njobs))
+        except mirror.MirrorFailed as e:
+            if logger is not None:
+                logger.warn("%s, checking out without the mirror" % e)
 
-    cwd = os.getcwd()
-    os.chdir(os.path.join(directory, "sel4"))
-    subprocess.call(['repo', 'init', '-u', manifest_url, '-m', manifest_name])
-    subprocess.call(['repo', 'sync', '--jobs', str(njobs)])
-    os.chdir(cwd)
+    cache_path = os.path.join(directory, cache_dir())
+    output.run(init_cmd, output.log_path(cache_path, "repo-init"), cwd=path)
+    output.run(['repo', 'sync', '--jobs', str(njobs)],
+               output.log_path(cache_path, "repo-sync"), cwd=path)
 
 def init_build_system(logger, directory, info, jobs):
     logger.info("Downloading dependencies...")
-    get_code(directory, info["manifest_url"], info["manifest_name"], jobs)
+    with trace.span("sync repositories"):
+        get_code(directory, info["manifest_url"], info["manifest_name"], jobs, logger)
 
     logger.info("Instantiating build templates...")
-    instantiate_build_templates(directory, info)
+    with trace.span("instantiate build templates"):
+        (written, unchanged) = instantiate_build_templates(directory, info)
+    logger.info("Wrote %d build templates, %d unchanged" % (written, unchanged))
 
     logger.info("Creating build system symlinks...")
-    make_symlinks(directory, info)
+    with trace.span("create symlinks"):
+        make_symlinks(directory, info)
 
 def instantiate_build_templates(directory, info):
+    """Instantiate the build templates into a project. Returns the number
+       of files written and the number left unchanged."""
+    from . import render
+
     template_path = build_template_path()
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_path))
+    written = 0
+    unchanged = 0
 
     for (path, _, files) in os.walk(template_path):
         for f in files:
@@ -207,40 +461,46 @@ def instantiate_build_templates(directory, info):
                 continue
 
             rel = os.path.relpath(os.path.join(path, f), template_path)
-            dest_path = os.path.join(directory, rel)
-
-            try:
-                template = env.get_template(rel)
-            except jinja2.exceptions.TemplateNotFound:
-                raise MissingTemplate("Missing template \"%s\"" % rel)
+            if render.instantiate(template_path, rel, os.path.join(directory, rel), info):
+                written += 1
+            else:
+                unchanged += 1
 
-            try:
-                os.remove(dest_path)
-            except OSError:
-                pass
-
-            try:
-                os.makedirs(os.path.dirname(dest_path))
-            except OSError:
-                pass
-
-            with open(dest_path, 'w') as outfile:
-                outfile.write(template.render(info))
+    return (written, unchanged)
 
 def add_argument_jobs(parser):
     parser.add_argument('--jobs', type=int, help="Number of threads to use",
                         default=multiprocessing.cpu_count())
 
+def add_argument_force(parser):
+    parser.add_argument('--force', help="Build even if nothing has changed since the last build",
+                        action='store_true')
+
 def add_argument_edit(parser):
     parser.add_argument('--edit', help="Edit newly created file", action='store_true')
 
 def make_symlinks(directory, info):
     src = os.path.join(directory, 'src')
     dst = os.path.join(directory, 'sel4', 'apps')
-    cwd = os.getcwd()
-    os.chdir(dst)
-    os.symlink(os.path.relpath(src, dst), info["name"])
-    os.chdir(cwd)
+    try:
+        os.makedirs(dst)
+    except OSError:
+        pass
+
+    link_path = os.path.join(dst, info["name"])
+    target = os.path.relpath(src, dst)
+    if os.path.islink(link_path):
+        if os.readlink(link_path) == target:
+            return
+        os.remove(link_path)
+    os.symlink(target, link_path)
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
 def camkes_import_path():
     return os.path.join(camkes_module_path(), "include", "builtin")
@@ -273,46 +533,63 @@ def spawn_editor(path):
     editor = os.getenv("EDITOR", "vim")
     subprocess.call([editor, path])
 
-def find_procedure(name, logger):
+class CamkesParseError(Exception):
+    pass
+
+RELATIVE_IMPORT_PATTERN = re.compile(r'(\bimport\s+")([^"]+)(")')
+
+def absolute_imports(string, directory):
+    """Rewrite the quoted (relative) imports in a camkes source string to
+       absolute paths, so the string can be parsed without changing into
+       the directory it was read from."""
+    def absolute(match):
+        return "%s%s%s" % (match.group(1), os.path.join(directory, match.group(2)), match.group(3))
+    return RELATIVE_IMPORT_PATTERN.sub(absolute, string)
+
+def parse_source(string, import_path):
+    """Parse a string of camkes source and return two dicts, mapping the
+       names of the procedures and of the components it defines, including
+       those it imports, to their ASTs. Raises CamkesParseError if the
+       string can't be parsed."""
 
     # camkes expects options as an object
     class Opts:
-        def __init__(self, path):
-            self.import_path = [camkes_import_path(), os.path.dirname(path)]
+        def __init__(self, import_path):
+            self.import_path = import_path
 
     camkes_parser = camkes_parser_module()
     camkes_ast = camkes_ast_module()
 
-    all_procedures = set()
-
-    for path, _, files in os.walk(src_path()):
-        for filename in files:
-            if filename.endswith(".camkes"):
-                full_path = os.path.join(path, filename)
-                with open(full_path, 'r') as f:
-                    string = f.read()
-                current_path = os.getcwd()
-                os.chdir(path)
-                # add an assembly so the parser doesn't complain when parsing a file with no assembly
-                string_with_assembly = "component __{}assembly{composition{component __ __;}}%s" % string
-                try:
-                    ast, _ = camkes_parser.parse_string(string_with_assembly, Opts(full_path))
-                except (camkes_parser.exception.ParseError, camkes_ast.exception.ASTError):
-                    logger.warn("While searching for definition of procedure %s, failed to parse %s"
-                                % (name, os.path.relpath(full_path, find_root())))
-                    continue
-                except camkes_ast.exception.ASTError:
-                    logger.warn("While searching for definition of procedure %s, failed to parse %s"
-                                % (name, os.path.relpath(full_path, find_root())))
-                    continue
-
-                os.chdir(current_path)
-
-                for item in ast.items:
-                    if isinstance(item, camkes_ast.Procedure):
-                        all_procedures.add(item.name)
-                        if item.name == name:
-                            return item, full_path
-
-    raise MissingProcedure("Failed to find definition of procedure %s.\nFound procedures:\n%s"
-                           % (name, "\n".join("- %s" % name for name in sorted(all_procedures))))
+    # add an assembly so the parser doesn't complain when parsing a file with no assembly
+    string_with_assembly = "component __{}assembly{composition{component __ __;}}%s" % string
+    try:
+        ast, _ = camkes_parser.parse_string(string_with_assembly, Opts(import_path))
+    except (camkes_parser.exception.ParseError, camkes_ast.exception.ASTError) as e:
+        raise CamkesParseError(str(e))
+
+    procedures = dict((item.name, item) for item in ast.items
+                      if isinstance(item, camkes_ast.Procedure))
+    components = dict((item.name, item) for item in ast.items
+                      if isinstance(item, camkes_ast.Component) and item.name != "__")
+    return (procedures, components)
+
+def parse_definitions(full_path):
+    """Parse a .camkes file and return two dicts, mapping the names of the
+       procedures and of the components it defines to their ASTs. Raises
+       CamkesParseError if the file can't be parsed."""
+    directory = os.path.dirname(os.path.abspath(full_path))
+    with open(full_path, 'r') as f:
+        string = absolute_imports(f.read(), directory)
+    return parse_source(string, [camkes_import_path(), directory])
+
+def parse_procedures(full_path):
+    """Parse a .camkes file and return a dict mapping the name of each
+       procedure it defines to the procedure's AST. Raises
+       CamkesParseError if the file can't be parsed."""
+    return parse_definitions(full_path)[0]
+
+def find_procedure(context, name, logger, procedure_index=None):
+    if procedure_index is None:
+        from . import index
+        procedure_index = index.ProcedureIndex(context, logger)
+    return procedure_index.find(name)
@@ -1,12 +1,9 @@
-import pdb
 import os
 import argparse
-import importlib
-import sys
-
-import jinja2
 
 from . import common
+from . import index
+from . import render
 
 class Interface:
     def __init__(self, keyword, typ, name):
@@ -38,37 +35,46 @@ def make_subparser(subparsers):
     parser.add_argument('--allow_missing_procedure', action='store_true')
 
     common.add_argument_edit(parser)
+    common.add_argument_jobs(parser)
     parser.set_defaults(func=handle_component)
 
-def handle_component(args):
-    args.__dict__.setdefault("interfaces", [])
-
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(common.part_template_path()))
-    def_template = env.get_template("component.camkes")
-    src_template = env.get_template("component.c")
-    component_dir_path = os.path.join(common.component_path(), args.name)
-    component_def_path = os.path.join(component_dir_path, "%s.camkes" % args.name)
-    component_src_path = os.path.join(component_dir_path, "src", common.component_src_filename())
-
+def component_paths(context, name):
+    """Returns the paths of a component's definition and source."""
+    component_dir_path = os.path.join(context.component_path, name)
+    return (os.path.join(component_dir_path, "%s.camkes" % name),
+            os.path.join(component_dir_path, "src", common.component_src_filename()))
+
+def find_imports(context, logger, name, interfaces, procedure_index,
+                 allow_missing_procedure=False, planned_procedures={}, refresh=True):
+    """Find the procedures a component provides, attaching their ASTs to its
+       interfaces, and return the paths its definition must import.
+       planned_procedures maps the names of procedures that are about to be
+       created to their paths."""
+    component_def_path = component_paths(context, name)[0]
     imports = []
 
-    for interface in (i for i in args.interfaces if i.keyword == 'provides'):
-        try:
-            (procedure, path) = common.find_procedure(interface.type, args.logger)
-        except common.MissingProcedure as e:
-            if args.allow_missing_procedure:
-                args.logger.warn("Can't find procedure definition for %s. "
-                                 "Generated code will not compile." % args.name)
-            else:
-                raise e
-            continue
+    for interface in (i for i in interfaces if i.keyword == 'provides'):
+        if interface.type in planned_procedures:
+            path = planned_procedures[interface.type]
+        else:
+            try:
+                (procedure, path) = procedure_index.find(interface.type, refresh)
+            except common.MissingProcedure as e:
+                if allow_missing_procedure:
+                    logger.warn("Can't find procedure definition for %s. "
+                                "Generated code will not compile." % interface.type)
+                else:
+                    raise e
+                continue
+            interface.ast = procedure
 
         relpath = os.path.relpath(path, os.path.dirname(component_def_path))
-        imports.append(relpath)
+        if relpath not in imports:
+            imports.append(relpath)
 
-        #pdb.set_trace()
-        interface.ast = procedure
+    return imports
 
+def template_helpers():
     camkes_templates = common.camkes_templates_module()
 
     show_type = camkes_templates.macros.show_type
@@ -105,45 +111,51 @@ def handle_component(args):
 
         return "\n    return %s;" % value
 
-    ctx = {
-        "name": args.name,
-        "interfaces": args.interfaces,
-        "control": args.control,
-        "hardware": args.hardware,
-        "imports": imports,
+    return {
         "return_type": return_type,
         "param_string": param_string,
         "default_return": default_return,
     }
 
-    if os.path.exists(component_def_path):
-        args.logger.info("Component def already exists in %s" % component_def_path)
-    else:
-        try:
-            os.makedirs(os.path.dirname(component_def_path))
-        except OSError:
-            pass
-
-        with open(component_def_path, 'w') as f:
-            f.write(def_template.render(ctx))
-            args.logger.info("Created component def for %s in %s" %
-                             (args.name, os.path.relpath(component_def_path, common.find_root())))
-
-    if os.path.exists(component_src_path):
-        args.logger.info("Component src already exists in %s" % component_src_path)
-    else:
-        try:
-            os.makedirs(os.path.dirname(component_src_path))
-        except OSError:
-            pass
-
-        with open(component_src_path, 'w') as f:
-            f.write(src_template.render(ctx))
-            args.logger.info("Created component src for %s in %s" %
-                             (args.name, os.path.relpath(component_src_path, common.find_root())))
+def render_component(context, name, interfaces, imports, control=False, hardware=False, helpers=None):
+    """Returns the paths and contents of a component's definition and source."""
+    (component_def_path, component_src_path) = component_paths(context, name)
+
+    ctx = {
+        "name": name,
+        "interfaces": interfaces,
+        "control": control,
+        "hardware": hardware,
+        "imports": imports,
+    }
+    ctx.update(helpers or template_helpers())
+
+    def_template = render.get_template(common.part_template_path(), "component.camkes")
+    src_template = render.get_template(common.part_template_path(), "component.c")
+
+    return [(component_def_path, def_template.render(ctx)),
+            (component_src_path, src_template.render(ctx))]
+
+def handle_component(args):
+    args.__dict__.setdefault("interfaces", [])
+
+    procedure_index = index.ProcedureIndex(args.context, args.logger, args.jobs)
+    imports = find_imports(args.context, args.logger, args.name, args.interfaces, procedure_index,
+                           args.allow_missing_procedure)
+
+    outputs = render_component(args.context, args.name, args.interfaces, imports,
+                               args.control, args.hardware)
+    (component_def_path, component_src_path) = [path for (path, _) in outputs]
+
+    for ((path, content), kind) in zip(outputs, ["def", "src"]):
+        if render.create(path, content):
+            args.logger.info("Created component %s for %s in %s" %
+                             (kind, args.name, os.path.relpath(path, args.context.root)))
+        else:
+            args.logger.info("Component %s already exists in %s" % (kind, path))
 
     args.logger.info("Assuming  default paths, you can import it in the top level file with:"
-                     "\n\nimport \"%s\";" % os.path.relpath(component_def_path, common.src_path()))
+                     "\n\nimport \"%s\";" % os.path.relpath(component_def_path, args.context.src_path))
 
     if args.edit:
         common.spawn_editor(component_src_path)
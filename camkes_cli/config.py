@@ -1,12 +1,13 @@
 import subprocess
 
 from . import common
+from . import lock
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('config', description="Select a configuration")
-    parser.add_argument('config', help="Name to associate with configuration", type=str,
-                        choices=common.list_configs())
+    common.add_argument_config(parser, "Name to associate with configuration")
     parser.set_defaults(func=handle_config)
 
 def handle_config(args):
-    common.load_config(args.config)
+    with lock.build_lock(args.context, args.config, args.logger):
+        common.load_config(args.context, args.config)
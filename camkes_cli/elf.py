@@ -0,0 +1,193 @@
+import os
+import mmap
+import struct
+import contextlib
+import collections
+
+# e_machine values from the ELF specification
+EM_386 = 3
+EM_ARM = 40
+EM_X86_64 = 62
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+
+STT_OBJECT = 1
+STT_FUNC = 2
+
+STB_LOCAL = 0
+
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+ELF_MAGIC = b'\x7fELF'
+CPIO_MAGIC = b'070701'
+CPIO_TRAILER = "TRAILER!!!"
+AR_MAGIC = b'!<arch>\n'
+
+# (header after e_ident, section header, symbol) formats for each ELF class
+ELF_FORMATS = {
+    1: ("HHIIIIIHHHHHH", "IIIIIIIIII", "IIIBBH"),
+    2: ("HHIQQQIHHHHHH", "IIQQQQIIQQ", "IBBHQQ"),
+}
+
+Section = collections.namedtuple("Section", "name type flags addr offset size")
+
+Symbol = collections.namedtuple("Symbol", "name value size type binding shndx")
+
+class InvalidElf(Exception):
+    pass
+
+def is_elf(data, base=0):
+    return data[base:base + 4] == ELF_MAGIC
+
+def read_machine(path):
+    """Returns the e_machine field of an ELF file, reading only its header."""
+    with open(path, 'rb') as f:
+        ident = f.read(20)
+    if len(ident) < 20 or not is_elf(ident):
+        raise InvalidElf("%s is not an ELF file" % path)
+    return struct.unpack_from("<H" if ident[5:6] == b'\x01' else ">H", ident, 18)[0]
+
+@contextlib.contextmanager
+def mapped(path):
+    """Map a file read-only into memory."""
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            data.close()
+
+def c_string(data, offset):
+    end = data.find(b'\0', offset)
+    return data[offset:end].decode('utf-8', 'replace')
+
+class ElfFile:
+    """Reads the section and symbol tables of an ELF file in a buffer, such
+       as a memory-mapped file, starting at offset base. Only the tables are
+       read; section contents are never copied."""
+
+    def __init__(self, data, base=0):
+        if not is_elf(data, base):
+            raise InvalidElf("Not an ELF file")
+
+        elf_class = struct.unpack_from("B", data, base + 4)[0]
+        if elf_class not in ELF_FORMATS:
+            raise InvalidElf("Unknown ELF class %d" % elf_class)
+        endian = "<" if struct.unpack_from("B", data, base + 5)[0] == 1 else ">"
+        (header, section, symbol) = ELF_FORMATS[elf_class]
+
+        self.data = data
+        self.base = base
+        self.elf_class = elf_class
+        self.section_format = endian + section
+        self.symbol_format = endian + symbol
+
+        fields = struct.unpack_from(endian + header, data, base + 16)
+        self.machine = fields[1]
+        self.shoff = fields[5]
+        self.shentsize = fields[10]
+        self.shnum = fields[11]
+        self.shstrndx = fields[12]
+        self._sections = None
+
+    def raw_section(self, index):
+        # name, type, flags, addr, offset, size and link
+        return struct.unpack_from(self.section_format, self.data,
+                                  self.base + self.shoff + index * self.shentsize)[:7]
+
+    def sections(self):
+        if self._sections is None:
+            raw = [self.raw_section(i) for i in range(self.shnum)]
+            strtab_offset = self.base + raw[self.shstrndx][4] if self.shstrndx < len(raw) else None
+            self._sections = []
+            for (name, typ, flags, addr, offset, size, _) in raw:
+                name = c_string(self.data, strtab_offset + name) if strtab_offset is not None else ""
+                self._sections.append(Section(name, typ, flags, addr, offset, size))
+        return self._sections
+
+    def symbols(self):
+        """Yields the entries of the symbol table."""
+        entry_size = struct.calcsize(self.symbol_format)
+        for i in range(self.shnum):
+            (_, typ, _, _, offset, size, link) = self.raw_section(i)
+            if typ != SHT_SYMTAB:
+                continue
+
+            strtab_offset = self.base + self.raw_section(link)[4]
+            for entry in range(self.base + offset, self.base + offset + size, entry_size):
+                fields = struct.unpack_from(self.symbol_format, self.data, entry)
+                if self.elf_class == 1:
+                    (name, value, sym_size, info, _, shndx) = fields
+                else:
+                    (name, info, _, shndx, value, sym_size) = fields
+                yield Symbol(c_string(self.data, strtab_offset + name), value, sym_size,
+                             info & 0xf, info >> 4, shndx)
+
+    def file_offset(self, section, addr):
+        return self.base + section.offset + (addr - section.addr)
+
+def section_kind(section):
+    """Classifies an allocated section as text, data or bss, in the same
+       way as size(1): read-only data counts as text."""
+    if not section.flags & SHF_ALLOC:
+        return None
+    if section.type == SHT_NOBITS:
+        return "bss"
+    if section.flags & SHF_WRITE:
+        return "data"
+    return "text"
+
+def cpio_entries(data, offset, end=None):
+    """Yields the name, data offset and size of each file in a newc cpio
+       archive starting at offset."""
+    if end is None:
+        end = len(data)
+
+    while offset + 110 <= end and data[offset:offset + 6] == CPIO_MAGIC:
+        fields = [int(data[offset + 6 + 8 * i:offset + 14 + 8 * i], 16) for i in range(13)]
+        (file_size, name_size) = (fields[6], fields[11])
+        name = data[offset + 110:offset + 110 + name_size - 1].decode('utf-8', 'replace')
+        if name == CPIO_TRAILER:
+            return
+        data_offset = (offset + 110 + name_size + 3) & ~3
+        yield (name, data_offset, file_size)
+        offset = (data_offset + file_size + 3) & ~3
+
+def archive_symbols(path):
+    """Returns the names of the symbols defined by the members of an ar
+       archive, read from the archive's symbol index."""
+    if os.path.getsize(path) < len(AR_MAGIC):
+        return []
+
+    with mapped(path) as data:
+        if data[:8] != AR_MAGIC or len(data) < 68:
+            return []
+
+        # the index, if there is one, is the first member
+        name = data[8:24].decode('ascii', 'replace').strip()
+        size = int(data[56:66].decode('ascii').strip())
+        if name not in ["/", "/SYM64/"]:
+            return []
+
+        word = 8 if name == "/SYM64/" else 4
+        fmt = ">Q" if word == 8 else ">I"
+        count = struct.unpack_from(fmt, data, 68)[0]
+        names = data[68 + word * (count + 1):68 + size].split(b'\0')
+        return [n.decode('utf-8', 'replace') for n in names[:count]]
+
+def library_symbols(directory):
+    """Maps each symbol defined by a static library under a directory to
+       the name of that library."""
+    owners = {}
+    for (path, dirs, files) in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith(".a"):
+                for symbol in archive_symbols(os.path.join(path, f)):
+                    owners.setdefault(symbol, f[:-2])
+    return owners
@@ -0,0 +1,149 @@
+import os
+import json
+import hashlib
+
+from . import common
+from . import kconfig
+
+# components of a fingerprint, and how to describe a change in each
+COMPONENTS = [
+    ("config", "configuration changed"),
+    ("sources", "sources changed"),
+    ("templates", "build templates changed"),
+    ("revision", "build system revision changed"),
+]
+
+def fingerprint_dir():
+    return "fingerprints"
+
+def fingerprint_path(context, name):
+    return os.path.join(context.cache_path, fingerprint_dir(), "%s.json" % name)
+
+def tree_hash(directory):
+    """Hash of the names and contents of all files under a directory."""
+    h = hashlib.sha256()
+    for path, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            full_path = os.path.join(path, f)
+            h.update(os.path.relpath(full_path, directory).encode('utf-8'))
+            h.update(common.file_hash(full_path).encode('utf-8'))
+    return h.hexdigest()
+
+def templates_hash(context):
+    """Hash of the files instantiated from the build templates."""
+    h = hashlib.sha256()
+    template_path = common.build_template_path()
+    for path, dirs, files in os.walk(template_path):
+        dirs.sort()
+        for f in sorted(files):
+            if f.startswith('.'):
+                continue
+            rel = os.path.relpath(os.path.join(path, f), template_path)
+            h.update(rel.encode('utf-8'))
+            try:
+                h.update(common.file_hash(os.path.join(context.root, rel)).encode('utf-8'))
+            except (IOError, OSError):
+                h.update(b"missing")
+    return h.hexdigest()
+
+def git_head(path):
+    """Returns the commit checked out in a git working tree, without
+       running git."""
+    git_dir = os.path.join(path, ".git")
+    with open(os.path.join(git_dir, "HEAD")) as f:
+        head = f.read().strip()
+    if not head.startswith("ref:"):
+        return head
+
+    ref = head[len("ref:"):].strip()
+    try:
+        with open(os.path.join(git_dir, ref)) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        pass
+
+    with open(os.path.join(git_dir, "packed-refs")) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2 and fields[1] == ref:
+                return fields[0]
+    return head
+
+def project_revisions(context):
+    """Returns a dict mapping each project in the build system to the
+       revision it has checked out."""
+    revisions = {}
+    try:
+        with open(os.path.join(context.build_system_path, ".repo", "project.list")) as f:
+            projects = [line.strip() for line in f if line.strip()]
+    except (IOError, OSError):
+        return revisions
+
+    for project in projects:
+        try:
+            revisions[project] = git_head(os.path.join(context.build_system_path, project))
+        except (IOError, OSError):
+            revisions[project] = None
+    return revisions
+
+def revision_hash(context):
+    h = hashlib.sha256()
+    for (project, revision) in sorted(project_revisions(context).items()):
+        h.update(("%s %s\n" % (project, revision)).encode('utf-8'))
+    return h.hexdigest()
+
+def compute(context, name):
+    return {
+        "config": kconfig.options_hash(os.path.join(context.config_path, name)),
+        "sources": tree_hash(context.src_path),
+        "templates": templates_hash(context),
+        "revision": revision_hash(context),
+    }
+
+def load(context, name):
+    try:
+        with open(fingerprint_path(context, name)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def save(context, name, fingerprint):
+    path = fingerprint_path(context, name)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(fingerprint, f, indent=4, sort_keys=True)
+    os.rename(tmp_path, path)
+
+def remove(context, name):
+    """Forget the configuration's last successful build, so that it is
+       built again."""
+    try:
+        os.remove(fingerprint_path(context, name))
+    except OSError:
+        pass
+
+def rebuild_reasons(context, name, fingerprint):
+    """Returns a list of reasons the configuration needs to be rebuilt,
+       which is empty if it is up to date with the last successful build."""
+    previous = load(context, name)
+    if previous is None:
+        return ["no previous successful build"]
+
+    reasons = [description for (component, description) in COMPONENTS
+               if previous.get(component) != fingerprint[component]]
+
+    if not os.path.isdir(context.config_build_path(name)):
+        reasons.append("build directory missing")
+
+    try:
+        common.app_image_paths(context, name)
+    except (OSError, common.NoApp, common.MultipleApps, common.MultipleKernels):
+        reasons.append("images missing")
+
+    return reasons
@@ -0,0 +1,192 @@
+import os
+import json
+import struct
+
+from . import common
+from . import elf
+from . import images
+
+# symbols marking the cpio archive of component images in the loader
+ARCHIVE_SYMBOLS = ["_cpio_archive", "_capdl_archive"]
+
+KINDS = ["text", "data", "bss"]
+
+LOADER_NAME = "capdl-loader"
+KERNEL_NAME = "kernel"
+
+class FootprintExceeded(Exception):
+    pass
+
+def footprint_dir():
+    return "footprints"
+
+def baseline_path(context, name):
+    return os.path.join(context.cache_path, footprint_dir(), "%s.json" % name)
+
+def sizes():
+    return dict((kind, 0) for kind in KINDS)
+
+def total(part_sizes):
+    return sum(part_sizes[kind] for kind in KINDS)
+
+def find_archive(image):
+    """Returns the section holding the cpio archive embedded in a loader
+       image, and the start and end offsets of the archive."""
+    sections = image.sections()
+    for symbol in image.symbols():
+        if symbol.name in ARCHIVE_SYMBOLS and elf.SHN_UNDEF < symbol.shndx < len(sections):
+            section = sections[symbol.shndx]
+            start = image.file_offset(section, symbol.value)
+            end = start + symbol.size if symbol.size > 0 else image.base + section.offset + section.size
+            return (section, start, end)
+
+    for section in sections:
+        start = image.base + section.offset
+        if section.type != elf.SHT_NOBITS and image.data[start:start + 6] == elf.CPIO_MAGIC:
+            return (section, start, start + section.size)
+
+    return (None, None, None)
+
+def measure(image, owners):
+    """Sizes of an image's text, data and bss, and the part of each that
+       comes from symbols defined by static libraries."""
+    sections = image.sections()
+    part = {"sizes": sizes(), "libraries": {}}
+
+    for section in sections:
+        kind = elf.section_kind(section)
+        if kind is not None:
+            part["sizes"][kind] += section.size
+
+    for symbol in image.symbols():
+        if (symbol.type not in [elf.STT_OBJECT, elf.STT_FUNC] or symbol.binding == elf.STB_LOCAL
+                or symbol.size == 0 or not elf.SHN_UNDEF < symbol.shndx < min(len(sections), elf.SHN_LORESERVE)):
+            continue
+        library = owners.get(symbol.name)
+        kind = elf.section_kind(sections[symbol.shndx])
+        if library is not None and kind is not None:
+            part["libraries"].setdefault(library, sizes())[kind] += symbol.size
+
+    return part
+
+def compute(context, name):
+    """Measure the images of a configuration. The loader's archive of
+       component images is excluded from the loader's own sizes, and each
+       component is measured separately."""
+    if not os.path.isdir(os.path.join(context.image_path, name)):
+        raise common.NoApp("No images for config %s. Build it first." % name)
+
+    # measure one published set of images, even if they're rebuilt meanwhile
+    with images.reading(context, name) as directory:
+        return measure_images(context, name, *common.app_image_paths(context, name, directory))
+
+def measure_images(context, name, app, kernel):
+    owners = elf.library_symbols(os.path.join(context.config_build_path(name), "build"))
+    parts = {}
+
+    try:
+        with elf.mapped(app) as data:
+            image = elf.ElfFile(data)
+            parts[LOADER_NAME] = measure(image, owners)
+
+            (section, start, end) = find_archive(image)
+            if section is not None:
+                parts[LOADER_NAME]["sizes"][elf.section_kind(section) or "text"] -= end - start
+                for (entry, offset, size) in elf.cpio_entries(data, start, end):
+                    if elf.is_elf(data, offset):
+                        parts[entry] = measure(elf.ElfFile(data, offset), owners)
+
+        if kernel is not None:
+            with elf.mapped(kernel) as data:
+                parts[KERNEL_NAME] = measure(elf.ElfFile(data), owners)
+    except (struct.error, IndexError, ValueError) as e:
+        raise elf.InvalidElf("Failed to read images of %s: %s" % (name, e))
+
+    return parts
+
+def load_baseline(context, name):
+    try:
+        with open(baseline_path(context, name)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def save_baseline(context, name, parts):
+    path = baseline_path(context, name)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(parts, f, indent=4, sort_keys=True)
+    os.rename(tmp_path, path)
+
+def part_order(parts):
+    fixed = [p for p in [KERNEL_NAME, LOADER_NAME] if p in parts]
+    return fixed + sorted(p for p in parts if p not in fixed)
+
+def growth(current, previous):
+    if previous == 0:
+        return 0.0 if current == 0 else float("inf")
+    return (current - previous) * 100.0 / previous
+
+def overall_sizes(parts):
+    overall = sizes()
+    for part in parts.values():
+        for kind in KINDS:
+            overall[kind] += part["sizes"][kind]
+    return overall
+
+def report(logger, parts, baseline=None):
+    names = part_order(parts)
+    width = max([len(n) for n in names] +
+                [len(l) + 2 for p in parts.values() for l in p["libraries"]] + [len("total")])
+
+    def row(label, part_sizes, previous=None):
+        line = "%-*s  %10d  %10d  %10d  %10d" % ((width, label) + tuple(part_sizes[k] for k in KINDS)
+                                                 + (total(part_sizes),))
+        if previous is not None:
+            line += "  %+9.1f%%" % growth(total(part_sizes), total(previous))
+        logger.info(line)
+
+    logger.info("%-*s  %10s  %10s  %10s  %10s%s" % (width, "image", "text", "data", "bss", "total",
+                                                   "  vs baseline" if baseline is not None else ""))
+    for name in names:
+        part = parts[name]
+        previous = baseline.get(name) if baseline is not None else None
+        row(name, part["sizes"], previous["sizes"] if previous is not None else None)
+        for library in sorted(part["libraries"]):
+            row("  " + library, part["libraries"][library])
+
+    row("total", overall_sizes(parts), overall_sizes(baseline) if baseline is not None else None)
+
+def regressions(parts, baseline, threshold):
+    """Returns the images, and the total, which grew by more than threshold
+       percent since the baseline."""
+    grown = []
+    for name in part_order(parts):
+        if name in baseline and growth(total(parts[name]["sizes"]), total(baseline[name]["sizes"])) > threshold:
+            grown.append(name)
+    if growth(total(overall_sizes(parts)), total(overall_sizes(baseline))) > threshold:
+        grown.append("total")
+    return grown
+
+def check(context, name, logger, threshold, update_baseline=False):
+    """Report the footprint of a configuration's images, and compare it to
+       the stored baseline. The first report becomes the baseline."""
+    parts = compute(context, name)
+    baseline = None if update_baseline else load_baseline(context, name)
+
+    report(logger, parts, baseline)
+
+    if baseline is None:
+        save_baseline(context, name, parts)
+        logger.info("Saved footprint baseline for %s" % name)
+        return
+
+    grown = regressions(parts, baseline, threshold)
+    if len(grown) > 0:
+        raise FootprintExceeded("Footprint grew by more than %g%% since the baseline: %s"
+                                % (threshold, ", ".join(grown)))
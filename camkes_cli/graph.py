@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+
+from . import parsing
+
+FORMATS = ["dot", "json"]
+
+def import_graph(context):
+    """Maps each .camkes file in the project, and each file they import,
+       to the files it imports, with paths relative to the project root."""
+    session = parsing.ParseSession()
+    for path in parsing.camkes_files(context.src_path):
+        session.load(path)
+    rel = lambda path: os.path.relpath(path, context.root)
+    return dict((rel(path), sorted(rel(i) for i in imports)) for (path, imports) in session.graph().items())
+
+def quote(string):
+    return '"%s"' % string.replace('\\', '\\\\').replace('"', '\\"')
+
+def format_dot(graph):
+    lines = ["digraph imports {"]
+    for path in sorted(graph):
+        lines.append("    %s;" % quote(path))
+        for imported in graph[path]:
+            lines.append("    %s -> %s;" % (quote(path), quote(imported)))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def format_json(graph):
+    return json.dumps(graph, indent=2, sort_keys=True) + "\n"
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('graph', description="Print the graph of imports between the "
+                                                        "project's .camkes files")
+    parser.add_argument('--format', choices=FORMATS, default="dot", help="Output format (default: dot)")
+    parser.add_argument('--output', metavar='FILE', default=None, help="Write the graph to FILE")
+    parser.set_defaults(func=handle_graph)
+
+def handle_graph(args):
+    graph = import_graph(args.context)
+    text = format_dot(graph) if args.format == "dot" else format_json(graph)
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        args.logger.info("Wrote graph of %d files to %s" % (len(graph), args.output))
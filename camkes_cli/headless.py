@@ -0,0 +1,116 @@
+import os
+import re
+import time
+import gzip
+import select
+import subprocess
+
+from . import output
+
+# exit statuses of a headless run
+PASSED = 0
+FAILED = 1
+EXITED = 2
+TIMED_OUT = 124
+
+# seconds qemu is given to exit after being asked to, before it is killed
+KILL_GRACE = 2
+
+def pattern(string):
+    """argparse type for regular expressions."""
+    import argparse
+    try:
+        return re.compile(string)
+    except re.error as e:
+        raise argparse.ArgumentTypeError("invalid regular expression \"%s\": %s" % (string, e))
+
+class Matcher:
+    """Matches a stream of console output line by line against success and
+       failure patterns, keeping at most a line's worth of partial input.
+       The partial line is matched too, so prompts that aren't followed by
+       a newline can be expected."""
+
+    def __init__(self, expect=None, fail=None):
+        self.expect = expect
+        self.fail = fail
+        self.partial = b''
+        self.result = None
+        self.line = None
+
+    def feed(self, chunk):
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()[-output.MAX_LINE_LENGTH:]
+        for line in lines + [self.partial]:
+            if self.match(line[:output.MAX_LINE_LENGTH]):
+                break
+        return self.result
+
+    def match(self, raw_line):
+        line = raw_line.decode('utf-8', 'replace').rstrip('\r')
+        if self.fail is not None and self.fail.search(line):
+            self.result = FAILED
+        elif self.expect is not None and self.expect.search(line):
+            self.result = PASSED
+        else:
+            return False
+        self.line = line
+        return True
+
+def stop(proc):
+    if proc.poll() is None:
+        proc.terminate()
+        deadline = time.time() + KILL_GRACE
+        while proc.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if proc.poll() is None:
+            proc.kill()
+    proc.stdout.close()
+    return proc.wait()
+
+def run(cmd, log_path, expect=None, fail=None, timeout=None, echo=None, start=subprocess.Popen):
+    """Run qemu without a terminal, streaming its console to a compressed
+       log (and to the terminal, unless echo is False), until a line
+       matches expect or fail, qemu exits, or timeout seconds pass. qemu is
+       killed if it is still running. Returns the status of the run and the
+       line that matched, or None if start declined to start qemu."""
+    with open(os.devnull, 'rb') as devnull:
+        proc = start(cmd, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if proc is None:
+        return (None, None)
+
+    matcher = Matcher(expect, fail)
+    fd = proc.stdout.fileno()
+    out = output.terminal()
+    deadline = None if timeout is None else time.time() + timeout
+    result = None
+    if echo is None:
+        echo = not output.quiet
+
+    try:
+        with gzip.open(log_path, 'wb', 1) as log:
+            while result is None:
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.time()
+                    if wait <= 0:
+                        result = TIMED_OUT
+                        break
+
+                ready, _, _ = select.select([fd], [], [], wait)
+                if not ready:
+                    continue
+                chunk = os.read(fd, 1 << 16)
+                if not chunk:
+                    break
+                log.write(chunk)
+                if echo:
+                    out.write(chunk)
+                    out.flush()
+                result = matcher.feed(chunk)
+    finally:
+        status = stop(proc)
+
+    if result is None:
+        result = PASSED if status == 0 and expect is None else EXITED
+
+    return (result, matcher.line)
@@ -0,0 +1,181 @@
+import os
+import shutil
+import stat
+import tempfile
+import contextlib
+
+from . import common
+from . import lock
+
+# FICLONE from linux/fs.h, which shares a file's extents where the
+# filesystem supports copy-on-write
+FICLONE = 0x40049409
+
+def store_dir():
+    return ".store"
+
+def versions_dir():
+    return ".versions"
+
+def clone_file(src, dst):
+    """Make dst a copy of src, sharing storage with it where possible:
+       through a hardlink, then a reflink, before falling back to copying
+       the data."""
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return
+    except (ImportError, IOError, OSError):
+        pass
+
+    shutil.copyfile(src, dst)
+
+def add_to_store(store_path, path):
+    """Move a file into the content-addressed store, unless the store
+       already holds a file with the same contents. Returns the path of
+       the file in the store and whether it was already there."""
+    stored_path = os.path.join(store_path, common.file_hash(path))
+    if os.path.exists(stored_path):
+        os.remove(path)
+        return stored_path, True
+
+    shutil.move(path, stored_path)
+    os.chmod(stored_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH |
+                          (os.stat(stored_path).st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)))
+    return stored_path, False
+
+def referenced_files(store_path, versions_path):
+    """Returns the names of the files in the store which some version of
+       images holds. A version's image is a hardlink to the file in the
+       store, or, where hardlinking wasn't possible, a copy of it, which
+       is matched by its contents."""
+    stored = {}
+    for f in os.listdir(store_path):
+        st = os.stat(os.path.join(store_path, f))
+        stored[(st.st_dev, st.st_ino)] = f
+
+    referenced = set()
+    for version in os.listdir(versions_path):
+        version_path = os.path.join(versions_path, version)
+        if not os.path.isdir(version_path):
+            continue
+        for f in os.listdir(version_path):
+            path = os.path.join(version_path, f)
+            st = os.stat(path)
+            if (st.st_dev, st.st_ino) in stored:
+                referenced.add(stored[(st.st_dev, st.st_ino)])
+            else:
+                referenced.add(common.file_hash(path))
+    return referenced
+
+def collect_garbage(store_path, versions_path):
+    """Delete files from the store that no version of images holds."""
+    referenced = referenced_files(store_path, versions_path)
+    for f in os.listdir(store_path):
+        if f not in referenced:
+            os.remove(os.path.join(store_path, f))
+
+def swap_directory(link_path, target):
+    """Atomically point link_path at target."""
+    if not os.path.islink(link_path) and os.path.isdir(link_path):
+        # images published before the store existed
+        shutil.rmtree(link_path)
+
+    tmp_path = "%s.%d.tmp" % (link_path, os.getpid())
+    os.symlink(os.path.relpath(target, os.path.dirname(link_path)), tmp_path)
+    os.rename(tmp_path, link_path)
+
+def published_versions(context):
+    """Returns the version directories images/<name> currently point to."""
+    versions = set()
+    for f in os.listdir(context.image_path):
+        link_path = os.path.join(context.image_path, f)
+        if os.path.islink(link_path):
+            versions.add(os.path.realpath(link_path))
+    return versions
+
+def remove_unused_versions(context, versions_path):
+    """Delete the versions of images which are no longer published, unless
+       they are still being read, in which case a later publish deletes
+       them."""
+    published = published_versions(context)
+    for f in os.listdir(versions_path):
+        version_path = os.path.realpath(os.path.join(versions_path, f))
+        if version_path in published:
+            continue
+        version = lock.version_lock(context, version_path)
+        if not version.acquire(blocking=False):
+            continue
+        try:
+            shutil.rmtree(version_path, ignore_errors=True)
+            version.remove()
+        finally:
+            version.release()
+
+@contextlib.contextmanager
+def reading(context, name):
+    """Yields the directory holding the images currently published for a
+       configuration. It isn't deleted until the block exits, even if newer
+       images are published in the meantime."""
+    link_path = os.path.join(context.image_path, name)
+    version = None
+    while os.path.islink(link_path):
+        directory = os.path.realpath(link_path)
+        version = lock.version_lock(context, directory, shared=True)
+        version.acquire()
+        # the images may have been replaced and deleted before we got the lock
+        if os.path.realpath(link_path) == directory and os.path.isdir(directory):
+            break
+        version.release()
+        version = None
+
+    try:
+        yield os.path.realpath(link_path)
+    finally:
+        if version is not None:
+            version.release()
+
+def publish(context, name, logger):
+    """Publish the images built for a configuration as images/<name>.
+
+       Images are moved into a content-addressed store under images/,
+       then linked into a new directory which replaces images/<name> in
+       a single rename, so a concurrent reader never sees a partially
+       published set of images. Identical images, such as a kernel shared
+       by several configurations, are only stored once. Images being read
+       through reading() are kept until their readers are done."""
+    store_path = os.path.join(context.image_path, store_dir())
+    versions_path = os.path.join(context.image_path, versions_dir())
+    for path in [store_path, versions_path]:
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+
+    with lock.store_lock(context, logger):
+        saved = publish_locked(context, name, store_path, versions_path)
+    logger.info("Published images for %s (%d bytes saved by deduplication)" % (name, saved))
+
+def publish_locked(context, name, store_path, versions_path):
+    version_path = tempfile.mkdtemp(prefix="%s." % name, dir=versions_path)
+    build_images_path = context.build_images_path(name)
+    saved = 0
+    for f in sorted(os.listdir(build_images_path)):
+        size = os.path.getsize(os.path.join(build_images_path, f))
+        stored_path, deduplicated = add_to_store(store_path, os.path.join(build_images_path, f))
+        if deduplicated:
+            saved += size
+        clone_file(stored_path, os.path.join(version_path, f))
+    os.chmod(version_path, 0o755)
+
+    swap_directory(os.path.join(context.image_path, name), version_path)
+    remove_unused_versions(context, versions_path)
+    collect_garbage(store_path, versions_path)
+    return saved
@@ -0,0 +1,226 @@
+import os
+import pickle
+import multiprocessing
+
+from . import common
+from . import parsing
+
+INDEX_VERSION = 3
+
+def index_name():
+    return "procedures.pickle"
+
+def serialize_ast(ast):
+    try:
+        return pickle.dumps(ast, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError, RuntimeError):
+        # not every camkes AST can be pickled, such entries are re-parsed on lookup
+        return None
+
+KINDS = ["procedures", "components"]
+
+def parse_serialized(full_path):
+    """Process pool worker. Returns the path, the procedures and the
+       components defined in the file with their ASTs serialized (or None
+       in their place if the file can't be parsed), and the files it
+       imports. Definitions the file only imports are left out, since its
+       entry isn't updated when the files it imports change."""
+    with open(full_path, 'r') as f:
+        source = parsing.SourceFile(full_path, f.read())
+    imports = source.imports
+    try:
+        (procedures, components) = source.own_definitions(*common.parse_definitions(full_path))
+    except common.CamkesParseError:
+        return full_path, None, None, imports
+    return (full_path,
+            dict((name, serialize_ast(ast)) for (name, ast) in procedures.items()),
+            dict((name, serialize_ast(ast)) for (name, ast) in components.items()),
+            imports)
+
+class ProcedureIndex:
+    """Persistent map from procedure and component names to the .camkes
+       files defining them, which also records the files each file imports.
+       Each file's entry is keyed on its mtime, size and content hash, so
+       only files that have changed since the index was last saved are
+       re-parsed."""
+
+    def __init__(self, context, logger, jobs=None):
+        self.context = context
+        self.logger = logger
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.root = context.root
+        self.path = os.path.join(context.cache_path, index_name())
+        self.entries = {}
+        self.order = []
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                version, entries = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return
+        if version == INDEX_VERSION:
+            self.entries = entries
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError:
+            pass
+
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((INDEX_VERSION, self.entries), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+        self.dirty = False
+
+    def camkes_files(self):
+        for path in parsing.camkes_files(self.context.src_path):
+            yield os.path.relpath(path, self.root)
+
+    def stale_files(self):
+        """Returns the files whose index entries are missing or out of date.
+           Entries whose mtime or size changed without a change in content
+           are updated in place."""
+        stale = []
+        self.order = list(self.camkes_files())
+
+        for rel in self.order:
+            st = os.stat(os.path.join(self.root, rel))
+            entry = self.entries.get(rel)
+            if entry is not None and (entry["mtime"], entry["size"]) == (st.st_mtime, st.st_size):
+                continue
+
+            digest = common.file_hash(os.path.join(self.root, rel))
+            if entry is not None and entry["hash"] == digest:
+                entry["mtime"] = st.st_mtime
+                entry["size"] = st.st_size
+                self.dirty = True
+                continue
+
+            stale.append((rel, st, digest))
+
+        for rel in set(self.entries) - set(self.order):
+            del self.entries[rel]
+            self.dirty = True
+
+        return stale
+
+    def parse(self, rel):
+        try:
+            return common.parse_definitions(os.path.join(self.root, rel))
+        except common.CamkesParseError:
+            return None
+
+    def update(self, rel, st, digest, procedures, components, imports):
+        self.entries[rel] = {
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "hash": digest,
+            "procedures": procedures,
+            "components": components,
+            "imports": [os.path.relpath(path, self.root) for path in imports],
+        }
+        self.dirty = True
+
+    def parse_session(self, details):
+        """Parse stale files together in one session, so files imported by
+           many of them are only parsed once. Returns False if they can't be
+           parsed together."""
+        session = parsing.ParseSession()
+        results = session.parse(list(details))
+        if results is None:
+            return False
+
+        for (path, (procedures, components)) in results.items():
+            self.update(*(details[path] + (
+                dict((name, serialize_ast(ast)) for (name, ast) in procedures.items()),
+                dict((name, serialize_ast(ast)) for (name, ast) in components.items()),
+                session.load(path).imports)))
+        return True
+
+    def parse_stale(self, stale, stop_at=None):
+        """Parse stale files, recording each result as it arrives. With more
+           than one job, the files are parsed one by one in parallel, and if
+           stop_at is given, outstanding work is abandoned as soon as the
+           file defining a procedure of that name is parsed. Files that only
+           import it don't count, as their results leave it out. With one
+           job, the files are parsed together in a single session, so files
+           imported by many of them are parsed once, or one by one if they
+           can't be parsed together."""
+        if len(stale) == 0:
+            return
+
+        details = dict((os.path.join(self.root, rel), (rel, st, digest)) for (rel, st, digest) in stale)
+        parallel = len(stale) > 1 and self.jobs > 1
+        if not parallel and self.parse_session(details):
+            return
+
+        if not parallel:
+            results = (parse_serialized(path) for path in details)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(min(self.jobs, len(stale)))
+            results = pool.imap_unordered(parse_serialized, details)
+
+        try:
+            for (path, procedures, components, imports) in results:
+                self.update(*(details[path] + (procedures, components, imports)))
+                if stop_at is not None and procedures is not None and stop_at in procedures:
+                    break
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def refresh(self):
+        self.parse_stale(self.stale_files())
+        self.save()
+
+    def lookup(self, rel, name, kind="procedures"):
+        blob = self.entries[rel][kind][name]
+        if blob is not None:
+            common.add_camkes_module_path()
+            return pickle.loads(blob)
+        return self.parse(rel)[KINDS.index(kind)][name]
+
+    def search(self, name, kind="procedures"):
+        """Returns the file defining name, or None if no file does."""
+        for rel in self.order:
+            if name in (self.entries.get(rel, {}).get(kind) or {}):
+                return rel
+        return None
+
+    def find(self, name, refresh=True):
+        """Returns the AST and path of the procedure called name. Pass
+           refresh=False to skip checking for changed files, when the index
+           has just been refreshed."""
+        stale = self.stale_files() if refresh else []
+        stale_files = set(rel for (rel, _, _) in stale)
+
+        rel = self.search(name)
+        if rel is None or rel in stale_files:
+            self.parse_stale(stale, stop_at=name)
+            rel = self.search(name)
+        self.save()
+
+        if rel is not None:
+            return self.lookup(rel, name), os.path.join(self.root, rel)
+
+        all_procedures = set()
+
+        for rel in self.order:
+            procedures = self.entries[rel]["procedures"]
+            if procedures is None:
+                self.logger.warn("While searching for definition of procedure %s, failed to parse %s"
+                                 % (name, rel))
+                continue
+            all_procedures.update(procedures)
+
+        raise common.MissingProcedure("Failed to find definition of procedure %s.\nFound procedures:\n%s"
+                                      % (name, "\n".join("- %s" % name for name in sorted(all_procedures))))
@@ -1,6 +1,13 @@
 import os
 
 from . import common
+from . import elf
+from . import footprint
+
+APP_EXCEPTIONS = (
+    footprint.FootprintExceeded,
+    elf.InvalidElf,
+)
 
 def list_templates():
     return os.listdir(common.base_template_path())
@@ -9,6 +16,13 @@ def make_subparser(subparsers):
     parser = subparsers.add_parser('info', description="Get information")
     parser.add_argument('--list_templates', help="List available templates",
                             action='store_true')
+    parser.add_argument('--footprint', help="Report the memory footprint of a configuration's images",
+                        type=common.config_name, default=None, metavar='CONFIG')
+    parser.add_argument('--threshold', type=float, default=5.0, metavar='PERCENT',
+                        help="With --footprint, fail if the images grew by more than PERCENT "
+                             "since the baseline (default: 5)")
+    parser.add_argument('--save_baseline', action='store_true',
+                        help="With --footprint, make this footprint the new baseline")
     parser.set_defaults(func=handle_info)
 
 def handle_info(args):
@@ -16,3 +30,6 @@ def handle_info(args):
     if args.list_templates:
         for t in os.listdir(common.app_template_path()):
             args.logger.info(t)
+
+    if args.footprint is not None:
+        footprint.check(args.context, args.footprint, args.logger, args.threshold, args.save_baseline)
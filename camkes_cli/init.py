@@ -1,6 +1,3 @@
-import multiprocessing
-import toml
-
 from . import common
 
 def make_subparser(subparsers):
@@ -9,6 +6,4 @@ def make_subparser(subparsers):
     common.add_argument_jobs(parser)
 
 def handle_init(args):
-    with open(common.markup_path()) as info_file:
-        info = toml.load(info_file)
-        common.init_build_system(args.logger, common.find_root(), info, args.jobs)
+    common.init_build_system(args.logger, args.context.root, args.context.info, args.jobs)
@@ -0,0 +1,151 @@
+import os
+import re
+import hashlib
+
+from . import common
+
+OPTION_PATTERN = re.compile(r'^(CONFIG_\w+)=(.*)$')
+UNSET_PATTERN = re.compile(r'^# (CONFIG_\w+) is not set$')
+
+FULL = "full"
+PARTIAL = "partial"
+NONE = "none"
+
+CLEANS = [NONE, PARTIAL, FULL]
+
+# How much of a build a change to an option invalidates. Each rule is an
+# option pattern, the clean it needs and, for partial cleans, the
+# sub-trees of the configuration's build directory to delete. Sub-trees
+# are glob patterns in which %(app)s is the project's name. The first
+# matching rule wins, and options matching no rule need a full clean.
+CLEAN_RULES = [
+    # selecting applications only changes what is built
+    (r"CONFIG_APP_\w+", NONE, []),
+    # camkes options only change the code generated for the application
+    (r"CONFIG_CAMKES_\w+", PARTIAL, ["build/*/*/%(app)s", "build/%(app)s"]),
+]
+
+def parse(path):
+    """Read a .config file into a dict mapping each option that is set to
+       its value. Options that are not set are left out, as are comments
+       and blank lines, so files that differ only in those or in the order
+       of their options compare equal."""
+    options = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            match = OPTION_PATTERN.match(line)
+            if match is not None:
+                (option, value) = match.groups()
+            else:
+                match = UNSET_PATTERN.match(line)
+                if match is None:
+                    continue
+                (option, value) = (match.group(1), "n")
+
+            if value == "n":
+                options.pop(option, None)
+            else:
+                options[option] = value
+    return options
+
+def options_hash(path):
+    h = hashlib.sha256()
+    for (option, value) in sorted(parse(path).items()):
+        h.update(("%s=%s\n" % (option, value)).encode('utf-8'))
+    return h.hexdigest()
+
+def diff(old, new):
+    """Returns (option, old value, new value) for each option that differs
+       between two option dicts, with None for an option that isn't set."""
+    return [(option, old.get(option), new.get(option)) for option in sorted(set(old) | set(new))
+            if old.get(option) != new.get(option)]
+
+def project_rules(context):
+    """Clean rules from the project's camkes.toml, given as
+           [[clean_rules]]
+           option = "CONFIG_MY_DRIVER_\\w+"
+           clean = "partial"
+           subtrees = ["build/*/*/libmydriver"]
+       which are tried before the default rules."""
+    rules = []
+    for rule in context.info.get("clean_rules", []):
+        if not isinstance(rule, dict) or "option" not in rule:
+            raise common.BuildFailed("Clean rules in camkes.toml need an option pattern")
+        if rule.get("clean") not in CLEANS:
+            raise common.BuildFailed("The clean rule for %s needs a clean of %s"
+                                     % (rule["option"], ", ".join(CLEANS)))
+        try:
+            re.compile("(%s)$" % rule["option"])
+        except (re.error, TypeError) as e:
+            raise common.BuildFailed("The clean rule for %s has an invalid option pattern: %s"
+                                     % (rule["option"], e))
+        subtrees = rule.get("subtrees", [])
+        if rule["clean"] == PARTIAL and not subtrees:
+            raise common.BuildFailed("The partial clean rule for %s needs subtrees" % rule["option"])
+        if not isinstance(subtrees, list):
+            raise common.BuildFailed("The subtrees of the clean rule for %s must be a list" % rule["option"])
+        for subtree in subtrees:
+            try:
+                subtree % substitutions(context)
+            except (KeyError, TypeError, ValueError):
+                raise common.BuildFailed("The clean rule for %s has an invalid subtree %r: only %%(app)s "
+                                         "may be substituted, and %% must be written %%%%"
+                                         % (rule["option"], subtree))
+        rules.append((rule["option"], rule["clean"], list(subtrees)))
+    return rules
+
+def substitutions(context):
+    """Values substituted into clean rule subtrees."""
+    return {"app": context.info.get("name", "")}
+
+def classify(option, rules):
+    """Returns the clean a change to option needs, and the sub-trees to
+       delete for a partial clean."""
+    for (pattern, clean, subtrees) in rules:
+        if re.match("(%s)$" % pattern, option):
+            return (clean, subtrees)
+    return (FULL, [])
+
+def describe(change):
+    (option, old, new) = change
+    return "%s (%s -> %s)" % (option, "unset" if old is None else old, "unset" if new is None else new)
+
+class CleanPlan:
+    """What needs to be cleaned before building a configuration whose
+       .config changed, and which option changes are responsible."""
+
+    def __init__(self):
+        self.clean = NONE
+        self.subtrees = []
+        # maps each clean to the changes needing it
+        self.changes = {}
+
+    def reasons(self, clean=None):
+        return [describe(change) for change in self.changes.get(clean or self.clean, [])]
+
+def clean_plan(context, name):
+    """Compare the configuration's saved .config with the one last built,
+       and work out how much of the build the differences invalidate."""
+    build_config_path = context.build_config_path(name)
+    if not os.path.exists(build_config_path):
+        return CleanPlan()
+
+    changes = diff(parse(build_config_path), parse(os.path.join(context.config_path, name)))
+    rules = project_rules(context) + CLEAN_RULES
+
+    plan = CleanPlan()
+    subtrees = []
+    for change in changes:
+        (clean, change_subtrees) = classify(change[0], rules)
+        plan.changes.setdefault(clean, []).append(change)
+        if CLEANS.index(clean) > CLEANS.index(plan.clean):
+            plan.clean = clean
+        for subtree in change_subtrees:
+            subtree = subtree % substitutions(context)
+            if subtree not in subtrees:
+                subtrees.append(subtree)
+
+    if plan.clean == PARTIAL:
+        plan.subtrees = subtrees
+    return plan
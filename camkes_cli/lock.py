@@ -0,0 +1,81 @@
+import os
+import fcntl
+
+def locks_dir():
+    return "locks"
+
+def lock_path(context, name):
+    return os.path.join(context.cache_path, locks_dir(), "%s.lock" % name)
+
+class Lock:
+    """An flock on a file under .camkes-cli/locks, shared between the
+       camkes-cli processes working on a project. Any number of processes
+       can hold a shared lock at once, while an exclusive lock excludes all
+       others. The lock is released if its holder dies, so a crashed
+       command never leaves the project locked."""
+
+    def __init__(self, path, shared=False, logger=None, description=None):
+        self.path = path
+        self.shared = shared
+        self.logger = logger
+        self.description = description
+        self.f = None
+
+    def acquire(self, blocking=True):
+        """Take the lock, waiting for other holders if blocking is set.
+           Returns whether the lock was taken."""
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError:
+            pass
+
+        self.f = open(self.path, 'a')
+        operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(self.f.fileno(), operation | fcntl.LOCK_NB)
+            return True
+        except (IOError, OSError):
+            if not blocking:
+                self.f.close()
+                self.f = None
+                return False
+
+        if self.logger is not None and self.description is not None:
+            self.logger.info("Waiting for another camkes-cli %s..." % self.description)
+        fcntl.flock(self.f.fileno(), operation)
+        return True
+
+    def release(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def remove(self):
+        """Delete the lock file. Only to be called by the holder of the
+           exclusive lock, once whatever it protects is gone."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def build_lock(context, name, logger=None):
+    """Held while anything writes to a configuration's build directory:
+       building, cleaning, loading or editing its config."""
+    return Lock(lock_path(context, "build-%s" % name), logger=logger,
+                description="to finish with configuration %s" % name)
+
+def store_lock(context, logger=None):
+    """Held while publishing images into the project's image store."""
+    return Lock(lock_path(context, "image-store"), logger=logger, description="to finish publishing images")
+
+def version_lock(context, version_path, shared=False):
+    """Held shared while reading a published set of images, and exclusive
+       while deleting it."""
+    return Lock(lock_path(context, "images-%s" % os.path.basename(version_path)), shared=shared)
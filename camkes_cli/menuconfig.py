@@ -1,6 +1,7 @@
 import subprocess
 
 from . import common
+from . import lock
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('menuconfig', description="Configure build system")
@@ -8,9 +9,11 @@ def make_subparser(subparsers):
     parser.set_defaults(func=handle_menuconfig)
 
 def handle_menuconfig(args):
-    try:
-        common.load_config(args.config)
-    except:
-        pass
-    subprocess.call(['make', '-C', common.build_system_path(), 'menuconfig'])
-    common.save_config(args.config)
+    with lock.build_lock(args.context, args.config, args.logger):
+        try:
+            common.load_config(args.context, args.config)
+        except:
+            pass
+        build_path = common.prepare_config_build(args.context, args.config)
+        subprocess.call(['make', '-C', build_path, 'menuconfig'])
+        common.save_config(args.context, args.config)
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import fcntl
+import contextlib
+
+from . import common
+from . import output
+from . import settings
+
+MIRROR_DIR_ENV_VAR = "CAMKES_CLI_MIRROR_DIR"
+
+class MissingMirror(Exception):
+    pass
+
+class MirrorFailed(Exception):
+    pass
+
+APP_EXCEPTIONS = (
+    MissingMirror,
+    MirrorFailed,
+)
+
+def mirror_root():
+    """Returns the directory holding the mirror cache, or None if the cache
+       is disabled. It is enabled by the mirror_dir setting or the
+       CAMKES_CLI_MIRROR_DIR environment variable."""
+    path = settings.get("mirror_dir", MIRROR_DIR_ENV_VAR)
+    if path is None:
+        return None
+    return os.path.abspath(os.path.expanduser(path))
+
+def metadata_name():
+    return "camkes-cli-mirror.json"
+
+def mirror_path(root, manifest_url, manifest_name):
+    key = hashlib.sha1(("%s\n%s" % (manifest_url, manifest_name)).encode('utf-8')).hexdigest()
+    return os.path.join(root, key[:16])
+
+def load_metadata(path):
+    try:
+        with open(os.path.join(path, metadata_name())) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def save_metadata(path, metadata):
+    tmp_path = os.path.join(path, "%s.%d.tmp" % (metadata_name(), os.getpid()))
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f, indent=4, sort_keys=True)
+    os.rename(tmp_path, os.path.join(path, metadata_name()))
+
+def list_mirrors(root):
+    mirrors = []
+    if os.path.isdir(root):
+        for entry in sorted(os.listdir(root)):
+            metadata = load_metadata(os.path.join(root, entry))
+            if metadata is not None:
+                mirrors.append((os.path.join(root, entry), metadata))
+    return mirrors
+
+@contextlib.contextmanager
+def locked(path):
+    """Serialise operations on a mirror between concurrent invocations."""
+    with open(os.path.join(path, ".lock"), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def clear(path):
+    """Delete the contents of a mirror, except for its lock file, which
+       others may be waiting on."""
+    for f in os.listdir(path):
+        if f == ".lock":
+            continue
+        full_path = os.path.join(path, f)
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            shutil.rmtree(full_path, ignore_errors=True)
+        else:
+            os.remove(full_path)
+
+def sync_mirror(root, manifest_url, manifest_name, jobs):
+    """Create or refresh the mirror of a manifest, and return its path.
+       Raises MirrorFailed if repo fails, leaving a mirror that was being
+       created empty, so the next attempt starts again from scratch."""
+    path = mirror_path(root, manifest_url, manifest_name)
+    try:
+        os.makedirs(path)
+    except OSError:
+        pass
+
+    log_cache_path = os.path.join(root, common.cache_dir())
+    with locked(path):
+        metadata = load_metadata(path)
+        created = metadata is None
+        if created:
+            clear(path)
+            status = output.run(['repo', 'init', '--mirror', '-u', manifest_url, '-m', manifest_name],
+                                output.log_path(log_cache_path, "mirror-init"), cwd=path)
+            if status != 0:
+                clear(path)
+                raise MirrorFailed("Failed to create a mirror of %s %s: repo init exited with status %d"
+                                   % (manifest_url, manifest_name, status))
+            metadata = {"manifest_url": manifest_url, "manifest_name": manifest_name}
+
+        status = output.run(['repo', 'sync', '--jobs', str(jobs)],
+                            output.log_path(log_cache_path, "mirror-sync"), cwd=path)
+        if status != 0:
+            if created:
+                clear(path)
+            raise MirrorFailed("Failed to sync the mirror of %s %s: repo sync exited with status %d"
+                               % (manifest_url, manifest_name, status))
+        metadata["refreshed"] = time.time()
+        metadata["used"] = time.time()
+        save_metadata(path, metadata)
+
+    return path
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('mirror', description="Manage the repo mirror cache shared by "
+                                                         "all projects on this host")
+    mirror_subparsers = parser.add_subparsers()
+
+    list_parser = mirror_subparsers.add_parser('list', description="List cached mirrors")
+    list_parser.set_defaults(func=handle_list)
+
+    refresh_parser = mirror_subparsers.add_parser('refresh', description="Update cached mirrors")
+    refresh_parser.add_argument('--manifest_url', type=str, default=None,
+                                help="Refresh (or create) only the mirror of this manifest")
+    refresh_parser.add_argument('--manifest_name', type=str, default=None)
+    refresh_parser.set_defaults(func=handle_refresh)
+    common.add_argument_jobs(refresh_parser)
+
+    prune_parser = mirror_subparsers.add_parser('prune', description="Delete unused mirrors")
+    prune_parser.add_argument('--days', type=float, default=30,
+                              help="Delete mirrors that haven't been used for this many days")
+    prune_parser.set_defaults(func=handle_prune)
+
+def enabled_root():
+    root = mirror_root()
+    if root is None:
+        raise MissingMirror("The mirror cache is disabled. Enable it by setting mirror_dir in %s "
+                            "or %s" % (settings.user_settings_path(), MIRROR_DIR_ENV_VAR))
+    return root
+
+def handle_list(args):
+    for (path, metadata) in list_mirrors(enabled_root()):
+        args.logger.info("%s  %s %s (last used %s)"
+                         % (os.path.basename(path), metadata["manifest_url"], metadata["manifest_name"],
+                            time.strftime("%Y-%m-%d", time.localtime(metadata.get("used", 0)))))
+
+def handle_refresh(args):
+    root = enabled_root()
+    if args.manifest_url is not None:
+        from . import defaults
+        manifests = [(args.manifest_url, args.manifest_name or defaults.CAMKES_MANIFEST_NAME)]
+    else:
+        manifests = [(m["manifest_url"], m["manifest_name"]) for (_, m) in list_mirrors(root)]
+
+    failures = 0
+    for (manifest_url, manifest_name) in manifests:
+        args.logger.info("Refreshing mirror of %s %s" % (manifest_url, manifest_name))
+        try:
+            sync_mirror(root, manifest_url, manifest_name, args.jobs)
+        except MirrorFailed as e:
+            args.logger.error(e)
+            failures += 1
+    if failures > 0:
+        raise MirrorFailed("%d of %d mirrors failed to refresh" % (failures, len(manifests)))
+
+def handle_prune(args):
+    cutoff = time.time() - args.days * 24 * 60 * 60
+    for (path, metadata) in list_mirrors(enabled_root()):
+        if metadata.get("used", 0) < cutoff:
+            args.logger.info("Deleting mirror of %s %s" % (metadata["manifest_url"], metadata["manifest_name"]))
+            with locked(path):
+                shutil.rmtree(path)
@@ -4,10 +4,11 @@ import multiprocessing
 import collections
 
 import toml
-import jinja2
 
 from . import common
 from . import defaults
+from . import render
+from . import trace
 
 class DirectoryExists(Exception):
     pass
@@ -15,6 +16,11 @@ class DirectoryExists(Exception):
 class TemplateParseError(Exception):
     pass
 
+APP_EXCEPTIONS = (
+    DirectoryExists,
+    TemplateParseError,
+)
+
 def make_skeleton(args):
     os.mkdir(args.directory)
     os.mkdir(os.path.join(args.directory, "src"))
@@ -32,38 +38,16 @@ def instantiate_base_templates(directory, info):
         "config_aarch32": "configs/aarch32",
     }
 
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(common.base_template_path()))
-
     for source in templates_destinations:
-        try:
-            template = env.get_template(source)
-        except jinja2.exceptions.TemplateNotFound:
-            raise common.MissingTemplate("Missing template \"%s\"" % source)
-
-        output = template.render(info)
-
-        dst = os.path.join(directory, templates_destinations[source])
-
-        try:
-            os.makedirs(os.path.dirname(dst))
-        except OSError:
-            pass
-
-        with open(dst, 'w') as outfile:
-            outfile.write(output)
+        render.instantiate(common.base_template_path(), source,
+                           os.path.join(directory, templates_destinations[source]), info)
 
 def instantiate_app_template(template, directory, info):
 
     template_path = os.path.join(common.app_template_path(), template)
 
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_path))
-    try:
-        top_level_template = env.get_template("app.camkes")
-    except jinja2.exceptions.TemplateNotFound:
-        raise common.MissingTemplate("Missing template \"app.camkes\"")
-
-    with open(os.path.join(directory, "src", info["name"] + ".camkes"), 'w') as outfile:
-        outfile.write(top_level_template.render(info))
+    render.instantiate(template_path, "app.camkes",
+                       os.path.join(directory, "src", info["name"] + ".camkes"), info)
 
     base_path_source = os.path.join(template_path, "src")
     base_path_destintaion = os.path.join(directory, "src")
@@ -76,18 +60,8 @@ def instantiate_app_template(template, directory, info):
                 continue
 
             rel = os.path.relpath(os.path.join(path, f), base_path_source)
-            try:
-                template = env.get_template(os.path.join("src", rel))
-            except jinja2.exceptions.TemplateNotFound:
-                raise common.MissingTemplate("Missing template \"%s\"" % rel)
-
-            destination_file = os.path.join(base_path_destintaion, rel)
-            try:
-                os.makedirs(os.path.dirname(destination_file))
-            except OSError:
-                pass
-            with open(destination_file, 'w') as outfile:
-                outfile.write(template.render(info))
+            render.instantiate(template_path, os.path.join("src", rel),
+                               os.path.join(base_path_destintaion, rel), info)
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('new', description="Create a new project")
@@ -121,11 +95,13 @@ def handle_new(args):
     make_skeleton(args)
 
     args.logger.info("Instantiating base templates...")
-    instantiate_base_templates(args.directory, info)
+    with trace.span("instantiate base templates"):
+        instantiate_base_templates(args.directory, info)
 
     if args.template is not None:
         args.logger.info("Instantiating app template...")
-        instantiate_app_template(args.template, args.directory, info)
+        with trace.span("instantiate app template"):
+            instantiate_app_template(args.template, args.directory, info)
 
     common.init_build_system(args.logger, args.directory, info, args.jobs)
 
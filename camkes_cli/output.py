@@ -0,0 +1,136 @@
+import os
+import re
+import sys
+import time
+import gzip
+import select
+import logging
+import subprocess
+
+# lines of output longer than this are truncated when scanned for errors
+MAX_LINE_LENGTH = 4096
+
+# number of error lines kept for the summary
+MAX_ERRORS = 20
+
+# number of logs kept for each project
+MAX_LOGS = 50
+
+# seconds between progress reports in quiet mode
+PROGRESS_INTERVAL = 5
+
+ERROR_PATTERN = re.compile(r"(\berror:|\bError \d+|\*\*\*|undefined reference)")
+WARNING_PATTERN = re.compile(r"\bwarning:")
+
+quiet = False
+
+logger = logging.getLogger(__name__)
+
+def configure(cli_logger, quiet_mode):
+    global logger, quiet
+    logger = cli_logger
+    quiet = quiet_mode
+
+def log_dir():
+    return "logs"
+
+def log_path(cache_path, label):
+    """Returns the path of a new log under a project's cache directory,
+       removing the oldest logs if there are too many."""
+    directory = os.path.join(cache_path, log_dir())
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+
+    logs = sorted(os.listdir(directory))
+    for f in logs[:max(0, len(logs) - MAX_LOGS + 1)]:
+        # another thread or process may have removed it already
+        try:
+            os.remove(os.path.join(directory, f))
+        except OSError:
+            pass
+
+    return os.path.join(directory, "%s-%d-%s.log.gz" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid(), label))
+
+class Summary:
+    """Scans a stream of output line by line for errors and warnings,
+       keeping at most a line's worth of partial input."""
+
+    def __init__(self):
+        self.partial = b''
+        self.lines = 0
+        self.warnings = 0
+        self.errors = []
+        self.error_count = 0
+
+    def feed(self, chunk):
+        lines = (self.partial + chunk).split(b'\n')
+        self.partial = lines.pop()[:MAX_LINE_LENGTH]
+        for line in lines:
+            self.scan(line[:MAX_LINE_LENGTH])
+
+    def close(self):
+        if self.partial:
+            self.scan(self.partial)
+            self.partial = b''
+
+    def scan(self, raw_line):
+        self.lines += 1
+        line = raw_line.decode('utf-8', 'replace').rstrip()
+        if ERROR_PATTERN.search(line):
+            self.error_count += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(line)
+                if quiet:
+                    logger.error(line)
+        elif WARNING_PATTERN.search(line):
+            self.warnings += 1
+
+def terminal():
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+def run(cmd, log_path, start=subprocess.Popen, **kwargs):
+    """Run a command, streaming its combined output to the terminal and to
+       a compressed log as it is produced, and summarise the errors and
+       warnings it reported. In quiet mode, only errors and periodic
+       progress are shown. Returns the command's exit status."""
+    proc = start(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+    if proc is None:
+        return -1
+
+    summary = Summary()
+    fd = proc.stdout.fileno()
+    out = terminal()
+    last_progress = time.time()
+
+    with gzip.open(log_path, 'wb', 1) as log:
+        while True:
+            ready, _, _ = select.select([fd], [], [], PROGRESS_INTERVAL)
+            if ready:
+                chunk = os.read(fd, 1 << 16)
+                if not chunk:
+                    break
+                log.write(chunk)
+                summary.feed(chunk)
+                if not quiet:
+                    out.write(chunk)
+                    out.flush()
+
+            if quiet and time.time() - last_progress >= PROGRESS_INTERVAL:
+                logger.info("%s: %d lines of output" % (os.path.basename(cmd[0]), summary.lines))
+                last_progress = time.time()
+
+    summary.close()
+    proc.stdout.close()
+    status = proc.wait()
+
+    if summary.error_count > 0 or summary.warnings > 0:
+        logger.info("%s reported %d errors and %d warnings" % (os.path.basename(cmd[0]),
+                                                               summary.error_count, summary.warnings))
+    if summary.error_count > 0 and not quiet:
+        logger.info("First error: %s" % summary.errors[0])
+    if status != 0 or summary.error_count > 0:
+        logger.info("Full output: %s" % log_path)
+
+    return status
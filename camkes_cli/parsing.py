@@ -0,0 +1,151 @@
+import os
+import re
+import hashlib
+
+from . import common
+
+# procedure and component definitions, but not component instances such
+# as "component Foo foo;" in an assembly's composition
+DEFINITION_PATTERN = re.compile(r'^\s*(procedure|component)\s+(\w+)\s*\{', re.MULTILINE)
+
+# whole import statements, of project files ("...") and builtin files (<...>)
+IMPORT_STATEMENT_PATTERN = re.compile(r'^[ \t]*import\s+("([^"]+)"|<[^>]+>)\s*;', re.MULTILINE)
+
+COMMENT_PATTERN = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+
+def camkes_files(directory):
+    """Yields the paths of the .camkes files under a directory."""
+    for path, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".camkes"):
+                yield os.path.join(path, filename)
+
+class SourceFile:
+    """A .camkes file, read once, with its import statements taken out so
+       that it can be parsed together with the files it imports."""
+
+    def __init__(self, path, text):
+        self.path = os.path.normpath(os.path.abspath(path))
+        self.hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.imports = []
+        self.builtin_imports = []
+        directory = os.path.dirname(self.path)
+
+        def take_import(match):
+            if match.group(2) is None:
+                self.builtin_imports.append(match.group(0).strip())
+                return ""
+            imported = os.path.normpath(os.path.join(directory, match.group(2)))
+            self.imports.append(imported)
+            if not os.path.isfile(imported):
+                # leave it for the parser to report
+                return 'import "%s";' % imported
+            return ""
+
+        self.body = IMPORT_STATEMENT_PATTERN.sub(take_import, text)
+        self.definitions = dict((name, kind + "s") for (kind, name)
+                                in DEFINITION_PATTERN.findall(COMMENT_PATTERN.sub("", self.body)))
+
+    def own_definitions(self, procedures, components):
+        """Returns the procedures and components, of those parsed from this
+           file, that it defines itself rather than imports."""
+        found = {"procedures": procedures, "components": components}
+        definitions = ({}, {})
+        for (name, kind) in self.definitions.items():
+            if name in found[kind]:
+                definitions[0 if kind == "procedures" else 1][name] = found[kind][name]
+        return definitions
+
+class ParseSession:
+    """Reads each file reachable from the files of one scan once, keyed on
+       its resolved path, and records the import graph between them. The
+       files are parsed together in a single pass, in which each unique
+       file, by path and by content, is parsed once however many files
+       import it."""
+
+    def __init__(self):
+        self.files = {}
+
+    def load(self, path):
+        """Returns the file at path, reading it and the files it imports if
+           they haven't been read yet, or None if it can't be read."""
+        key = os.path.realpath(path)
+        if key not in self.files:
+            try:
+                with open(path, 'r') as f:
+                    text = f.read()
+            except (IOError, OSError):
+                self.files[key] = None
+                return None
+
+            source = SourceFile(path, text)
+            self.files[key] = source
+            for imported in source.imports:
+                self.load(imported)
+        return self.files[key]
+
+    def graph(self):
+        """Maps the path of each file read to the paths it imports."""
+        return dict((source.path, list(source.imports)) for source in self.files.values()
+                    if source is not None)
+
+    def closure(self, paths):
+        """Returns the files at paths and everything they import, with each
+           file after the files it imports."""
+        order = []
+        visited = set()
+
+        def visit(path):
+            key = os.path.realpath(path)
+            if key in visited:
+                return
+            visited.add(key)
+            source = self.load(path)
+            if source is None:
+                return
+            for imported in source.imports:
+                visit(imported)
+            order.append(source)
+
+        for path in paths:
+            visit(path)
+        return order
+
+    def parse(self, paths):
+        """Parse the files at paths, returning a dict mapping each path to
+           the procedures and components defined in that file. Returns None
+           if the files can't be parsed together, because one of them is
+           broken or two define the same name, in which case they must be
+           parsed one by one."""
+        # copies of the same file are parsed once
+        order = []
+        hashes = set()
+        for source in self.closure(paths):
+            if source.hash not in hashes:
+                hashes.add(source.hash)
+                order.append(source)
+
+        owners = {}
+        for source in order:
+            for name in source.definitions:
+                if owners.setdefault(name, source) is not source:
+                    return None
+
+        builtin_imports = []
+        for source in order:
+            builtin_imports.extend(i for i in source.builtin_imports if i not in builtin_imports)
+        string = "\n".join(builtin_imports + [source.body for source in order])
+
+        try:
+            (procedures, components) = common.parse_source(string, [common.camkes_import_path()])
+        except common.CamkesParseError:
+            return None
+
+        results = {}
+        for path in paths:
+            source = self.load(path)
+            if source is None:
+                return None
+            results[path] = source.own_definitions(procedures, components)
+        return results
@@ -1,7 +1,7 @@
 import os
-import jinja2
 
 from . import common
+from . import render
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('procedure', description="Add an procedure")
@@ -9,30 +9,24 @@ def make_subparser(subparsers):
     parser.set_defaults(func=handle_procedure)
     common.add_argument_edit(parser)
 
-def handle_procedure(args):
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(common.part_template_path()))
-    template = env.get_template("procedure.camkes")
+def procedure_file_path(context, name):
+    return os.path.join(context.procedure_path, "%s.camkes" % name)
+
+def render_procedure(context, name):
+    """Returns the path and content of a new, empty procedure."""
+    template = render.get_template(common.part_template_path(), "procedure.camkes")
+    return (procedure_file_path(context, name), template.render({"name": name}))
 
-    procedure_file_name = "%s.camkes" % args.name
-    procedure_path = os.path.join(common.procedure_path(), procedure_file_name)
+def handle_procedure(args):
+    (procedure_path, content) = render_procedure(args.context, args.name)
 
-    if os.path.exists(procedure_path):
+    if not render.create(procedure_path, content):
         args.logger.info("Procedure already exists")
     else:
-
-        try:
-            os.makedirs(os.path.dirname(procedure_path))
-        except OSError:
-            pass
-
-        with open(procedure_path, 'w') as f:
-            procedure_string = template.render({"name": args.name})
-            f.write(procedure_string)
-
         args.logger.info("Created empty procedure in %s" % procedure_path)
         args.logger.info("Assuming default paths, you can import it in a component with:"
                          "\n\nimport \"../../%s/%s\";" %
-                         (common.procedure_dir(), procedure_file_name))
+                         (common.procedure_dir(), os.path.basename(procedure_path)))
 
     if args.edit:
         common.spawn_editor(procedure_path)
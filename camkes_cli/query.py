@@ -0,0 +1,58 @@
+import sys
+import json
+import socket
+
+QUERIES = ["procedure", "procedures", "component", "components", "imports", "graph", "status", "shutdown"]
+
+class QueryError(Exception):
+    pass
+
+APP_EXCEPTIONS = (
+    QueryError,
+)
+
+def send(path, request):
+    """Send a request to the server listening on path, and return its
+       response, or None if no server is listening."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(path)
+        except socket.error:
+            return None
+
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = client.recv(1 << 16)
+            if not chunk:
+                raise QueryError("The server closed the connection")
+            response += chunk
+        return json.loads(response.decode('utf-8'))
+    finally:
+        client.close()
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('query', description="Query the project's procedures, components "
+                                                        "and imports")
+    parser.add_argument('query', choices=QUERIES)
+    parser.add_argument('name', nargs='?', default=None,
+                        help="Name of the procedure or component, or path of the file to query")
+    parser.add_argument('--no_fallback', action='store_true',
+                        help="Fail rather than answer in this process if no server is running")
+    parser.set_defaults(func=handle_query)
+
+def handle_query(args):
+    request = {"query": args.query, "name": args.name}
+    response = send(args.context.server_socket_path, request)
+
+    if response is None:
+        if args.no_fallback or args.query == "shutdown":
+            raise QueryError("No server is running. Start one with: camkes-cli serve")
+        from . import serve
+        response = serve.Model(args.context, args.logger).handle(request)
+
+    if not response["ok"]:
+        raise QueryError(response["error"])
+
+    sys.stdout.write(json.dumps(response["result"], indent=2, sort_keys=True) + "\n")
@@ -0,0 +1,94 @@
+import os
+
+from . import common
+from . import settings
+
+# one environment per template directory, each of which keeps the templates
+# it has compiled for the rest of the invocation
+_environments = {}
+
+def bytecode_cache_path():
+    return os.path.join(settings.user_cache_path(), "jinja2")
+
+def bytecode_cache():
+    """Returns a cache of compiled templates on disk, or None if there's
+       nowhere to keep one, in which case templates are compiled every
+       time."""
+    import jinja2
+
+    cache_path = bytecode_cache_path()
+    try:
+        os.makedirs(cache_path)
+    except OSError:
+        pass
+
+    if not os.path.isdir(cache_path) or not os.access(cache_path, os.W_OK | os.X_OK):
+        return None
+    return jinja2.FileSystemBytecodeCache(cache_path)
+
+def environment(template_path):
+    """Returns the shared jinja2 environment for a template directory.
+       Compiled templates are also cached on disk where possible, so later
+       invocations don't compile them again."""
+    import jinja2
+
+    env = _environments.get(template_path)
+    if env is None:
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_path),
+                                 bytecode_cache=bytecode_cache())
+        _environments[template_path] = env
+    return env
+
+def get_template(template_path, name):
+    import jinja2
+
+    try:
+        return environment(template_path).get_template(name)
+    except jinja2.exceptions.TemplateNotFound:
+        raise common.MissingTemplate("Missing template \"%s\"" % name)
+
+def write_if_changed(path, content):
+    """Write content to a file, unless the file already holds exactly that
+       content. Returns whether the file was written. Unchanged files keep
+       their mtimes, so make doesn't rebuild anything depending on them."""
+    if not os.path.islink(path):
+        try:
+            with open(path, 'r') as f:
+                if f.read() == content:
+                    return False
+        except (IOError, OSError):
+            pass
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+    return True
+
+def create(path, content):
+    """Write a new file, leaving any existing file alone. Returns whether
+       the file was created."""
+    if os.path.exists(path):
+        return False
+
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+    return True
+
+def instantiate(template_path, name, dest_path, info):
+    """Render a template to a file, leaving the file alone if it already
+       holds the rendered content. Returns whether the file was written."""
+    return write_if_changed(dest_path, get_template(template_path, name).render(info))
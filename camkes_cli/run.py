@@ -1,8 +1,12 @@
 import subprocess
-from elftools.elf.elffile import ELFFile
 
 from . import common
+from . import elf
 from . import build
+from . import trace
+from . import output
+from . import headless
+from . import images
 
 class UnknownArch(Exception):
     pass
@@ -10,55 +14,103 @@ class UnknownArch(Exception):
 class MissingKernel(Exception):
     pass
 
-ELFTOOLS_ARCH_TABLE = {
-    "x86": "x86",
-    "x64": "x86_64",
-    "ARM": "aarch32",
+APP_EXCEPTIONS = (
+    UnknownArch,
+    MissingKernel,
+    elf.InvalidElf,
+)
+
+MACHINE_ARCH_TABLE = {
+    elf.EM_386: "x86",
+    elf.EM_X86_64: "x86_64",
+    elf.EM_ARM: "aarch32",
 }
 
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('run', description="Run the app in qemu")
-    parser.add_argument('config', help="Name of configuration to run", type=str,
-                        choices=common.list_configs())
+    common.add_argument_config(parser, "Name of configuration to run")
     parser.add_argument('--plat', help="Name of platform (passed to qemu with -M)", default="kzm")
+    parser.add_argument('--headless', action='store_true',
+                        help="Run qemu without a terminal, and exit with a status reporting how the run went "
+                             "(implied by --expect, --fail and --timeout)")
+    parser.add_argument('--expect', type=headless.pattern, default=None, metavar='REGEX',
+                        help="Stop with status %d when a line of output matches REGEX" % headless.PASSED)
+    parser.add_argument('--fail', type=headless.pattern, default=None, metavar='REGEX',
+                        help="Stop with status %d when a line of output matches REGEX" % headless.FAILED)
+    parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                        help="Stop with status %d after SECONDS" % headless.TIMED_OUT)
     parser.set_defaults(func=handle_run)
     common.add_argument_jobs(parser)
+    common.add_argument_force(parser)
 
 def handle_run(args):
-    build.handle_build(args)
-
-    app, maybe_kernel = common.app_image_paths(args.config)
-
-    with open(app, 'rb') as f:
-        elftools_arch_name = ELFFile(f).get_machine_arch()
-        try:
-            arch_name = ELFTOOLS_ARCH_TABLE[elftools_arch_name]
-        except KeyError:
-            raise UnknownArch("elftools reported unknown arch name: %s" % elftools_arch_name)
-
-    args.logger.info("Found image for arch: %s" % arch_name)
-    RUNFN_TABLE[arch_name](app, maybe_kernel, args)
-
-def run_x86(app, kernel, args):
+    build.build_config(args.context, args.config, args.logger, args.jobs, args.force)
+
+    # the images are kept while qemu runs, even if they are rebuilt meanwhile
+    with images.reading(args.context, args.config) as directory:
+        cmd = qemu_command(args.context, args.config, args.plat, args.logger, directory)
+
+        with trace.span("qemu"):
+            if not (args.headless or args.expect or args.fail or args.timeout is not None):
+                subprocess.call(cmd)
+                return
+
+            log_path = output.log_path(args.context.cache_path, "run-%s" % args.config)
+            (result, line) = headless.run(cmd, log_path, args.expect, args.fail, args.timeout)
+
+    if result == headless.PASSED:
+        if line is not None:
+            args.logger.info("Matched expected output: %s" % line)
+    elif result == headless.FAILED:
+        args.logger.error("Matched failure output: %s" % line)
+    elif result == headless.TIMED_OUT:
+        args.logger.error("Timed out after %g seconds" % args.timeout)
+    else:
+        args.logger.error("qemu exited without producing expected output")
+
+    if result != headless.PASSED:
+        args.logger.info("Console output: %s" % log_path)
+
+    return result
+
+def detect_arch(app):
+    machine = elf.read_machine(app)
+    try:
+        return MACHINE_ARCH_TABLE[machine]
+    except KeyError:
+        raise UnknownArch("Image has unknown ELF machine: %d" % machine)
+
+def qemu_command(context, name, plat, logger, directory=None):
+    """Returns the qemu command line that runs a configuration's images,
+       from directory if given or else from where they're published."""
+    app, maybe_kernel = common.app_image_paths(context, name, directory)
+
+    with trace.span("detect arch"):
+        arch_name = detect_arch(app)
+
+    logger.info("Found image for arch: %s" % arch_name)
+    return QEMU_COMMAND_TABLE[arch_name](app, maybe_kernel, plat)
+
+def qemu_x86(app, kernel, plat):
     if kernel is None:
         raise MissingKernel("Kernel image is missing")
 
-    subprocess.call(['qemu-system-i386', '-cpu', 'Haswell', '-m', '512', '-nographic',
-                     '-kernel', kernel, '-initrd', app])
+    return ['qemu-system-i386', '-cpu', 'Haswell', '-m', '512', '-nographic',
+            '-kernel', kernel, '-initrd', app]
 
-def run_x86_64(app, kernel, args):
+def qemu_x86_64(app, kernel, plat):
     if kernel is None:
         raise MissingKernel("Kernel image is missing")
 
-    subprocess.call(['qemu-system-x86_64', '-cpu', 'Haswell', '-m', '512', '-nographic',
-                     '-kernel', kernel, '-initrd', app])
+    return ['qemu-system-x86_64', '-cpu', 'Haswell', '-m', '512', '-nographic',
+            '-kernel', kernel, '-initrd', app]
 
-def run_aarch32(app, kernel, args):
-    subprocess.call(['qemu-system-arm', '-M', args.plat, '-nographic', '-kernel', app])
+def qemu_aarch32(app, kernel, plat):
+    return ['qemu-system-arm', '-M', plat, '-nographic', '-kernel', app]
 
-RUNFN_TABLE = {
-    "x86": run_x86,
-    "x86_64": run_x86_64,
-    "aarch32": run_aarch32,
+QEMU_COMMAND_TABLE = {
+    "x86": qemu_x86,
+    "x86_64": qemu_x86_64,
+    "aarch32": qemu_aarch32,
 }
@@ -0,0 +1,127 @@
+import os
+
+from . import common
+from . import index
+from . import render
+from . import component
+from . import procedure
+
+INTERFACE_KEYWORDS = ['provides', 'uses', 'emits', 'consumes', 'dataport']
+
+COMPONENT_FLAGS = ['control', 'hardware']
+
+class InvalidSpec(Exception):
+    pass
+
+APP_EXCEPTIONS = (
+    InvalidSpec,
+)
+
+def load_spec(path):
+    """Load and check a spec of the form:
+
+       procedures = ["Foo"]
+
+       [components.Server]
+       provides = [["Foo", "foo"]]
+
+       [components.Client]
+       control = true
+       uses = [["Foo", "foo"]]
+    """
+    import toml
+
+    try:
+        with open(path) as spec_file:
+            spec = toml.load(spec_file)
+    except (IOError, OSError) as e:
+        raise InvalidSpec("Failed to read spec %s: %s" % (path, e))
+    except toml.TomlDecodeError as e:
+        raise InvalidSpec("Failed to parse spec %s: %s" % (path, e))
+
+    for key in set(spec) - set(["procedures", "components"]):
+        raise InvalidSpec("Unknown key \"%s\" in spec %s" % (key, path))
+
+    procedures = spec.get("procedures", [])
+    if not isinstance(procedures, list) or not all(isinstance(p, str) for p in procedures):
+        raise InvalidSpec("procedures must be a list of names")
+
+    components = spec.get("components", {})
+    if not isinstance(components, dict) or not all(isinstance(desc, dict) for desc in components.values()):
+        raise InvalidSpec("components must be a table of component tables")
+    for (name, desc) in components.items():
+        for key in set(desc) - set(INTERFACE_KEYWORDS + COMPONENT_FLAGS):
+            raise InvalidSpec("Unknown key \"%s\" in component %s" % (key, name))
+        for keyword in INTERFACE_KEYWORDS:
+            for interface in desc.get(keyword, []):
+                if not isinstance(interface, list) or len(interface) != 2 or \
+                        not all(isinstance(part, str) for part in interface):
+                    raise InvalidSpec("Each of %s's %s interfaces must be a [type, name] pair"
+                                      % (name, keyword))
+
+    return (procedures, components)
+
+def interfaces(desc):
+    return [component.Interface(keyword, typ, name)
+            for keyword in INTERFACE_KEYWORDS for (typ, name) in desc.get(keyword, [])]
+
+def plan(context, logger, procedures, components, jobs=None, allow_missing_procedure=False):
+    """Render every file described by a spec, returning their paths and
+       contents. Procedures are looked up in a single index, refreshed once,
+       and procedures the spec is about to create can be provided by its
+       components."""
+    outputs = []
+    planned_procedures = {}
+
+    for name in procedures:
+        (path, content) = procedure.render_procedure(context, name)
+        outputs.append((path, content))
+        if not os.path.exists(path):
+            planned_procedures[name] = path
+
+    if len(components) == 0:
+        return outputs
+
+    procedure_index = index.ProcedureIndex(context, logger, jobs)
+    procedure_index.refresh()
+    helpers = component.template_helpers()
+
+    for name in sorted(components):
+        desc = components[name]
+        component_interfaces = interfaces(desc)
+        imports = component.find_imports(context, logger, name, component_interfaces, procedure_index,
+                                         allow_missing_procedure, planned_procedures, refresh=False)
+        outputs.extend(component.render_component(context, name, component_interfaces, imports,
+                                                  desc.get("control", False), desc.get("hardware", False),
+                                                  helpers))
+
+    return outputs
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('scaffold', description="Add the procedures and components "
+                                                           "described by a spec file")
+    parser.add_argument('spec', help="TOML file describing procedures and components", type=str)
+    parser.add_argument('--dry_run', action='store_true', help="List the files that would be created")
+    parser.add_argument('--allow_missing_procedure', action='store_true')
+    common.add_argument_jobs(parser)
+    parser.set_defaults(func=handle_scaffold)
+
+def handle_scaffold(args):
+    (procedures, components) = load_spec(args.spec)
+    outputs = plan(args.context, args.logger, procedures, components, args.jobs,
+                   args.allow_missing_procedure)
+
+    created = 0
+    for (path, content) in outputs:
+        rel = os.path.relpath(path, args.context.root)
+        if os.path.exists(path):
+            args.logger.info("Exists:  %s" % rel)
+        elif args.dry_run:
+            args.logger.info("Create:  %s" % rel)
+        else:
+            render.create(path, content)
+            args.logger.info("Created: %s" % rel)
+            created += 1
+
+    if not args.dry_run:
+        args.logger.info("Created %d of %d files" % (created, len(outputs)))
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import errno
+import select
+import socket
+
+from . import common
+from . import index
+from . import watch
+
+# interface keywords and the component attributes listing them
+INTERFACE_ATTRIBUTES = [
+    ("provides", "provides"),
+    ("uses", "uses"),
+    ("emits", "emits"),
+    ("consumes", "consumes"),
+    ("dataport", "dataports"),
+]
+
+class ServerRunning(Exception):
+    pass
+
+class QueryFailed(Exception):
+    pass
+
+APP_EXCEPTIONS = (
+    ServerRunning,
+)
+
+# json decodes strings as unicode in python 2
+STRING_TYPES = (str, type(u""))
+
+def type_name(typ):
+    return getattr(typ, "name", None) or str(typ)
+
+def describe_procedure(ast):
+    methods = []
+    for method in getattr(ast, "methods", []):
+        methods.append({
+            "name": method.name,
+            "return_type": type_name(method.return_type) if method.return_type is not None else None,
+            "parameters": [{"direction": getattr(p, "direction", None), "type": type_name(p.type), "name": p.name}
+                           for p in getattr(method, "parameters", [])],
+        })
+    return {"methods": methods}
+
+def describe_component(ast):
+    interfaces = []
+    for (keyword, attribute) in INTERFACE_ATTRIBUTES:
+        for interface in getattr(ast, attribute, None) or []:
+            interfaces.append({"keyword": keyword, "type": type_name(interface.type), "name": interface.name})
+    return {
+        "control": bool(getattr(ast, "control", False)),
+        "hardware": bool(getattr(ast, "hardware", False)),
+        "interfaces": interfaces,
+    }
+
+class Model:
+    """Answers queries about a project's .camkes files from its index,
+       keeping the ASTs it has loaded in memory."""
+
+    def __init__(self, context, logger, jobs=None):
+        self.context = context
+        self.logger = logger
+        self.index = index.ProcedureIndex(context, logger, jobs)
+        self.asts = {}
+        self.refresh()
+
+    def refresh(self):
+        self.index.refresh()
+        self.refreshed = time.time()
+
+        # forget the ASTs of files that have changed
+        hashes = dict((rel, entry["hash"]) for (rel, entry) in self.index.entries.items())
+        for key in list(self.asts):
+            if hashes.get(key[1]) != key[3]:
+                del self.asts[key]
+
+    def ast(self, kind, rel, name):
+        key = (kind, rel, name, self.index.entries[rel]["hash"])
+        if key not in self.asts:
+            self.asts[key] = self.index.lookup(rel, name, kind)
+        return self.asts[key]
+
+    def definitions(self, kind):
+        names = set()
+        for rel in self.index.order:
+            names.update(self.index.entries[rel].get(kind) or {})
+        return dict((name, self.index.search(name, kind)) for name in names)
+
+    def definition(self, kind, name, describe):
+        rel = self.index.search(name, kind)
+        if rel is None:
+            raise QueryFailed("No %s named %s" % (kind[:-1], name))
+        result = {"name": name, "path": os.path.join(self.index.root, rel)}
+        result.update(describe(self.ast(kind, rel, name)))
+        return result
+
+    def imports(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.index.root)
+        if rel not in self.index.entries:
+            raise QueryFailed("%s is not a .camkes file in %s" % (path, self.context.src_path))
+        return {
+            "path": os.path.join(self.index.root, rel),
+            "imports": [os.path.join(self.index.root, r) for r in self.index.entries[rel]["imports"]],
+            "imported_by": [os.path.join(self.index.root, r) for r in self.index.order
+                            if rel in self.index.entries[r]["imports"]],
+        }
+
+    def graph(self):
+        return dict((os.path.join(self.index.root, rel),
+                     [os.path.join(self.index.root, r) for r in self.index.entries[rel]["imports"]])
+                    for rel in self.index.order)
+
+    def status(self):
+        return {
+            "root": self.index.root,
+            "files": len(self.index.order),
+            "unparsed": [os.path.join(self.index.root, rel) for rel in self.index.order
+                         if self.index.entries[rel]["procedures"] is None],
+            "procedures": len(self.definitions("procedures")),
+            "components": len(self.definitions("components")),
+            "refreshed": self.refreshed,
+            "pid": os.getpid(),
+        }
+
+    def answer(self, query, name=None):
+        if query == "procedure":
+            return self.definition("procedures", name, describe_procedure)
+        if query == "component":
+            return self.definition("components", name, describe_component)
+        if query in ["procedures", "components"]:
+            return dict((n, os.path.join(self.index.root, rel)) for (n, rel) in self.definitions(query).items())
+        if query == "imports":
+            return self.imports(name)
+        if query == "graph":
+            return self.graph()
+        if query == "status":
+            return self.status()
+        raise QueryFailed("Unknown query %s" % query)
+
+    def handle(self, request):
+        """Answer a request of the form {"query": ..., "name": ...}. Errors
+           are reported in the response, so a bad request can't bring down
+           a server answering other clients."""
+        try:
+            if not isinstance(request, dict) or "query" not in request:
+                raise QueryFailed("Requests must be objects with a \"query\"")
+            name = request.get("name")
+            if request["query"] in ["procedure", "component", "imports"] and name is None:
+                raise QueryFailed("The %s query needs a name" % request["query"])
+            if name is not None and not isinstance(name, STRING_TYPES):
+                raise QueryFailed("The name must be a string")
+            return {"ok": True, "result": self.answer(request["query"], name)}
+        except QueryFailed as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            self.logger.error("Failed to answer %s: %s" % (json.dumps(request), e))
+            return {"ok": False, "error": "Failed to answer the query: %s" % e}
+
+class Server:
+    """Serves queries about a project over a unix socket, one JSON object
+       per line in each direction. The model is refreshed as soon as the
+       project's sources change, so queries are answered from memory."""
+
+    def __init__(self, model, path, watcher, logger):
+        self.model = model
+        self.path = path
+        self.watcher = watcher
+        self.logger = logger
+        self.clients = {}
+        self.running = True
+        self.listener = self.bind(path)
+
+    def bind(self, path):
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise ServerRunning("A server is already listening on %s" % path)
+            except socket.error as e:
+                if e.errno not in [errno.ECONNREFUSED, errno.ENOENT]:
+                    raise
+                # left behind by a server that didn't shut down cleanly
+                os.remove(path)
+            finally:
+                probe.close()
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(16)
+        return listener
+
+    def poll_changes(self):
+        changes = [p for p in self.watcher.wait(0) if not watch.ignored(p)]
+        if len(changes) > 0:
+            self.model.refresh()
+            self.logger.info("Refreshed after changes to %d files" % len(set(changes)))
+
+    def serve(self):
+        watcher_fd = getattr(self.watcher, "fd", None)
+        timeout = None if watcher_fd is not None else watch.POLL_INTERVAL
+
+        while self.running:
+            fds = [self.listener] + list(self.clients) + ([watcher_fd] if watcher_fd is not None else [])
+            ready, _, _ = select.select(fds, [], [], timeout)
+
+            if watcher_fd is None or watcher_fd in ready:
+                self.poll_changes()
+
+            for sock in ready:
+                if sock is self.listener:
+                    (client, _) = self.listener.accept()
+                    self.clients[client] = b''
+                elif sock in self.clients:
+                    self.receive(sock)
+
+    def receive(self, client):
+        try:
+            chunk = client.recv(1 << 16)
+        except socket.error:
+            # reset by the client
+            chunk = b''
+        if not chunk:
+            self.disconnect(client)
+            return
+
+        lines = (self.clients[client] + chunk).split(b'\n')
+        self.clients[client] = lines.pop()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                response = {"ok": False, "error": "Malformed request"}
+            else:
+                if isinstance(request, dict) and request.get("query") == "shutdown":
+                    self.running = False
+                    response = {"ok": True, "result": None}
+                else:
+                    response = self.model.handle(request)
+            try:
+                client.sendall(json.dumps(response).encode('utf-8') + b'\n')
+            except socket.error:
+                self.disconnect(client)
+                return
+
+    def disconnect(self, client):
+        del self.clients[client]
+        client.close()
+
+    def close(self):
+        for client in list(self.clients):
+            self.disconnect(client)
+        self.listener.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('serve', description="Answer queries about the project from memory "
+                                                        "over a unix socket")
+    parser.add_argument('--poll', action='store_true', help="Poll for changes rather than using inotify")
+    parser.set_defaults(func=handle_serve)
+    common.add_argument_jobs(parser)
+
+def handle_serve(args):
+    model = Model(args.context, args.logger, args.jobs)
+    watcher = watch.make_watcher([args.context.src_path], args.poll, args.logger)
+    server = Server(model, args.context.server_socket_path, watcher, args.logger)
+
+    args.logger.info("Serving queries for %d files on %s" % (len(model.index.order), server.path))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        watcher.close()
+    args.logger.info("Stopped serving")
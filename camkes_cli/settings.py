@@ -0,0 +1,33 @@
+import os
+
+HOST_SETTINGS_PATH = "/etc/camkes-cli/config.toml"
+
+_settings = None
+
+def user_settings_path():
+    config_home = os.getenv("XDG_CONFIG_HOME", os.path.join(os.path.expanduser("~"), ".config"))
+    return os.path.join(config_home, "camkes-cli", "config.toml")
+
+def user_cache_path():
+    cache_home = os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "camkes-cli")
+
+def load():
+    """Returns the settings shared by all projects of this user and host.
+       Host settings are read from /etc/camkes-cli/config.toml and can be
+       overridden per user in ~/.config/camkes-cli/config.toml."""
+    global _settings
+    if _settings is None:
+        _settings = {}
+        for path in [HOST_SETTINGS_PATH, user_settings_path()]:
+            if os.path.exists(path):
+                import toml
+                with open(path) as settings_file:
+                    _settings.update(toml.load(settings_file))
+    return _settings
+
+def get(key, env_var=None, default=None):
+    """Look up a setting, which the environment variable env_var overrides."""
+    if env_var is not None and os.getenv(env_var):
+        return os.getenv(env_var)
+    return load().get(key, default)
@@ -0,0 +1,203 @@
+import re
+import json
+import time
+import multiprocessing
+import multiprocessing.pool
+import xml.etree.ElementTree as ElementTree
+
+from . import common
+from . import build
+from . import run
+from . import output
+from . import headless
+from . import images
+
+DEFAULT_TIMEOUT = 60
+
+RESULT_NAMES = {
+    headless.PASSED: "passed",
+    headless.FAILED: "failed",
+    headless.EXITED: "exited",
+    headless.TIMED_OUT: "timed out",
+}
+
+class TestsFailed(Exception):
+    pass
+
+APP_EXCEPTIONS = (
+    TestsFailed,
+)
+
+class BootTests:
+    """Boots several configurations in qemu at once, each checked against
+       its own expected output, so a run takes about as long as the
+       slowest boot. Expectations are read from the [test] table of
+       camkes.toml, and can be set per configuration:
+
+       [test]
+       expect = "All is well"
+       fail = "panic"
+       timeout = 60
+
+       [test.configs.aarch32]
+       plat = "sabre"
+    """
+
+    def __init__(self, context, logger, configs, parallel, overrides=None):
+        self.context = context
+        self.logger = logger
+        self.configs = configs
+        self.parallel = max(1, min(parallel, len(configs)))
+        self.overrides = overrides or {}
+        self.results = {}
+
+    def expectations(self, name):
+        test_info = self.context.info.get("test", {})
+        expected = dict((k, v) for (k, v) in test_info.items() if k != "configs")
+        expected.update(test_info.get("configs", {}).get(name, {}))
+        expected.update((k, v) for (k, v) in self.overrides.items() if v is not None)
+        return expected
+
+    def timeout(self, name, expected):
+        try:
+            return float(expected.get("timeout", DEFAULT_TIMEOUT))
+        except (TypeError, ValueError):
+            raise TestsFailed("The timeout for %s must be a number of seconds, not %r"
+                              % (name, expected["timeout"]))
+
+    def boot_one(self, name):
+        """Boot one configuration, recording how it went. Any error is
+           recorded as that configuration's result, so the others still
+           boot and are reported."""
+        start = time.time()
+        result = {"name": name, "line": None, "log": None, "message": None}
+        try:
+            expected = self.expectations(name)
+            if expected.get("expect") is None:
+                raise TestsFailed("No expected output for %s. Set test.expect in %s or pass --expect"
+                                  % (name, common.markup_name()))
+            timeout = self.timeout(name, expected)
+
+            with images.reading(self.context, name) as directory:
+                cmd = run.qemu_command(self.context, name, expected.get("plat", "kzm"), self.logger, directory)
+                result["log"] = output.log_path(self.context.cache_path, "test-%s" % name)
+                (status, result["line"]) = headless.run(cmd, result["log"],
+                                                        re.compile(expected["expect"]),
+                                                        re.compile(expected["fail"]) if expected.get("fail") else None,
+                                                        timeout, echo=False)
+            if status not in RESULT_NAMES:
+                raise TestsFailed("qemu didn't start")
+            result["status"] = RESULT_NAMES[status]
+        except Exception as e:
+            result["status"] = "error"
+            result["message"] = str(e) or e.__class__.__name__
+
+        result["time"] = time.time() - start
+        self.results[name] = result
+        self.logger.info("%s: %s" % (name, result["status"]))
+
+    def run(self):
+        start = time.time()
+        pool = multiprocessing.pool.ThreadPool(self.parallel)
+        try:
+            pool.map(self.boot_one, self.configs)
+        finally:
+            pool.close()
+            pool.join()
+        self.elapsed = time.time() - start
+
+    def add_unbuilt(self, name):
+        self.results[name] = {"name": name, "status": "not built", "time": 0.0, "line": None,
+                              "log": None, "message": "Failed to build %s" % name}
+
+    def summary(self):
+        names = sorted(self.results)
+        width = max(len(name) for name in names)
+        self.logger.info("")
+        for name in names:
+            result = self.results[name]
+            detail = result["line"] or result["message"] or ""
+            self.logger.info("%-*s  %-10s  %7.1fs  %s" % (width, name, result["status"], result["time"], detail))
+        self.logger.info("%-*s  %-10s  %7.1fs" % (width, "total", "", self.elapsed))
+
+    def failures(self):
+        return [name for name in sorted(self.results) if self.results[name]["status"] != "passed"]
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({"elapsed": self.elapsed,
+                       "results": [self.results[name] for name in sorted(self.results)]},
+                      f, indent=4, sort_keys=True)
+
+    def write_junit(self, path):
+        suite = ElementTree.Element("testsuite", {
+            "name": "boot",
+            "tests": str(len(self.results)),
+            "failures": str(len([r for r in self.results.values()
+                                 if r["status"] not in ["passed", "error", "not built"]])),
+            "errors": str(len([r for r in self.results.values() if r["status"] in ["error", "not built"]])),
+            "time": "%.3f" % self.elapsed,
+        })
+        for name in sorted(self.results):
+            result = self.results[name]
+            case = ElementTree.SubElement(suite, "testcase", {
+                "classname": "boot",
+                "name": name,
+                "time": "%.3f" % result["time"],
+            })
+            if result["status"] in ["error", "not built"]:
+                ElementTree.SubElement(case, "error", {"message": result["message"]})
+            elif result["status"] != "passed":
+                failure = ElementTree.SubElement(case, "failure", {"message": result["status"]})
+                failure.text = result["line"]
+            if result["log"] is not None:
+                ElementTree.SubElement(case, "system-out").text = "Console output: %s" % result["log"]
+
+        ElementTree.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('test', description="Boot configurations in qemu and check their output")
+    parser.add_argument('configs', help="Names of configurations to test (default: all of them)",
+                        type=common.config_name, nargs='*')
+    parser.add_argument('--parallel', type=int, default=multiprocessing.cpu_count(),
+                        help="Number of configurations to boot at once")
+    parser.add_argument('--expect', type=str, default=None, metavar='REGEX',
+                        help="Pass when a line of output matches REGEX (overrides camkes.toml)")
+    parser.add_argument('--fail', type=str, default=None, metavar='REGEX',
+                        help="Fail when a line of output matches REGEX (overrides camkes.toml)")
+    parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                        help="Fail after SECONDS (overrides camkes.toml, default: %d)" % DEFAULT_TIMEOUT)
+    parser.add_argument('--no_build', action='store_true', help="Test the images as they are")
+    parser.add_argument('--junit', type=str, default=None, metavar='FILE', help="Write a JUnit report to FILE")
+    parser.add_argument('--json', type=str, default=None, metavar='FILE', help="Write a JSON report to FILE")
+    parser.set_defaults(func=handle_test)
+    common.add_argument_jobs(parser)
+    common.add_argument_force(parser)
+
+def handle_test(args):
+    configs = args.configs or sorted(common.list_configs())
+    if len(configs) == 0:
+        raise TestsFailed("There are no configurations to test")
+
+    unbuilt = []
+    if not args.no_build:
+        matrix = build.MatrixBuild(args.context, args.logger, configs, args.jobs, None, force=args.force)
+        matrix.run()
+        unbuilt = matrix.failures()
+
+    tests = BootTests(args.context, args.logger, [name for name in configs if name not in unbuilt],
+                      args.parallel, {"expect": args.expect, "fail": args.fail, "timeout": args.timeout})
+    tests.run()
+    for name in unbuilt:
+        tests.add_unbuilt(name)
+    tests.summary()
+
+    if args.json is not None:
+        tests.write_json(args.json)
+    if args.junit is not None:
+        tests.write_junit(args.junit)
+
+    failures = tests.failures()
+    if len(failures) > 0:
+        raise TestsFailed("%d of %d configurations failed: %s"
+                          % (len(failures), len(configs), ", ".join(failures)))
@@ -0,0 +1,95 @@
+import os
+import time
+import json
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_tracer = None
+
+def enable():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+@contextlib.contextmanager
+def no_span():
+    yield
+
+def span(name, **args):
+    """Record the time spent in a phase of a command, if tracing is enabled."""
+    if _tracer is None:
+        return no_span()
+    return _tracer.span(name, **args)
+
+def child_times():
+    if resource is None:
+        return (0.0, 0.0)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (usage.ru_utime, usage.ru_stime)
+
+def cpu_time():
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    times = os.times()
+    return times[0] + times[1]
+
+class Tracer:
+    """Records nested spans of wall and CPU time, including the CPU time of
+       child processes such as make, as Chrome trace events."""
+
+    def __init__(self):
+        self.epoch = time.time()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        start = time.time()
+        start_cpu = cpu_time()
+        start_children = child_times()
+        try:
+            yield
+        finally:
+            end = time.time()
+            end_children = child_times()
+            args = dict(args)
+            args.update({
+                "cpu_ms": (cpu_time() - start_cpu) * 1000,
+                "child_user_ms": (end_children[0] - start_children[0]) * 1000,
+                "child_system_ms": (end_children[1] - start_children[1]) * 1000,
+                "depth": depth,
+            })
+            with self.lock:
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.epoch) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.current_thread().ident,
+                    "args": args,
+                })
+            self.local.depth = depth
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": sorted(self.events, key=lambda e: e["ts"]),
+                       "displayTimeUnit": "ms"}, f, indent=1)
+
+    def summary(self, logger):
+        events = sorted(self.events, key=lambda e: e["ts"])
+        width = max([len(e["name"]) + 2 * e["args"]["depth"] for e in events] + [len("phase")])
+        logger.info("%-*s  %10s  %10s  %10s" % (width, "phase", "wall ms", "cpu ms", "child ms"))
+        for e in events:
+            args = e["args"]
+            logger.info("%-*s  %10.1f  %10.1f  %10.1f"
+                        % (width, "  " * args["depth"] + e["name"], e["dur"] / 1000, args["cpu_ms"],
+                           args["child_user_ms"] + args["child_system_ms"]))
@@ -1,17 +1,33 @@
-import shutil
-
-import toml
-
 from . import common
+from . import fingerprint
+from . import trace
 
 def make_subparser(subparsers):
     parser = subparsers.add_parser('update', description="Update build system")
     parser.set_defaults(func=handle_update)
+    common.add_argument_jobs(parser)
+
+def report_changes(logger, before, after):
+    changed = sorted(p for p in after if p in before and before[p] != after[p])
+    added = sorted(p for p in after if p not in before)
+    removed = sorted(p for p in before if p not in after)
+
+    if len(changed) + len(added) + len(removed) == 0:
+        logger.info("No repositories changed")
+    for (description, projects) in [("Updated", changed), ("Added", added), ("Removed", removed)]:
+        for project in projects:
+            logger.info("%s %s" % (description, project))
 
 def handle_update(args):
-    args.logger.info("Deleting old build system path")
-    shutil.rmtree(common.build_system_path())
+    """Sync the build system in place. Files that didn't change keep their
+       mtimes, so each configuration's build directory only rebuilds what
+       depends on the repositories that moved."""
+    before = fingerprint.project_revisions(args.context)
+
+    common.init_build_system(args.logger, args.context.root, args.context.info, args.jobs)
+
+    with trace.span("refresh build directories"):
+        for config in common.list_config_builds(args.context):
+            common.prepare_config_build(args.context, config)
 
-    with open(common.markup_path()) as info_file:
-        info = toml.load(info_file)
-        common.init_build_system(args.logger, common.find_root(), info, args.jobs)
+    report_changes(args.logger, before, fingerprint.project_revisions(args.context))
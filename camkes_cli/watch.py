@@ -0,0 +1,311 @@
+import os
+import re
+import time
+import errno
+import select
+import struct
+import threading
+
+from . import common
+from . import build
+from . import index
+from . import output
+from . import headless
+from . import images
+
+# inotify flags from linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+EVENT_FORMAT = "iIII"
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+# editor swap, backup and lock files, which don't affect the build
+IGNORE_PATTERN = re.compile(r"(^\.|~$|\.sw[a-z]$|^4913$)")
+
+# seconds between scans when polling for changes
+POLL_INTERVAL = 1.0
+
+def ignored(path):
+    return IGNORE_PATTERN.search(os.path.basename(path)) is not None
+
+class InotifyWatcher:
+    """Watches directory trees for changes with inotify, adding watches
+       for directories created while watching."""
+
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for path in paths:
+            self.add_tree(path)
+
+    def add_tree(self, top):
+        for (path, dirs, _) in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), WATCH_MASK)
+            if wd >= 0:
+                self.directories[wd] = path
+
+    def wait(self, timeout):
+        """Returns the paths that changed within timeout seconds, or as soon
+           as there are any changes if timeout is None."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        changes = []
+        offset = 0
+        while offset + EVENT_SIZE <= len(data):
+            (wd, mask, _, length) = struct.unpack_from(EVENT_FORMAT, data, offset)
+            name = data[offset + EVENT_SIZE:offset + EVENT_SIZE + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += EVENT_SIZE + length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.extend(self.directories.values())
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            changes.append(path)
+
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Watches directory trees for changes by comparing the mtimes and
+       sizes of their files, for systems without inotify."""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for top in self.paths:
+            for (path, _, files) in os.walk(top):
+                for f in files:
+                    full_path = os.path.join(path, f)
+                    try:
+                        st = os.stat(full_path)
+                    except OSError:
+                        continue
+                    snapshot[full_path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            time.sleep(POLL_INTERVAL if deadline is None else max(0, min(POLL_INTERVAL, deadline - time.time())))
+            snapshot = self.scan()
+            changes = [p for p in set(snapshot) | set(self.snapshot) if snapshot.get(p) != self.snapshot.get(p)]
+            self.snapshot = snapshot
+            if changes or (deadline is not None and time.time() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+def make_watcher(paths, poll=False, logger=None):
+    if not poll:
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError, ImportError) as e:
+            if logger is not None:
+                logger.warn("inotify is unavailable (%s), polling for changes instead" % e)
+    return PollingWatcher(paths)
+
+class Cycle:
+    """One rebuild, and optionally a boot, run in the background so that it
+       can be cancelled when the sources change again."""
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.jobserver = common.JobServer(watch.jobs, 1)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def cancel(self):
+        self.jobserver.stop()
+
+    def join(self):
+        self.thread.join()
+        self.jobserver.close()
+
+    def run(self):
+        """Any error is reported and ends the cycle, leaving the next
+           change to start a fresh one."""
+        watch = self.watch
+        start = time.time()
+        try:
+            watch.refresh_index()
+            build.build_config(watch.context, watch.name, watch.logger, jobserver=self.jobserver)
+        except Exception as e:
+            if self.jobserver.stopped:
+                watch.logger.info("Build cancelled")
+            elif isinstance(e, common.BuildFailed):
+                watch.logger.error(e)
+            else:
+                watch.logger.error("Building %s failed: %s" % (watch.name, e))
+            return
+        watch.logger.info("Finished building %s in %.1fs" % (watch.name, time.time() - start))
+
+        if watch.boot:
+            try:
+                watch.boot_once(self.jobserver)
+            except Exception as e:
+                watch.logger.error("Booting %s failed: %s" % (watch.name, e))
+
+class Watch:
+    """Rebuilds a configuration whenever its sources change. The project
+       context and procedure index stay in memory between rebuilds, so each
+       rebuild only re-reads what changed."""
+
+    def __init__(self, context, logger, name, jobs, settle, boot=False, plat="kzm", expect=None,
+                 fail=None, timeout=None):
+        self.context = context
+        self.logger = logger
+        self.name = name
+        self.jobs = jobs
+        self.settle = settle
+        self.boot = boot
+        self.plat = plat
+        self.expect = expect
+        self.fail = fail
+        self.timeout = timeout
+        self.procedure_index = index.ProcedureIndex(context, logger, jobs)
+
+    def refresh_index(self):
+        self.procedure_index.refresh()
+        for rel in self.procedure_index.order:
+            if self.procedure_index.entries[rel]["procedures"] is None:
+                self.logger.warn("Failed to parse %s" % rel)
+
+    def boot_once(self, jobserver):
+        from . import run
+        from . import elf
+        with images.reading(self.context, self.name) as directory:
+            try:
+                cmd = run.qemu_command(self.context, self.name, self.plat, self.logger, directory)
+            except (run.UnknownArch, run.MissingKernel, elf.InvalidElf, common.NoApp,
+                    common.MultipleApps, common.MultipleKernels) as e:
+                self.logger.error(e)
+                return
+            log_path = output.log_path(self.context.cache_path, "watch-%s" % self.name)
+
+            # qemu is started through the jobserver too, so that cancelling the
+            # cycle stops it along with any make
+            (result, line) = headless.run(cmd, log_path, self.expect, self.fail, self.timeout,
+                                          start=jobserver.start)
+        if result is None or jobserver.stopped:
+            self.logger.info("Boot cancelled")
+        elif result == headless.PASSED:
+            self.logger.info("Boot passed%s" % (": %s" % line if line is not None else ""))
+        else:
+            self.logger.error("Boot failed (status %d)%s. Console output: %s"
+                              % (result, ": %s" % line if line is not None else "", log_path))
+
+    def wait_for_quiet(self, watcher):
+        """Wait until no changes have arrived for settle seconds."""
+        while any(not ignored(p) for p in watcher.wait(self.settle)):
+            pass
+
+    def run(self, watcher):
+        cycle = None
+        pending = True
+        try:
+            while True:
+                if pending:
+                    self.wait_for_quiet(watcher)
+                    if cycle is not None:
+                        cycle.join()
+                    cycle = Cycle(self)
+                    cycle.start()
+                    pending = False
+
+                changes = [p for p in watcher.wait(None) if not ignored(p)]
+                if len(changes) > 0:
+                    self.logger.info("Changed: %s" % ", ".join(sorted(set(
+                        os.path.relpath(p, self.context.root) for p in changes))))
+                    if cycle.running():
+                        cycle.cancel()
+                    pending = True
+        finally:
+            if cycle is not None:
+                cycle.cancel()
+                cycle.join()
+
+def make_subparser(subparsers):
+    parser = subparsers.add_parser('watch', description="Rebuild a configuration whenever its sources change")
+    common.add_argument_config(parser, "Name of configuration to build")
+    parser.add_argument('--settle', type=float, default=0.5, metavar='SECONDS',
+                        help="Wait until there have been no changes for SECONDS before rebuilding")
+    parser.add_argument('--poll', action='store_true', help="Poll for changes rather than using inotify")
+    parser.add_argument('--plat', help="Name of platform (passed to qemu with -M)", default="kzm")
+    parser.add_argument('--run', action='store_true',
+                        help="Boot the images headless after each successful build "
+                             "(implied by --expect and --fail)")
+    parser.add_argument('--expect', type=headless.pattern, default=None, metavar='REGEX',
+                        help="Report the boot as passed when a line of output matches REGEX")
+    parser.add_argument('--fail', type=headless.pattern, default=None, metavar='REGEX',
+                        help="Report the boot as failed when a line of output matches REGEX")
+    parser.add_argument('--timeout', type=float, default=30, metavar='SECONDS',
+                        help="Stop each boot after SECONDS (default: 30)")
+    parser.set_defaults(func=handle_watch)
+    common.add_argument_jobs(parser)
+
+def handle_watch(args):
+    paths = [args.context.src_path, args.context.config_path]
+    watcher = make_watcher(paths, args.poll, args.logger)
+    watch = Watch(args.context, args.logger, args.config, args.jobs, args.settle,
+                  args.run or args.expect is not None or args.fail is not None,
+                  args.plat, args.expect, args.fail, args.timeout)
+
+    args.logger.info("Watching %s for changes. Press Ctrl-C to stop."
+                     % ", ".join(os.path.relpath(p, args.context.root) for p in paths))
+    try:
+        watch.run(watcher)
+    except KeyboardInterrupt:
+        args.logger.info("Stopped watching")
+    finally:
+        watcher.close()
@@ -0,0 +1,69 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_PATH)
+sys.path.insert(0, os.path.join(REPO_PATH, "benchmarks"))
+
+import synthetic
+
+from camkes_cli import cli
+from camkes_cli import common
+
+class ProjectTestCase(unittest.TestCase):
+    """Runs each test in a fresh synthetic project, with the stub CAmkES
+       parser and fake tools from the benchmarks."""
+
+    components = 4
+    procedures = 3
+    depth = 2
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="camkes-cli-test.")
+        self.root = os.path.join(self.directory, "project")
+        self.bin_path = os.path.join(self.directory, "bin")
+        synthetic.install_fake_tools(self.bin_path)
+        synthetic.generate_project(self.root, self.components, self.procedures, self.depth, options=10)
+
+        self.environ = dict(os.environ)
+        os.environ["PATH"] = os.pathsep.join([self.bin_path, os.environ.get("PATH", "")])
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.directory, "cache")
+        os.environ["XDG_CONFIG_HOME"] = os.path.join(self.directory, "config")
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+
+        # the stub parser is imported from this project, not an earlier one
+        for module in [m for m in sys.modules if m == "camkes" or m.startswith("camkes.")]:
+            del sys.modules[module]
+
+        common._project_context = None
+        self.context = common.project_context()
+        self.logger = logging.getLogger("tests")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        os.environ.clear()
+        os.environ.update(self.environ)
+        common._project_context = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def write(self, rel, content):
+        synthetic.write(self.path(rel), content)
+
+    def run_cli(self, *argv):
+        """Run a camkes-cli command in the project, returning its status."""
+        with mock.patch.object(sys, "argv", ["camkes", "--quiet"] + list(argv)):
+            return cli.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import support
+
+import synthetic
+
+from camkes_cli import images
+from camkes_cli import artifacts
+
+KEY = "ab" * 32
+
+class HttpBackendTest(unittest.TestCase):
+    """Stores artifacts through a server for a directory cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="camkes-cli-test.")
+        self.backend = artifacts.DirectoryBackend(os.path.join(self.directory, "cache"), 1 << 20)
+        os.makedirs(self.backend.path)
+        self.server = artifacts.make_server(self.backend, "127.0.0.1", 0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.http = artifacts.HttpBackend("http://127.0.0.1:%d/" % self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join(10)
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_store_and_fetch(self):
+        src_path = os.path.join(self.directory, "artifact.tar.gz")
+        synthetic.write(src_path, "artifact")
+        dest_path = os.path.join(self.directory, "fetched.tar.gz")
+        self.assertFalse(self.http.fetch(KEY, dest_path))
+
+        self.http.store(KEY, src_path)
+        self.assertTrue(os.path.isfile(self.backend.artifact_path(KEY)))
+        self.assertTrue(self.http.fetch(KEY, dest_path))
+        with open(dest_path) as f:
+            self.assertEqual(f.read(), "artifact")
+
+    def test_store_streams(self):
+        src_path = os.path.join(self.directory, "artifact.tar.gz")
+        synthetic.write(src_path, "x" * 100000)
+        (urlopen, Request, HTTPError, URLError) = artifacts.urllib_module()
+        requests = []
+
+        def recording_urlopen(request):
+            requests.append((request.data, request.get_header("Content-length")))
+            return urlopen(request)
+
+        with support.mock.patch.object(artifacts, "urllib_module",
+                                       lambda: (recording_urlopen, Request, HTTPError, URLError)):
+            self.http.store(KEY, src_path)
+        [(data, length)] = requests
+        self.assertFalse(isinstance(data, bytes))
+        self.assertEqual(length, "100000")
+        self.assertEqual(os.path.getsize(self.backend.artifact_path(KEY)), 100000)
+
+    def test_store_missing_file(self):
+        with self.assertRaises(artifacts.ArtifactCacheError):
+            self.http.store(KEY, os.path.join(self.directory, "missing.tar.gz"))
+
+class UploadTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(UploadTest, self).setUp()
+        self.cache = artifacts.DirectoryBackend(os.path.join(self.directory, "cache"), 1 << 20)
+        synthetic.write(os.path.join(self.context.build_images_path("x86"), "kernel"), "kernel")
+        images.publish(self.context, "x86", self.logger)
+
+    def test_upload_and_fetch(self):
+        artifacts.upload(self.cache, KEY, self.context, "x86", self.logger)
+        shutil.rmtree(self.context.build_images_path("x86"))
+        self.assertTrue(artifacts.fetch(self.cache, KEY, self.context, "other", self.logger))
+        with open(os.path.join(self.context.build_images_path("other"), "kernel")) as f:
+            self.assertEqual(f.read(), "kernel")
+
+    def test_pack_failure(self):
+        with support.mock.patch.object(artifacts, "pack", side_effect=IOError("No space left on device")):
+            with self.assertRaises(artifacts.ArtifactCacheError):
+                artifacts.upload(self.cache, KEY, self.context, "x86", self.logger)
+        # the temporary archive is removed
+        self.assertEqual([f for f in os.listdir(self.context.cache_path) if f.startswith("artifact.")], [])
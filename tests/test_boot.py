@@ -0,0 +1,80 @@
+import os
+import json
+import xml.etree.ElementTree as ElementTree
+
+import support
+
+import synthetic
+
+from camkes_cli import run
+from camkes_cli import test
+
+# fake qemus for each configuration
+QEMUS = {
+    "a": "echo All is well\n",
+    "b": "echo panic\n",
+    "c": "exec sleep 60\n",
+}
+
+class BootTestsTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(BootTestsTest, self).setUp()
+        for name in QEMUS:
+            self.write("configs/%s" % name, synthetic.config_source(10))
+            synthetic.write(os.path.join(self.directory, "qemu-%s" % name), "#!/bin/sh\n%s" % QEMUS[name],
+                            executable=True)
+
+    def set_test_info(self, info):
+        with open(self.path("camkes.toml"), 'a') as f:
+            f.write(info)
+        self.context._info = None
+
+    def qemu_command(self, context, name, plat, logger, directory=None):
+        return [os.path.join(self.directory, "qemu-%s" % name)]
+
+    def run_tests(self, *options):
+        self.json_path = os.path.join(self.directory, "results.json")
+        self.junit_path = os.path.join(self.directory, "results.xml")
+        with support.mock.patch.object(run, "qemu_command", self.qemu_command):
+            status = self.run_cli("test", "a", "b", "c", "--json", self.json_path, "--junit", self.junit_path,
+                                  *options)
+        with open(self.json_path) as f:
+            results = dict((result["name"], result) for result in json.load(f)["results"])
+        return (status, results)
+
+    def test_results(self):
+        self.set_test_info('[test]\nexpect = "All is well"\nfail = "panic"\ntimeout = 0.5\n')
+        (status, results) = self.run_tests()
+        self.assertEqual(status, 1)
+        self.assertEqual(dict((name, result["status"]) for (name, result) in results.items()),
+                         {"a": "passed", "b": "failed", "c": "timed out"})
+        self.assertEqual(results["b"]["line"], "panic")
+
+        suite = ElementTree.parse(self.junit_path).getroot()
+        self.assertEqual((suite.get("tests"), suite.get("failures"), suite.get("errors")), ("3", "2", "0"))
+
+    def test_overrides(self):
+        self.set_test_info('[test]\nexpect = "nothing"\n')
+        (status, results) = self.run_tests("--expect", "All is well|panic", "--timeout", "0.5")
+        self.assertEqual([results[name]["status"] for name in "abc"], ["passed", "passed", "timed out"])
+
+    def test_bad_timeout(self):
+        self.set_test_info('[test]\nexpect = "All is well"\ntimeout = 0.5\n'
+                           '[test.configs.b]\ntimeout = "soon"\n')
+        (status, results) = self.run_tests()
+        self.assertEqual([results[name]["status"] for name in "abc"], ["passed", "error", "timed out"])
+        self.assertIn("soon", results["b"]["message"])
+        suite = ElementTree.parse(self.junit_path).getroot()
+        self.assertEqual(suite.get("errors"), "1")
+
+    def test_unexpected_error(self):
+        self.set_test_info('[test]\nexpect = "All is well"\ntimeout = 0.5\n')
+        with support.mock.patch.object(test.headless, "run", side_effect=KeyError("status")):
+            (status, results) = self.run_tests()
+        self.assertEqual([results[name]["status"] for name in "abc"], ["error"] * 3)
+
+    def test_no_expectation(self):
+        (status, results) = self.run_tests()
+        self.assertEqual(results["a"]["status"], "error")
+        self.assertIn("No expected output", results["a"]["message"])
@@ -0,0 +1,56 @@
+import os
+import re
+
+import support
+
+from camkes_cli import build
+from camkes_cli import common
+from camkes_cli import artifacts
+
+class MatrixBuildTest(support.ProjectTestCase):
+
+    def run_matrix(self, errors, fail_fast=False):
+        """Runs a matrix build of a, b and c, in which building each config
+           named in errors raises its error."""
+        def build_config(context, name, logger, **kwargs):
+            if name in errors:
+                raise errors[name]
+            return True
+
+        matrix = build.MatrixBuild(self.context, self.logger, ["a", "b", "c"], 1, 1, fail_fast=fail_fast)
+        with support.mock.patch.object(build, "build_config", build_config):
+            matrix.run()
+        matrix.summary()
+        return matrix
+
+    def test_all_built(self):
+        matrix = self.run_matrix({})
+        self.assertEqual(matrix.failures(), [])
+        self.assertEqual([matrix.results[name][0] for name in "abc"], ["built"] * 3)
+
+    def test_errors_fail_one_config(self):
+        for error in [common.BuildFailed("make failed"), common.NoApp("no app"), OSError("disk full"),
+                      artifacts.ArtifactCacheError("bad cache"), KeyError("CONFIG_X"),
+                      re.error("bad pattern"), common.MissingTemplate("missing")]:
+            matrix = self.run_matrix({"b": error})
+            self.assertEqual(matrix.failures(), ["b"])
+            self.assertEqual(matrix.results["b"][2], str(error))
+            self.assertEqual(matrix.results["c"][0], "built")
+
+    def test_fail_fast(self):
+        matrix = self.run_matrix({"a": ValueError("unexpected")}, fail_fast=True)
+        self.assertEqual(matrix.results["a"][0], "failed")
+        self.assertEqual([matrix.results[name][0] for name in "bc"], ["skipped"] * 2)
+
+class BuildConfigTest(support.ProjectTestCase):
+
+    def test_build(self):
+        self.assertTrue(build.build_config(self.context, "x86", self.logger))
+        self.assertFalse(build.build_config(self.context, "x86", self.logger))
+
+    def test_invalid_artifact_cache_size(self):
+        os.environ[artifacts.ARTIFACT_CACHE_ENV_VAR] = self.path("artifacts")
+        os.environ[artifacts.ARTIFACT_CACHE_SIZE_ENV_VAR] = "lots"
+        with self.assertLogs(self.logger, "WARNING") as logs:
+            self.assertTrue(build.build_config(self.context, "x86", self.logger))
+        self.assertIn("building without the artifact cache", "\n".join(logs.output))
@@ -0,0 +1,103 @@
+import os
+
+import support
+
+import synthetic
+
+from camkes_cli import build
+from camkes_cli import common
+from camkes_cli import ccache
+
+# records the compiler it was run as, and a miss the first time and a hit
+# after that, in the stats log
+FAKE_CCACHE = r'''#!/bin/sh
+mkdir -p "$CCACHE_DIR"
+echo "# $(basename "$0") $*" >> "$CCACHE_STATSLOG"
+if [ -e "$CCACHE_DIR/seen" ]; then
+    echo direct_cache_hit >> "$CCACHE_STATSLOG"
+else
+    touch "$CCACHE_DIR/seen"
+    echo cache_miss >> "$CCACHE_STATSLOG"
+fi
+'''
+
+# compiles a file before running the fake make
+COMPILING_MAKE = r'''#!/bin/sh
+gcc -c main.c || exit 1
+exec "%s" "$@"
+'''
+
+class CcacheTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(CcacheTest, self).setUp()
+        self.tools_path = os.path.join(self.directory, "tools")
+        for compiler in ["gcc", "arm-none-eabi-g++", "ld"]:
+            synthetic.write(os.path.join(self.tools_path, compiler), "#!/bin/sh\nexit 1\n", executable=True)
+        synthetic.write(os.path.join(self.tools_path, "make"),
+                        COMPILING_MAKE % os.path.join(self.bin_path, "make"), executable=True)
+        os.environ["PATH"] = os.pathsep.join([self.tools_path, os.environ["PATH"]])
+        os.environ[ccache.CCACHE_DIR_ENV_VAR] = os.path.join(self.directory, "ccache")
+
+    def install_ccache(self):
+        path = os.path.join(self.directory, "ccache-bin", "ccache")
+        synthetic.write(path, FAKE_CCACHE, executable=True)
+        os.environ["PATH"] = os.pathsep.join([os.environ["PATH"], os.path.dirname(path)])
+        return path
+
+    def test_prepare(self):
+        path = self.install_ccache()
+        self.assertTrue(ccache.prepare(self.context))
+        bin_path = ccache.masquerade_path(self.context)
+        self.assertIn("gcc", os.listdir(bin_path))
+        self.assertIn("arm-none-eabi-g++", os.listdir(bin_path))
+        self.assertNotIn("ld", os.listdir(bin_path))
+        self.assertEqual(os.readlink(os.path.join(bin_path, "gcc")), path)
+
+        # links to an old ccache are replaced
+        os.remove(os.path.join(bin_path, "gcc"))
+        os.symlink("/nonexistent/ccache", os.path.join(bin_path, "gcc"))
+        self.assertTrue(ccache.prepare(self.context))
+        self.assertEqual(os.readlink(os.path.join(bin_path, "gcc")), path)
+
+    def test_environment(self):
+        env = ccache.environment(self.context, "x86")
+        self.assertEqual(env["PATH"].split(os.pathsep)[0], ccache.masquerade_path(self.context))
+        self.assertEqual(env["CCACHE_DIR"], os.path.join(self.directory, "ccache"))
+        self.assertEqual(env["CCACHE_BASEDIR"], self.context.root)
+
+    def test_not_installed(self):
+        self.assertFalse(ccache.prepare(self.context))
+        with self.assertRaises(common.BuildFailed):
+            build.make_environment(self.context, "x86", self.logger, ccache=True)
+
+        # asked for in camkes.toml, the build carries on without it
+        with open(self.path("camkes.toml"), 'a') as f:
+            f.write("ccache = true\n")
+        self.context._info = None
+        with self.assertLogs(self.logger, "WARNING"):
+            self.assertIsNone(build.make_environment(self.context, "x86", self.logger))
+
+    def test_not_requested(self):
+        self.install_ccache()
+        self.assertIsNone(build.make_environment(self.context, "x86", self.logger))
+
+    def test_read_stats(self):
+        synthetic.write(ccache.stats_log_path(self.context, "x86"),
+                        "# a.c\ncache_miss\n# b.c\ndirect_cache_hit\n# c.c\npreprocessed_cache_hit\n")
+        self.assertEqual(ccache.read_stats(self.context, "x86"), (2, 1))
+        ccache.reset_stats(self.context, "x86")
+        self.assertEqual(ccache.read_stats(self.context, "x86"), (0, 0))
+
+    def test_build(self):
+        self.install_ccache()
+        with self.assertLogs(self.logger, "INFO") as logs:
+            build.build_config(self.context, "x86", self.logger, ccache=True)
+        self.assertIn("INFO:tests:ccache: 0 hits, 1 misses (0.0% hit rate)", logs.output)
+        with open(ccache.stats_log_path(self.context, "x86")) as f:
+            self.assertEqual(f.readline().split()[:2], ["#", "gcc"])
+
+        # the cache is shared, so a forced rebuild hits
+        with self.assertLogs(self.logger, "INFO") as logs:
+            build.build_config(self.context, "x86", self.logger, force=True, ccache=True)
+        self.assertIn("INFO:tests:ccache: 1 hits, 0 misses (100.0% hit rate)", logs.output)
@@ -0,0 +1,96 @@
+import os
+
+import support
+
+import synthetic
+
+from camkes_cli import build
+from camkes_cli import common
+from camkes_cli import kconfig
+
+# records each run, as its arguments, before running the fake make
+RECORDING_MAKE = r'''#!/bin/sh
+echo "$*" >> "%s"
+exec "%s" "$@"
+'''
+
+class ConfigBuildTest(support.ProjectTestCase):
+    """Builds configurations in directories of their own."""
+
+    def setUp(self):
+        super(ConfigBuildTest, self).setUp()
+        self.make_log_path = os.path.join(self.directory, "make.log")
+        tools_path = os.path.join(self.directory, "tools")
+        synthetic.write(os.path.join(tools_path, "make"),
+                        RECORDING_MAKE % (self.make_log_path, os.path.join(self.bin_path, "make")),
+                        executable=True)
+        os.environ["PATH"] = os.pathsep.join([tools_path, os.environ["PATH"]])
+        self.write("configs/arm", synthetic.config_source(20))
+
+    def makes(self):
+        """The build directory and targets of each make run since the last
+           call."""
+        try:
+            with open(self.make_log_path) as f:
+                runs = [line.split() for line in f]
+        except IOError:
+            return []
+        os.remove(self.make_log_path)
+        return [(os.path.basename(args[1]), [a for a in args[2:] if not a.startswith("-") and
+                                             not a.isdigit()]) for args in runs]
+
+    def test_prepare_config_build(self):
+        build_path = common.prepare_config_build(self.context, "x86")
+        self.assertEqual(build_path, self.context.config_build_path("x86"))
+        self.assertEqual(os.path.realpath(os.path.join(build_path, "tools")),
+                         os.path.realpath(self.path("sel4", "tools")))
+        for entry in ["builds", ".config", "images"]:
+            self.assertFalse(os.path.lexists(os.path.join(build_path, entry)), entry)
+
+        # links follow what the build system holds
+        os.makedirs(self.path("sel4", "kernel"))
+        common.prepare_config_build(self.context, "x86")
+        self.assertTrue(os.path.islink(os.path.join(build_path, "kernel")))
+        os.rmdir(self.path("sel4", "kernel"))
+        common.prepare_config_build(self.context, "x86")
+        self.assertFalse(os.path.lexists(os.path.join(build_path, "kernel")))
+
+    def test_configs_build_separately(self):
+        build.build_config(self.context, "x86", self.logger)
+        build.build_config(self.context, "arm", self.logger)
+        self.assertEqual(self.makes(), [("x86", []), ("arm", [])])
+        self.assertEqual(sorted(common.list_config_builds(self.context)), ["arm", "x86"])
+        for name in ["x86", "arm"]:
+            self.assertEqual(kconfig.parse(self.context.build_config_path(name)),
+                             kconfig.parse(self.path("configs", name)))
+
+        # switching back keeps the objects of the first configuration
+        obj_path = os.path.join(self.context.config_build_path("x86"), "build", "main.o")
+        synthetic.write(obj_path, "object")
+        build.build_config(self.context, "x86", self.logger, force=True)
+        self.assertEqual(self.makes(), [("x86", [])])
+        self.assertTrue(os.path.exists(obj_path))
+
+    def test_equivalent_config_untouched(self):
+        common.load_config(self.context, "x86")
+        config_path = self.context.build_config_path("x86")
+        os.utime(config_path, (0, 0))
+
+        # the same options in another order
+        self.write("configs/x86", synthetic.config_source(10, seed=1))
+        common.load_config(self.context, "x86")
+        self.assertEqual(os.stat(config_path).st_mtime, 0)
+
+        self.write("configs/x86", synthetic.config_source(11))
+        self.assertTrue(common.config_changed(self.context, "x86"))
+        common.load_config(self.context, "x86")
+        self.assertNotEqual(os.stat(config_path).st_mtime, 0)
+
+    def test_clean_one_config(self):
+        build.build_config(self.context, "x86", self.logger)
+        build.build_config(self.context, "arm", self.logger)
+        self.makes()
+        self.run_cli("clean", "arm")
+        self.assertEqual(self.makes(), [("arm", ["clean"])])
+        self.run_cli("clean")
+        self.assertEqual(sorted(self.makes()), [("arm", ["clean"]), ("x86", ["clean"])])
@@ -0,0 +1,48 @@
+import shutil
+
+import support
+
+from camkes_cli import build
+from camkes_cli import fingerprint
+
+class FingerprintTest(support.ProjectTestCase):
+
+    def build(self):
+        """Build x86, returning whether make was run."""
+        return build.build_config(self.context, "x86", self.logger)
+
+    def reasons(self):
+        return fingerprint.rebuild_reasons(self.context, "x86", fingerprint.compute(self.context, "x86"))
+
+    def test_unchanged_build_skipped(self):
+        self.assertEqual(self.reasons(), ["no previous successful build"])
+        self.assertTrue(self.build())
+        self.assertEqual(self.reasons(), [])
+        self.assertFalse(self.build())
+
+    def test_source_change(self):
+        self.build()
+        self.write("src/interfaces/P0.camkes", "procedure P0 {}\n")
+        self.assertEqual(self.reasons(), ["sources changed"])
+        self.assertTrue(self.build())
+
+    def test_config_change(self):
+        self.build()
+        self.write("configs/x86", "CONFIG_OTHER=y\n")
+        self.assertEqual(self.reasons(), ["configuration changed"])
+
+    def test_clean_then_build(self):
+        self.build()
+        self.assertEqual(self.run_cli("clean", "x86"), None)
+        self.assertTrue(self.build())
+
+    def test_build_directory_missing(self):
+        self.build()
+        shutil.rmtree(self.context.config_build_path("x86"))
+        self.assertIn("build directory missing", self.reasons())
+        self.assertTrue(self.build())
+
+    def test_images_missing(self):
+        self.build()
+        shutil.rmtree(self.context.image_path)
+        self.assertEqual(self.reasons(), ["images missing"])
@@ -0,0 +1,182 @@
+import os
+import struct
+
+import support
+
+import synthetic
+
+from camkes_cli import elf
+from camkes_cli import common
+from camkes_cli import images
+from camkes_cli import footprint
+
+from test_images import APP, KERNEL
+
+SHT_PROGBITS = 1
+SHT_STRTAB = 3
+SHF_EXECINSTR = 0x4
+
+TEXT = elf.SHF_ALLOC | SHF_EXECINSTR
+DATA = elf.SHF_ALLOC | elf.SHF_WRITE
+
+def string_table(names):
+    """Returns a string table holding names, and the offset of each."""
+    table = b'\0'
+    offsets = {}
+    for name in names:
+        offsets[name] = len(table)
+        table += name.encode('utf-8') + b'\0'
+    return (table, offsets)
+
+def make_elf(sections, symbols=[], elf_class=2, machine=elf.EM_X86_64):
+    """Builds a little endian ELF file. sections are (name, type, flags,
+       content) tuples, where the content of a SHT_NOBITS section is its
+       size, and symbols are (name, section name, offset in section, size,
+       type) tuples."""
+    (header, section_format, symbol_format) = ["<" + f for f in elf.ELF_FORMATS[elf_class]]
+    header_size = 16 + struct.calcsize(header)
+    names = [s[0] for s in sections]
+
+    (strtab, symbol_names) = string_table([s[0] for s in symbols])
+    symtab = struct.pack(symbol_format, *([0] * 6))
+    for (name, section, offset, size, typ) in symbols:
+        # global symbols, at the addresses the sections are given below
+        (info, shndx) = ((1 << 4) | typ, names.index(section) + 1)
+        value = 0x1000 * shndx + offset
+        if elf_class == 1:
+            symtab += struct.pack(symbol_format, symbol_names[name], value, size, info, 0, shndx)
+        else:
+            symtab += struct.pack(symbol_format, symbol_names[name], info, 0, shndx, value, size)
+    tables = [(".symtab", elf.SHT_SYMTAB, 0, symtab), (".strtab", SHT_STRTAB, 0, strtab)]
+    (shstrtab, section_names) = string_table(names + [".symtab", ".strtab", ".shstrtab"])
+    all_sections = list(sections) + tables + [(".shstrtab", SHT_STRTAB, 0, shstrtab)]
+
+    contents = b''
+    headers = struct.pack(section_format, *([0] * 10))
+    for (index, (name, typ, flags, content)) in enumerate(all_sections):
+        offset = header_size + len(contents)
+        if typ == elf.SHT_NOBITS:
+            size = content
+        else:
+            size = len(content)
+            contents += content + b'\0' * (-len(content) % 8)
+        link = len(sections) + 2 if typ == elf.SHT_SYMTAB else 0
+        addr = 0x1000 * (index + 1) if flags & elf.SHF_ALLOC else 0
+        headers += struct.pack(section_format, section_names[name], typ, flags, addr, offset, size, link, 0, 8, 0)
+
+    ident = elf.ELF_MAGIC + struct.pack("BBB", elf_class, 1, 1) + b'\0' * 9
+    return (ident + struct.pack(header, 2, machine, 1, 0, 0, header_size + len(contents), 0, header_size, 0, 0,
+                                struct.calcsize(section_format), len(all_sections) + 1, len(all_sections))
+            + contents + headers)
+
+def cpio(files):
+    """Builds a newc cpio archive of (name, content) pairs."""
+    archive = b''
+    for (name, content) in list(files) + [(elf.CPIO_TRAILER, b'')]:
+        name = name.encode('utf-8') + b'\0'
+        fields = [0, 0o100644, 0, 0, 1, 0, len(content), 0, 0, 0, 0, len(name), 0]
+        archive += elf.CPIO_MAGIC + "".join("%08x" % f for f in fields).encode('ascii') + name
+        archive += b'\0' * (-len(archive) % 4) + content
+        archive += b'\0' * (-len(archive) % 4)
+    return archive
+
+def ar_index(symbols):
+    """Builds an ar archive holding only a symbol index."""
+    index = struct.pack(">I", len(symbols)) + struct.pack(">I", 0) * len(symbols) + \
+        b''.join(s.encode('utf-8') + b'\0' for s in symbols)
+    header = "%-16s%-12s%-6s%-6s%-8s%-10d`\n" % ("/", 0, 0, 0, 0, len(index))
+    return elf.AR_MAGIC + header.encode('ascii') + index
+
+def component(text):
+    return make_elf([(".text", SHT_PROGBITS, TEXT, b'\x90' * text), (".data", SHT_PROGBITS, DATA, b'\1' * 8),
+                     (".bss", elf.SHT_NOBITS, DATA, 16)])
+
+def loader(archive_symbol=True):
+    archive = cpio([("C0", component(40)), ("README", b'not an image\n')])
+    return make_elf([(".text", SHT_PROGBITS, TEXT, b'\x90' * 100), (".data", SHT_PROGBITS, DATA, b'\1' * 20),
+                     (".bss", elf.SHT_NOBITS, DATA, 50),
+                     ("._archive_cpio", SHT_PROGBITS, elf.SHF_ALLOC, archive)],
+                    [("lib_fn", ".text", 16, 30, elf.STT_FUNC), ("main", ".text", 0, 16, elf.STT_FUNC)] +
+                    ([("_cpio_archive", "._archive_cpio", 0, len(archive), elf.STT_OBJECT)]
+                     if archive_symbol else []))
+
+def kernel(text):
+    return make_elf([(".text", SHT_PROGBITS, TEXT, b'\x90' * text), (".bss", elf.SHT_NOBITS, DATA, 10)],
+                    elf_class=1, machine=elf.EM_386)
+
+class FootprintTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(FootprintTest, self).setUp()
+        library_path = os.path.join(self.context.config_build_path("x86"), "build", "libfoo", "libfoo.a")
+        os.makedirs(os.path.dirname(library_path))
+        with open(library_path, 'wb') as f:
+            f.write(ar_index(["lib_fn"]))
+
+    def publish(self, app=None, kernel_text=200):
+        path = self.context.build_images_path("x86")
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+        for (name, content) in [(APP, app or loader()), (KERNEL, kernel(kernel_text))]:
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(content)
+        images.publish(self.context, "x86", self.logger)
+
+    def test_compute(self):
+        self.publish()
+        parts = footprint.compute(self.context, "x86")
+        self.assertEqual(footprint.part_order(parts), [footprint.KERNEL_NAME, footprint.LOADER_NAME, "C0"])
+        # the loader's own sizes exclude the archive of components
+        self.assertEqual(parts[footprint.LOADER_NAME], {
+            "sizes": {"text": 100, "data": 20, "bss": 50},
+            "libraries": {"libfoo": {"text": 30, "data": 0, "bss": 0}},
+        })
+        self.assertEqual(parts["C0"]["sizes"], {"text": 40, "data": 8, "bss": 16})
+        self.assertEqual(parts[footprint.KERNEL_NAME]["sizes"], {"text": 200, "data": 0, "bss": 10})
+
+    def test_archive_without_symbol(self):
+        self.publish(loader(archive_symbol=False))
+        parts = footprint.compute(self.context, "x86")
+        self.assertEqual(parts[footprint.LOADER_NAME]["sizes"]["text"], 100)
+        self.assertEqual(parts["C0"]["sizes"]["text"], 40)
+
+    def test_baseline(self):
+        self.publish()
+        with self.assertLogs(self.logger, "INFO") as logs:
+            footprint.check(self.context, "x86", self.logger, 5)
+        self.assertIn("Saved footprint baseline for x86", [r.getMessage() for r in logs.records])
+        footprint.check(self.context, "x86", self.logger, 5)
+
+        self.publish(kernel_text=400)
+        with self.assertRaises(footprint.FootprintExceeded) as raised:
+            footprint.check(self.context, "x86", self.logger, 5)
+        self.assertIn("kernel, total", str(raised.exception))
+
+        # growth within the threshold, and a new baseline, pass
+        footprint.check(self.context, "x86", self.logger, 200)
+        footprint.check(self.context, "x86", self.logger, 5, update_baseline=True)
+        footprint.check(self.context, "x86", self.logger, 5)
+
+    def test_no_images(self):
+        with self.assertRaises(common.NoApp):
+            footprint.compute(self.context, "x86")
+
+    def test_invalid_image(self):
+        self.publish(loader()[:200])
+        with self.assertRaises(elf.InvalidElf):
+            footprint.compute(self.context, "x86")
+
+class ReadMachineTest(support.ProjectTestCase):
+
+    def test_read_machine(self):
+        path = self.path("image")
+        for (content, machine) in [(kernel(10), elf.EM_386), (component(10), elf.EM_X86_64)]:
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.assertEqual(elf.read_machine(path), machine)
+
+        synthetic.write(path, "not an image")
+        with self.assertRaises(elf.InvalidElf):
+            elf.read_machine(path)
@@ -0,0 +1,106 @@
+import os
+import sys
+import gzip
+import time
+import shutil
+import tempfile
+import unittest
+
+import support
+
+import synthetic
+
+from camkes_cli import cli
+from camkes_cli import run
+from camkes_cli import headless
+
+class MatcherTest(unittest.TestCase):
+
+    def test_line_split_across_chunks(self):
+        matcher = headless.Matcher(expect=headless.pattern("All tests passed"))
+        self.assertIsNone(matcher.feed(b"boot\nAll tests "))
+        self.assertEqual(matcher.feed(b"passed\r\nmore\n"), headless.PASSED)
+        self.assertEqual(matcher.line, "All tests passed")
+
+    def test_failure_wins_on_same_line(self):
+        matcher = headless.Matcher(expect=headless.pattern("tests"), fail=headless.pattern("FAILED"))
+        self.assertEqual(matcher.feed(b"tests FAILED\n"), headless.FAILED)
+
+    def test_prompt_without_newline(self):
+        matcher = headless.Matcher(expect=headless.pattern(r"login: $"))
+        self.assertEqual(matcher.feed(b"welcome\nlogin: "), headless.PASSED)
+
+class HeadlessRunTest(unittest.TestCase):
+    """Runs fake qemus, written as shell scripts."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="camkes-cli-test.")
+        self.log_path = os.path.join(self.directory, "run.log.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def qemu(self, script):
+        path = os.path.join(self.directory, "qemu")
+        synthetic.write(path, "#!/bin/sh\n%s" % script, executable=True)
+        return [path]
+
+    def run_qemu(self, script, expect="All tests passed", fail="FAILED", timeout=10):
+        return headless.run(self.qemu(script), self.log_path,
+                            expect=headless.pattern(expect) if expect is not None else None,
+                            fail=headless.pattern(fail) if fail is not None else None,
+                            timeout=timeout, echo=False)
+
+    def test_passed(self):
+        (result, line) = self.run_qemu("echo booting\necho All tests passed\nsleep 60\n")
+        self.assertEqual(result, headless.PASSED)
+        self.assertEqual(line, "All tests passed")
+
+    def test_failed(self):
+        (result, line) = self.run_qemu("echo booting\necho test 3 FAILED\nsleep 60\n")
+        self.assertEqual(result, headless.FAILED)
+        self.assertEqual(line, "test 3 FAILED")
+
+    def test_exited_early(self):
+        (result, line) = self.run_qemu("echo booting\nexit 0\n")
+        self.assertEqual(result, headless.EXITED)
+        self.assertIsNone(line)
+
+    def test_exited_without_expect(self):
+        self.assertEqual(self.run_qemu("echo booting\nexit 0\n", expect=None)[0], headless.PASSED)
+        self.assertEqual(self.run_qemu("echo booting\nexit 3\n", expect=None)[0], headless.EXITED)
+
+    def test_timed_out(self):
+        start = time.time()
+        (result, line) = self.run_qemu("echo booting\nexec sleep 60\n", timeout=0.5)
+        self.assertEqual(result, headless.TIMED_OUT)
+        # qemu is stopped rather than waited for
+        self.assertLess(time.time() - start, 0.5 + headless.KILL_GRACE + 5)
+
+    def test_prompt(self):
+        (result, line) = self.run_qemu("printf 'login: '\nexec sleep 60\n", expect=r"login: $")
+        self.assertEqual(result, headless.PASSED)
+
+    def test_console_logged(self):
+        self.run_qemu("echo booting\necho All tests passed\n")
+        with gzip.open(self.log_path, 'rb') as f:
+            self.assertEqual(f.read(), b"booting\nAll tests passed\n")
+
+class RunCommandTest(support.ProjectTestCase):
+    """Runs the run command, built with the fake make, on a fake qemu."""
+
+    def run_command(self, script, *options):
+        qemu = os.path.join(self.directory, "qemu")
+        synthetic.write(qemu, "#!/bin/sh\n%s" % script, executable=True)
+        argv = ["camkes", "--quiet", "run", "x86"] + list(options)
+        with support.mock.patch.object(run, "qemu_command", lambda *args: [qemu]), \
+                support.mock.patch.object(sys, "argv", argv):
+            return cli.main()
+
+    def test_exit_statuses(self):
+        self.assertEqual(self.run_command("echo All tests passed\n", "--expect", "passed"), headless.PASSED)
+        self.assertEqual(self.run_command("echo test FAILED\n", "--expect", "passed", "--fail", "FAILED"),
+                         headless.FAILED)
+        self.assertEqual(self.run_command("exit 0\n", "--expect", "passed"), headless.EXITED)
+        self.assertEqual(self.run_command("exec sleep 60\n", "--timeout", "0.5"), headless.TIMED_OUT)
+        self.assertEqual(self.run_command("exit 0\n", "--headless"), headless.PASSED)
@@ -0,0 +1,102 @@
+import os
+
+import support
+
+import synthetic
+
+from camkes_cli import images
+
+KERNEL = "kernel-ia32-pc99"
+APP = "capdl-loader-experimental-image-ia32-pc99"
+
+class ImagesTestCase(support.ProjectTestCase):
+
+    def build_images(self, name, app="app", kernel="kernel"):
+        """Write images as if a build of config name had made them."""
+        path = self.context.build_images_path(name)
+        synthetic.write(os.path.join(path, APP), app)
+        synthetic.write(os.path.join(path, KERNEL), kernel)
+
+    def publish(self, name, **images_content):
+        self.build_images(name, **images_content)
+        images.publish(self.context, name, self.logger)
+        return os.path.join(self.context.image_path, name)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def store(self):
+        return os.listdir(os.path.join(self.context.image_path, images.store_dir()))
+
+class PublishTest(ImagesTestCase):
+
+    def test_publish(self):
+        path = self.publish("x86")
+        self.assertTrue(os.path.islink(path))
+        self.assertEqual(sorted(os.listdir(path)), sorted([APP, KERNEL]))
+        self.assertEqual(self.read(os.path.join(path, APP)), "app")
+
+    def test_republish_replaces_images(self):
+        old_version = os.path.realpath(self.publish("x86"))
+        path = self.publish("x86", app="new app")
+        self.assertEqual(self.read(os.path.join(path, APP)), "new app")
+        self.assertFalse(os.path.exists(old_version))
+        # the old app is gone from the store, the unchanged kernel isn't
+        self.assertEqual(len(self.store()), 2)
+
+    def test_identical_images_stored_once(self):
+        first = self.publish("x86", app="first app")
+        second = self.publish("x86_64", app="second app")
+        self.assertEqual(len(self.store()), 3)
+        self.assertEqual(os.stat(os.path.join(first, KERNEL)).st_ino,
+                         os.stat(os.path.join(second, KERNEL)).st_ino)
+
+    def test_images_from_before_the_store(self):
+        old_path = os.path.join(self.context.image_path, "x86")
+        synthetic.write(os.path.join(old_path, APP), "old")
+        path = self.publish("x86")
+        self.assertTrue(os.path.islink(path))
+        self.assertEqual(self.read(os.path.join(path, APP)), "app")
+
+class CopyingPublishTest(PublishTest):
+    """Publishes where images can't be hardlinked or reflinked, so each is
+       a copy of the file in the store."""
+
+    def setUp(self):
+        super(CopyingPublishTest, self).setUp()
+        for patch in [support.mock.patch.object(os, "link", side_effect=OSError("cross-device link")),
+                      support.mock.patch("fcntl.ioctl", side_effect=IOError("not supported"))]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_identical_images_stored_once(self):
+        first = self.publish("x86", app="first app")
+        second = self.publish("x86_64", app="second app")
+        self.assertEqual(len(self.store()), 3)
+        self.assertEqual(self.read(os.path.join(first, KERNEL)), "kernel")
+        self.assertEqual(self.read(os.path.join(second, KERNEL)), "kernel")
+
+    def test_store_keeps_copied_images(self):
+        path = self.publish("x86")
+        self.assertEqual(len(self.store()), 2)
+        self.assertFalse(os.path.samefile(os.path.join(path, KERNEL),
+                                          os.path.join(self.context.image_path, images.store_dir(),
+                                                       self.store()[0])))
+
+class ReadingTest(ImagesTestCase):
+
+    def test_reading_keeps_images(self):
+        self.publish("x86")
+        with images.reading(self.context, "x86") as directory:
+            path = self.publish("x86", app="new app")
+            self.assertEqual(self.read(os.path.join(directory, APP)), "app")
+            self.assertEqual(self.read(os.path.join(path, APP)), "new app")
+
+        # the next publish deletes the images once nothing reads them
+        self.publish("x86", app="newer app")
+        self.assertFalse(os.path.exists(directory))
+
+    def test_reading_unpublished(self):
+        with images.reading(self.context, "x86") as directory:
+            self.assertFalse(os.path.exists(directory))
@@ -0,0 +1,87 @@
+import os
+
+import support
+
+import synthetic
+
+from camkes_cli import common
+from camkes_cli import index
+
+class ProcedureIndexTest(support.ProjectTestCase):
+
+    def new_index(self):
+        return index.ProcedureIndex(self.context, self.logger, 1)
+
+    def break_combined_parse(self):
+        # files are parsed one by one when they can't be parsed together
+        self.write("src/interfaces/Broken.camkes", "SYNTAX_ERROR\n")
+
+    def test_find(self):
+        (ast, path) = self.new_index().find("P1")
+        self.assertEqual(ast.name, "P1")
+        self.assertEqual(path, self.path("src", "interfaces", "P1.camkes"))
+
+    def assert_own_definitions(self):
+        procedure_index = self.new_index()
+        procedure_index.refresh()
+        entry = procedure_index.entries[os.path.join("src", "components", "C0", "C0.camkes")]
+        self.assertEqual(list(entry["procedures"]), [])
+        self.assertEqual(list(entry["components"]), ["C0"])
+
+    def test_entries_hold_own_definitions(self):
+        self.assert_own_definitions()
+
+    def test_entries_hold_own_definitions_parsed_alone(self):
+        self.break_combined_parse()
+        self.assert_own_definitions()
+
+    def test_unchanged_files_are_not_parsed(self):
+        self.new_index().refresh()
+        procedure_index = self.new_index()
+        self.assertEqual(procedure_index.stale_files(), [])
+
+    def test_renamed_procedure(self):
+        self.break_combined_parse()
+        self.new_index().refresh()
+        self.write("src/interfaces/P0.camkes", synthetic.procedure_source("Renamed0", 4))
+
+        procedure_index = self.new_index()
+        with self.assertRaises(common.MissingProcedure):
+            procedure_index.find("P0")
+        (ast, path) = procedure_index.find("Renamed0")
+        self.assertEqual(path, self.path("src", "interfaces", "P0.camkes"))
+
+    def test_lookup_without_serialized_ast(self):
+        procedure_index = self.new_index()
+        procedure_index.refresh()
+        rel = os.path.join("src", "interfaces", "P0.camkes")
+        procedure_index.entries[rel]["procedures"]["P0"] = None
+        self.assertEqual(procedure_index.lookup(rel, "P0").name, "P0")
+
+    def test_broken_file(self):
+        self.break_combined_parse()
+        procedure_index = self.new_index()
+        (ast, path) = procedure_index.find("P2")
+        self.assertEqual(ast.name, "P2")
+        self.assertIsNone(procedure_index.entries[os.path.join("src", "interfaces", "Broken.camkes")]["procedures"])
+
+    def test_find_in_cold_index(self):
+        self.break_combined_parse()
+        for jobs in [1, 2]:
+            procedure_index = index.ProcedureIndex(self.context, self.logger, jobs)
+            procedure_index.entries = {}
+            (ast, path) = procedure_index.find("P0")
+            self.assertEqual(path, self.path("src", "interfaces", "P0.camkes"))
+            (ast, path) = procedure_index.find("Chain1")
+            self.assertEqual(path, self.path("src", "interfaces", "chain", "L1.camkes"))
+
+    def test_parse_strategy(self):
+        # one job parses files together, more parse them in parallel
+        for (jobs, sessions) in [(1, 1), (2, 0)]:
+            procedure_index = index.ProcedureIndex(self.context, self.logger, jobs)
+            procedure_index.entries = {}
+            with support.mock.patch.object(procedure_index, "parse_session",
+                                           wraps=procedure_index.parse_session) as parse_session:
+                procedure_index.refresh()
+            self.assertEqual(parse_session.call_count, sessions)
+            self.assertEqual(procedure_index.search("P0"), os.path.join("src", "interfaces", "P0.camkes"))
@@ -0,0 +1,105 @@
+import os
+
+import support
+
+import synthetic
+
+from camkes_cli import build
+from camkes_cli import common
+from camkes_cli import kconfig
+
+class ParseTest(support.ProjectTestCase):
+
+    def options(self, content):
+        self.write("configs/test", content)
+        return kconfig.parse(self.path("configs", "test"))
+
+    def test_parse(self):
+        self.assertEqual(self.options("#\n# comment\n#\nCONFIG_A=y\nCONFIG_B=\"text\"\n\n"
+                                      "# CONFIG_C is not set\nCONFIG_D=n\n"),
+                         {"CONFIG_A": "y", "CONFIG_B": "\"text\""})
+
+    def test_order_and_comments_ignored(self):
+        self.write("configs/first", synthetic.config_source(50, seed=0))
+        self.write("configs/second", synthetic.config_source(50, seed=1))
+        self.assertEqual(kconfig.options_hash(self.path("configs", "first")),
+                         kconfig.options_hash(self.path("configs", "second")))
+
+    def test_diff(self):
+        self.assertEqual(kconfig.diff({"A": "y", "B": "1"}, {"B": "2", "C": "y"}),
+                         [("A", "y", None), ("B", "1", "2"), ("C", None, "y")])
+
+    def test_classify(self):
+        self.assertEqual(kconfig.classify("CONFIG_APP_FOO", kconfig.CLEAN_RULES), (kconfig.NONE, []))
+        self.assertEqual(kconfig.classify("CONFIG_CAMKES_FOO", kconfig.CLEAN_RULES)[0], kconfig.PARTIAL)
+        self.assertEqual(kconfig.classify("CONFIG_KERNEL_FOO", kconfig.CLEAN_RULES), (kconfig.FULL, []))
+
+class CleanPlanTest(support.ProjectTestCase):
+
+    def built_with(self, old, new, rules=""):
+        """Set up x86 as last built with the options old, and now
+           configured with new."""
+        if rules:
+            with open(self.path("camkes.toml"), 'a') as f:
+                f.write(rules)
+            self.context._info = None
+        common.prepare_config_build(self.context, "x86")
+        synthetic.write(self.context.build_config_path("x86"), old)
+        self.write("configs/x86", new)
+
+    def plan(self):
+        return kconfig.clean_plan(self.context, "x86")
+
+    def test_unchanged(self):
+        self.built_with("CONFIG_A=y\n# CONFIG_B is not set\n", "# comment\nCONFIG_A=y\n")
+        self.assertFalse(common.config_changed(self.context, "x86"))
+        self.assertEqual(self.plan().clean, kconfig.NONE)
+
+    def test_no_clean(self):
+        self.built_with("CONFIG_APP_A=y\n", "CONFIG_APP_B=y\n")
+        self.assertTrue(common.config_changed(self.context, "x86"))
+        plan = self.plan()
+        self.assertEqual(plan.clean, kconfig.NONE)
+        self.assertEqual(plan.reasons(), ["CONFIG_APP_A (y -> unset)", "CONFIG_APP_B (unset -> y)"])
+
+    def test_partial_clean(self):
+        self.built_with("CONFIG_CAMKES_A=1\n", "CONFIG_CAMKES_A=2\nCONFIG_APP_B=y\n")
+        plan = self.plan()
+        self.assertEqual(plan.clean, kconfig.PARTIAL)
+        self.assertEqual(plan.subtrees, ["build/*/*/bench", "build/bench"])
+
+    def test_full_clean(self):
+        self.built_with("CONFIG_CAMKES_A=1\nCONFIG_KERNEL=y\n", "CONFIG_CAMKES_A=2\n")
+        plan = self.plan()
+        self.assertEqual(plan.clean, kconfig.FULL)
+        self.assertEqual(plan.reasons(), ["CONFIG_KERNEL (y -> unset)"])
+
+    def test_project_rules(self):
+        self.built_with("CONFIG_DRIVER_A=1\n", "CONFIG_DRIVER_A=2\n",
+                        '[[clean_rules]]\noption = "CONFIG_DRIVER_\\\\w+"\nclean = "partial"\n'
+                        'subtrees = ["build/*/*/lib%(app)sdriver"]\n')
+        plan = self.plan()
+        self.assertEqual(plan.clean, kconfig.PARTIAL)
+        self.assertEqual(plan.subtrees, ["build/*/*/libbenchdriver"])
+
+    def test_partial_clean_deletes_subtrees(self):
+        self.built_with("CONFIG_CAMKES_A=1\n", "CONFIG_CAMKES_A=2\n")
+        build_path = self.context.config_build_path("x86")
+        synthetic.write(os.path.join(build_path, "build", "bench", "app.o"), "")
+        synthetic.write(os.path.join(build_path, "build", "kernel", "kernel.o"), "")
+        build.build_config(self.context, "x86", self.logger)
+        self.assertFalse(os.path.exists(os.path.join(build_path, "build", "bench")))
+        self.assertTrue(os.path.exists(os.path.join(build_path, "build", "kernel", "kernel.o")))
+
+    def test_invalid_rules(self):
+        for rule in ['option = "CONFIG_X"\nclean = "some"\n',
+                     'option = "CONFIG_X"\nclean = "partial"\n',
+                     'option = "CONFIG_(X"\nclean = "full"\n',
+                     'option = "CONFIG_X"\nclean = "partial"\nsubtrees = ["build/100%"]\n',
+                     'option = "CONFIG_X"\nclean = "partial"\nsubtrees = ["build/%(name)s"]\n',
+                     'option = "CONFIG_X"\nclean = "partial"\nsubtrees = "build"\n']:
+            self.write("camkes.toml", 'name = "bench"\n[[clean_rules]]\n%s' % rule)
+            self.context._info = None
+            with self.assertRaises(common.BuildFailed) as raised:
+                kconfig.project_rules(self.context)
+            self.assertIn("CONFIG_", str(raised.exception))
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import support
+
+from camkes_cli import lock
+
+# holds an exclusive lock on argv[1] until killed
+HOLD_LOCK = """
+import sys, fcntl, time
+f = open(sys.argv[1], 'a')
+fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+print("locked")
+sys.stdout.flush()
+time.sleep(60)
+"""
+
+class LockTest(support.ProjectTestCase):
+
+    def lock(self, shared=False):
+        return lock.Lock(lock.lock_path(self.context, "test"), shared=shared, logger=self.logger,
+                         description="test")
+
+    def test_exclusive(self):
+        with self.lock():
+            self.assertFalse(self.lock().acquire(blocking=False))
+            self.assertFalse(self.lock(shared=True).acquire(blocking=False))
+        held = self.lock()
+        self.assertTrue(held.acquire(blocking=False))
+        held.release()
+
+    def test_shared(self):
+        with self.lock(shared=True):
+            other = self.lock(shared=True)
+            self.assertTrue(other.acquire(blocking=False))
+            other.release()
+            self.assertFalse(self.lock().acquire(blocking=False))
+
+    def test_waits_for_holder(self):
+        held = self.lock()
+        held.acquire()
+        waiter = self.lock()
+        thread = threading.Thread(target=waiter.acquire)
+        with self.assertLogs(self.logger, "INFO") as logs:
+            thread.start()
+            time.sleep(0.2)
+            self.assertTrue(thread.is_alive())
+            held.release()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        waiter.release()
+        self.assertEqual(logs.output, ["INFO:tests:Waiting for another camkes-cli test..."])
+
+    def test_released_when_holder_dies(self):
+        path = lock.lock_path(self.context, "test")
+        os.makedirs(os.path.dirname(path))
+        holder = subprocess.Popen([sys.executable, "-c", HOLD_LOCK, path], stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(holder.stdout.readline().strip(), b"locked")
+            self.assertFalse(self.lock().acquire(blocking=False))
+        finally:
+            holder.kill()
+            holder.wait()
+            holder.stdout.close()
+        released = self.lock()
+        self.assertTrue(released.acquire(blocking=False))
+        released.release()
+
+    def test_locks_are_per_config(self):
+        with lock.build_lock(self.context, "x86"):
+            other = lock.build_lock(self.context, "arm")
+            self.assertTrue(other.acquire(blocking=False))
+            other.release()
+            self.assertFalse(lock.build_lock(self.context, "x86").acquire(blocking=False))
@@ -0,0 +1,203 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import support
+
+import synthetic
+
+from camkes_cli import common
+from camkes_cli import mirror
+
+MANIFEST_NAME = "default.xml"
+
+# records each invocation, as its directory and arguments, in FAKE_REPO_LOG,
+# and fails the command named in FAKE_REPO_FAIL
+RECORDING_REPO = r'''#!/bin/sh
+echo "$PWD $*" >> "$FAKE_REPO_LOG"
+case "$1" in
+    init) mkdir -p .repo;;
+esac
+if [ "$1" = "$FAKE_REPO_FAIL" ]; then
+    exit 1
+fi
+exit 0
+'''
+
+class MirrorTest(unittest.TestCase):
+    """Drives the mirror with a fake repo, recording how it is run."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="camkes-cli-test.")
+        self.root = os.path.join(self.directory, "mirrors")
+        self.log_path = os.path.join(self.directory, "repo.log")
+        bin_path = os.path.join(self.directory, "bin")
+        synthetic.write(os.path.join(bin_path, "repo"), RECORDING_REPO, executable=True)
+
+        self.environ = support.mock.patch.dict(os.environ, {
+            "PATH": os.pathsep.join([bin_path, os.environ.get("PATH", "")]),
+            "FAKE_REPO_LOG": self.log_path,
+            mirror.MIRROR_DIR_ENV_VAR: self.root,
+        })
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def invocations(self):
+        with open(self.log_path) as f:
+            return [line.split() for line in f]
+
+    def test_sync_mirror(self):
+        path = mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 2)
+        self.assertEqual(self.invocations(), [
+            [path, "init", "--mirror", "-u", "file:///manifest", "-m", MANIFEST_NAME],
+            [path, "sync", "--jobs", "2"],
+        ])
+        metadata = mirror.load_metadata(path)
+        self.assertEqual(metadata["manifest_url"], "file:///manifest")
+        self.assertEqual(metadata["manifest_name"], MANIFEST_NAME)
+        self.assertIn("refreshed", metadata)
+        self.assertEqual(mirror.list_mirrors(self.root), [(path, metadata)])
+
+    def test_sync_in_place(self):
+        path = mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        used = mirror.load_metadata(path)["used"]
+        self.assertEqual(mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1), path)
+
+        # the existing mirror is synced, not initialised again
+        self.assertEqual([cmd[1] for cmd in self.invocations()], ["init", "sync", "sync"])
+        self.assertGreaterEqual(mirror.load_metadata(path)["used"], used)
+
+    def test_manifests_have_separate_mirrors(self):
+        first = mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        second = mirror.sync_mirror(self.root, "file:///manifest", "other.xml", 1)
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(mirror.list_mirrors(self.root)), 2)
+
+    def test_get_code_references_mirror(self):
+        project = os.path.join(self.directory, "project")
+        common.get_code(project, "file:///manifest", MANIFEST_NAME, 1)
+        path = mirror.mirror_path(self.root, "file:///manifest", MANIFEST_NAME)
+        self.assertEqual(self.invocations()[2:], [
+            [os.path.join(project, "sel4"), "init", "-u", "file:///manifest", "-m", MANIFEST_NAME,
+             "--reference=%s" % path],
+            [os.path.join(project, "sel4"), "sync", "--jobs", "1"],
+        ])
+
+    def fail(self, command):
+        os.environ["FAKE_REPO_FAIL"] = command
+
+    def test_failed_init(self):
+        self.fail("init")
+        with self.assertRaises(mirror.MirrorFailed):
+            mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        path = mirror.mirror_path(self.root, "file:///manifest", MANIFEST_NAME)
+        self.assertEqual([cmd[1] for cmd in self.invocations()], ["init"])
+        self.assertEqual(mirror.list_mirrors(self.root), [])
+        self.assertEqual(os.listdir(path), [".lock"])
+
+        # the next attempt starts again
+        self.fail("")
+        mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        self.assertEqual([cmd[1] for cmd in self.invocations()], ["init", "init", "sync"])
+        self.assertIn("refreshed", mirror.load_metadata(path))
+
+    def test_failed_first_sync(self):
+        self.fail("sync")
+        with self.assertRaises(mirror.MirrorFailed):
+            mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        self.assertEqual(mirror.list_mirrors(self.root), [])
+
+    def test_failed_refresh(self):
+        path = mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        metadata = mirror.load_metadata(path)
+        self.fail("sync")
+        with self.assertRaises(mirror.MirrorFailed):
+            mirror.sync_mirror(self.root, "file:///manifest", MANIFEST_NAME, 1)
+        # the mirror is kept, as it was
+        self.assertEqual(mirror.load_metadata(path), metadata)
+        self.assertTrue(os.path.isdir(os.path.join(path, ".repo")))
+
+    def test_get_code_without_mirror(self):
+        self.fail("sync")
+        project = os.path.join(self.directory, "project")
+        common.get_code(project, "file:///manifest", MANIFEST_NAME, 1)
+        self.assertEqual(self.invocations()[2:], [
+            [os.path.join(project, "sel4"), "init", "-u", "file:///manifest", "-m", MANIFEST_NAME],
+            [os.path.join(project, "sel4"), "sync", "--jobs", "1"],
+        ])
+
+def git(cwd, *args):
+    subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                          cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+def git_output(cwd, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=cwd).decode('utf-8').strip()
+
+@unittest.skipUnless(shutil.which("repo") and shutil.which("git"),
+                     "needs repo and git")
+class RepoMirrorTest(unittest.TestCase):
+    """Mirrors a local manifest repository with the real repo."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="camkes-cli-test.")
+        self.root = os.path.join(self.directory, "mirrors")
+        self.remote = os.path.join(self.directory, "remote")
+
+        # a project and a manifest checking it out, as bare repositories
+        self.work = os.path.join(self.directory, "work")
+        for name in ["project", "manifest"]:
+            git(self.directory, "init", "--quiet", "--bare", os.path.join(self.remote, "%s.git" % name))
+            git(os.path.join(self.remote, "%s.git" % name), "symbolic-ref", "HEAD", "refs/heads/master")
+            git(self.directory, "clone", "--quiet", os.path.join(self.remote, "%s.git" % name),
+                os.path.join(self.work, name))
+        self.commit("project", "README", "first\n")
+        self.commit("manifest", MANIFEST_NAME,
+                    '<?xml version="1.0" encoding="UTF-8"?>\n<manifest>\n'
+                    '  <remote name="origin" fetch="file://%s"/>\n'
+                    '  <default remote="origin" revision="master"/>\n'
+                    '  <project name="project" path="project"/>\n'
+                    '</manifest>\n' % self.remote)
+        self.manifest_url = "file://%s" % os.path.join(self.remote, "manifest.git")
+
+        self.environ = support.mock.patch.dict(os.environ, {mirror.MIRROR_DIR_ENV_VAR: self.root})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def commit(self, name, filename, content):
+        path = os.path.join(self.work, name)
+        synthetic.write(os.path.join(path, filename), content)
+        git(path, "add", filename)
+        git(path, "commit", "--quiet", "-m", "Update %s" % filename)
+        git(path, "push", "--quiet", "origin", "HEAD:master")
+        return git_output(path, "rev-parse", "HEAD")
+
+    def test_mirror(self):
+        path = mirror.sync_mirror(self.root, self.manifest_url, MANIFEST_NAME, 1)
+        self.assertTrue(os.path.isdir(os.path.join(path, "project.git")))
+        with open(os.path.join(path, mirror.metadata_name())) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata["manifest_url"], self.manifest_url)
+        self.assertIn("refreshed", metadata)
+
+        # a project's checkout borrows objects from the mirror
+        project = os.path.join(self.directory, "checkout")
+        common.get_code(project, self.manifest_url, MANIFEST_NAME, 1)
+        self.assertEqual(git_output(os.path.join(project, "sel4", ".repo", "manifests"),
+                                    "config", "repo.reference"), path)
+        with open(os.path.join(project, "sel4", "project", "README")) as f:
+            self.assertEqual(f.read(), "first\n")
+
+        # a new commit reaches the mirror when it is synced in place
+        head = self.commit("project", "README", "second\n")
+        self.assertEqual(mirror.sync_mirror(self.root, self.manifest_url, MANIFEST_NAME, 1), path)
+        self.assertEqual(git_output(os.path.join(path, "project.git"), "rev-parse", "master"), head)
+        self.assertGreaterEqual(mirror.load_metadata(path)["refreshed"], metadata["refreshed"])
@@ -0,0 +1,58 @@
+import os
+
+import support
+
+from camkes_cli import common
+from camkes_cli import render
+
+class WriteTest(support.ProjectTestCase):
+
+    def test_write_if_changed(self):
+        path = self.path("out", "file")
+        self.assertTrue(render.write_if_changed(path, "first"))
+        os.utime(path, (0, 0))
+        self.assertFalse(render.write_if_changed(path, "first"))
+        self.assertEqual(os.stat(path).st_mtime, 0)
+        self.assertTrue(render.write_if_changed(path, "second"))
+        with open(path) as f:
+            self.assertEqual(f.read(), "second")
+
+    def test_write_replaces_symlink(self):
+        target = self.path("target")
+        self.write("target", "content")
+        os.symlink(target, self.path("link"))
+        self.assertTrue(render.write_if_changed(self.path("link"), "content"))
+        self.assertFalse(os.path.islink(self.path("link")))
+        with open(target) as f:
+            self.assertEqual(f.read(), "content")
+
+    def test_create(self):
+        self.assertTrue(render.create(self.path("new"), "first"))
+        self.assertFalse(render.create(self.path("new"), "second"))
+        with open(self.path("new")) as f:
+            self.assertEqual(f.read(), "first")
+
+class TemplateTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(TemplateTest, self).setUp()
+        render._environments.clear()
+
+    def tearDown(self):
+        render._environments.clear()
+        super(TemplateTest, self).tearDown()
+
+    def test_missing_template(self):
+        with self.assertRaises(common.MissingTemplate):
+            render.get_template(common.part_template_path(), "missing")
+
+    def test_bytecode_cache(self):
+        self.assertEqual(self.run_cli("procedure", "Bar"), None)
+        self.assertNotEqual(os.listdir(render.bytecode_cache_path()), [])
+
+    def test_unwritable_bytecode_cache(self):
+        os.environ["XDG_CACHE_HOME"] = "/proc/nope"
+        self.assertIsNone(render.bytecode_cache())
+        self.assertEqual(self.run_cli("procedure", "Bar"), None)
+        with open(self.path("src", "interfaces", "Bar.camkes")) as f:
+            self.assertIn("procedure Bar", f.read())
@@ -0,0 +1,87 @@
+import os
+import argparse
+
+import support
+
+from camkes_cli import index
+from camkes_cli import common
+from camkes_cli import scaffold
+
+SPEC = '''
+procedures = ["Foo"]
+
+[components.Server]
+provides = [["Foo", "foo"], ["P0", "p"]]
+
+[components.Client]
+control = true
+uses = [["Foo", "foo"]]
+'''
+
+class ScaffoldTest(support.ProjectTestCase):
+
+    def scaffold(self, spec, dry_run=False, allow_missing_procedure=False):
+        self.write("spec.toml", spec)
+        args = argparse.Namespace(context=self.context, logger=self.logger, spec=self.path("spec.toml"),
+                                  dry_run=dry_run, allow_missing_procedure=allow_missing_procedure, jobs=1)
+        with self.assertLogs(self.logger, "INFO") as logs:
+            scaffold.handle_scaffold(args)
+        return [record.getMessage() for record in logs.records]
+
+    def planned(self):
+        return [os.path.join("src", "interfaces", "Foo.camkes"),
+                os.path.join("src", "components", "Client", "Client.camkes"),
+                os.path.join("src", "components", "Client", "src", "main.c"),
+                os.path.join("src", "components", "Server", "Server.camkes"),
+                os.path.join("src", "components", "Server", "src", "main.c")]
+
+    def test_dry_run(self):
+        messages = self.scaffold(SPEC, dry_run=True)
+        self.assertEqual(messages, ["Create:  %s" % rel for rel in self.planned()])
+        for rel in self.planned():
+            self.assertFalse(os.path.exists(self.path(rel)), rel)
+
+    def test_scaffold(self):
+        messages = self.scaffold(SPEC)
+        self.assertEqual(messages[-1], "Created 5 of 5 files")
+        for rel in self.planned():
+            self.assertTrue(os.path.isfile(self.path(rel)), rel)
+
+        with open(self.path("src", "components", "Server", "Server.camkes")) as f:
+            server = f.read()
+        # the new procedure and an existing one are both imported
+        self.assertIn('import "../../interfaces/Foo.camkes";', server)
+        self.assertIn('import "../../interfaces/P0.camkes";', server)
+        self.assertIn("provides Foo foo;", server)
+        with open(self.path("src", "components", "Client", "Client.camkes")) as f:
+            self.assertIn("control;", f.read())
+
+        # nothing is overwritten
+        messages = self.scaffold(SPEC)
+        self.assertEqual(messages[-1], "Created 0 of 5 files")
+
+    def test_one_index_refresh(self):
+        spec = "".join('[components.S%d]\nprovides = [["P%d", "p"]]\n' % (i, i % 3) for i in range(10))
+        with support.mock.patch.object(index.ProcedureIndex, "refresh", autospec=True,
+                                       side_effect=index.ProcedureIndex.refresh) as refresh:
+            self.scaffold(spec)
+        self.assertEqual(refresh.call_count, 1)
+
+    def test_missing_procedure(self):
+        spec = '[components.Server]\nprovides = [["Missing", "m"]]\n'
+        with self.assertRaises(common.MissingProcedure):
+            self.scaffold(spec)
+        self.assertFalse(os.path.exists(self.path("src", "components", "Server")))
+        messages = self.scaffold(spec, allow_missing_procedure=True)
+        self.assertEqual(messages[-1], "Created 2 of 2 files")
+
+    def test_invalid_specs(self):
+        for spec in ['name = "x"\n', 'procedures = "Foo"\n', 'procedures = [1]\n',
+                     '[components.A]\nprovides = [["Foo"]]\n', '[components.A]\nuses = ["Foo"]\n',
+                     '[components.A]\nprovides = [[1, 2]]\n', '[components.A]\nkind = "x"\n',
+                     'components = 5\n', '[components]\nA = 5\n', 'procedures = \n']:
+            self.write("spec.toml", spec)
+            with self.assertRaises(scaffold.InvalidSpec):
+                scaffold.load_spec(self.path("spec.toml"))
+        with self.assertRaises(scaffold.InvalidSpec):
+            scaffold.load_spec(self.path("missing.toml"))
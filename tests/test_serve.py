@@ -0,0 +1,110 @@
+import os
+import json
+import socket
+import struct
+import threading
+
+import support
+
+from camkes_cli import query
+from camkes_cli import serve
+
+class NoChanges:
+    """A watcher reporting no changes."""
+
+    def wait(self, timeout):
+        return []
+
+    def close(self):
+        pass
+
+class ModelTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(ModelTest, self).setUp()
+        self.model = serve.Model(self.context, self.logger, 1)
+
+    def test_procedure(self):
+        response = self.model.handle({"query": "procedure", "name": "P0"})
+        self.assertTrue(response["ok"])
+        self.assertEqual(response["result"]["path"], self.path("src", "interfaces", "P0.camkes"))
+        self.assertEqual(len(response["result"]["methods"]), 4)
+
+    def test_component(self):
+        result = self.model.handle({"query": "component", "name": "C1"})["result"]
+        self.assertEqual(result["interfaces"], [{"keyword": "provides", "type": "P1", "name": "p"}])
+
+    def test_imports(self):
+        result = self.model.handle({"query": "imports", "name": self.path("src", "interfaces", "P0.camkes")})
+        self.assertIn(self.path("src", "components", "C0", "C0.camkes"), result["result"]["imported_by"])
+
+    def test_bad_requests(self):
+        for request in [[], {"name": "P0"}, {"query": "procedure"}, {"query": "imports", "name": 5},
+                        {"query": "procedure", "name": ["P0"]}, {"query": "nonsense"},
+                        {"query": "procedure", "name": "Missing"}]:
+            response = self.model.handle(request)
+            self.assertFalse(response["ok"], request)
+            self.assertIn("error", response)
+
+    def test_unexpected_error(self):
+        with support.mock.patch.object(self.model, "answer", side_effect=OSError("broken")):
+            with self.assertLogs(self.logger, "ERROR"):
+                response = self.model.handle({"query": "status"})
+        self.assertFalse(response["ok"])
+        self.assertIn("broken", response["error"])
+
+class ServerTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(ServerTest, self).setUp()
+        self.server = serve.Server(serve.Model(self.context, self.logger, 1), self.context.server_socket_path,
+                                   NoChanges(), self.logger)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            query.send(self.server.path, {"query": "shutdown"})
+            self.thread.join(10)
+        self.server.close()
+        super(ServerTest, self).tearDown()
+
+    def connect(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(10)
+        client.connect(self.server.path)
+        return client
+
+    def test_query(self):
+        response = query.send(self.server.path, {"query": "status"})
+        self.assertTrue(response["ok"])
+        self.assertEqual(response["result"]["pid"], os.getpid())
+
+    def test_survives_bad_requests(self):
+        client = self.connect()
+        try:
+            client.sendall(b'{"query": "imports", "name": 5}\nnot json\n')
+            responses = b''
+            while responses.count(b'\n') < 2:
+                responses += client.recv(1 << 16)
+        finally:
+            client.close()
+        self.assertEqual([json.loads(r)["ok"] for r in responses.splitlines()], [False, False])
+        self.assertTrue(query.send(self.server.path, {"query": "status"})["ok"])
+
+    def test_survives_reset_connection(self):
+        other = self.connect()
+        reset = self.connect()
+        reset.sendall(b'{"query": "gra')
+        # closing with a zero linger time resets the connection
+        reset.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        reset.close()
+        try:
+            other.sendall(b'{"query": "status"}\n')
+            response = b''
+            while not response.endswith(b'\n'):
+                response += other.recv(1 << 16)
+        finally:
+            other.close()
+        self.assertTrue(json.loads(response)["ok"])
+        self.assertTrue(self.thread.is_alive())
@@ -0,0 +1,72 @@
+import os
+import argparse
+
+import support
+
+import synthetic
+
+from camkes_cli import build
+from camkes_cli import common
+from camkes_cli import fingerprint
+from camkes_cli import update
+
+# like the fake repo, checking out FAKE_REVISION of each project
+REVISION_REPO = r'''#!/bin/sh
+case "$1" in
+    init) mkdir -p .repo && echo "<manifest/>" > .repo/manifest.xml;;
+    sync) mkdir -p apps kernel/.git tools/camkes/.git
+          printf 'kernel\ntools/camkes\n' > .repo/project.list
+          echo ${FAKE_REVISION:-0} > kernel/.git/HEAD
+          echo 0 > tools/camkes/.git/HEAD;;
+esac
+exit 0
+'''
+
+class UpdateTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(UpdateTest, self).setUp()
+        synthetic.write(os.path.join(self.bin_path, "repo"), REVISION_REPO, executable=True)
+        self.update()
+
+    def update(self, revision="0"):
+        os.environ["FAKE_REVISION"] = revision
+        with self.assertLogs(self.logger, "INFO") as logs:
+            update.handle_update(argparse.Namespace(context=self.context, logger=self.logger, jobs=1))
+        return [record.getMessage() for record in logs.records]
+
+    def test_unchanged(self):
+        messages = self.update()
+        self.assertIn("No repositories changed", messages)
+        self.assertIn("Wrote 0 build templates, %d unchanged" % self.templates(), messages)
+
+    def test_command(self):
+        self.run_cli("update", "--jobs", "2")
+        self.assertEqual(fingerprint.project_revisions(self.context), {"kernel": "0", "tools/camkes": "0"})
+
+    def templates(self):
+        return sum(len([f for f in files if not f.startswith('.')])
+                   for (_, _, files) in os.walk(common.build_template_path()))
+
+    def test_reports_changes(self):
+        self.assertEqual([m for m in self.update("1") if m.startswith("Updated")], ["Updated kernel"])
+        self.assertEqual(fingerprint.project_revisions(self.context), {"kernel": "1", "tools/camkes": "0"})
+
+    def test_keeps_builds(self):
+        build.build_config(self.context, "x86", self.logger)
+        obj_path = os.path.join(self.context.config_build_path("x86"), "build", "main.o")
+        synthetic.write(obj_path, "object")
+        os.makedirs(self.path("sel4", "projects"))
+
+        self.update()
+        self.assertTrue(os.path.exists(obj_path))
+        self.assertTrue(os.path.isfile(self.path("sel4", "tools", "camkes", "camkes", "parser.py")))
+        # what is new in the build system is linked into the build directory
+        self.assertTrue(os.path.islink(os.path.join(self.context.config_build_path("x86"), "projects")))
+
+        # an update that didn't move anything leaves the build up to date
+        self.assertFalse(build.build_config(self.context, "x86", self.logger))
+        self.update("1")
+        current = fingerprint.compute(self.context, "x86")
+        self.assertEqual(fingerprint.rebuild_reasons(self.context, "x86", current),
+                         ["build system revision changed"])
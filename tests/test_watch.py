@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+
+import support
+
+from camkes_cli import build
+from camkes_cli import watch
+
+class ScriptedWatcher:
+    """Reports each batch of changes in turn, once the cycle started by the
+       last has finished, then interrupts the watch."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.threads = threading.active_count()
+
+    def wait(self, timeout):
+        if timeout is not None:
+            # settled
+            return []
+        deadline = time.time() + 10
+        while threading.active_count() > self.threads and time.time() < deadline:
+            time.sleep(0.01)
+        if len(self.batches) == 0:
+            raise KeyboardInterrupt()
+        return self.batches.pop(0)
+
+class WatchTest(support.ProjectTestCase):
+
+    def setUp(self):
+        super(WatchTest, self).setUp()
+        self.watch = watch.Watch(self.context, self.logger, "x86", 1, 0)
+        self.builds = []
+        self.finished = threading.Event()
+
+    def run_watch(self, batches, errors):
+        """Watch through the batches of changes, with each build raising
+           the next of errors, or succeeding if it is None."""
+        errors = list(errors)
+
+        def build_config(context, name, logger, **kwargs):
+            self.builds.append(name)
+            error = errors.pop(0) if errors else None
+            if error is not None:
+                raise error
+            return True
+
+        with support.mock.patch.object(build, "build_config", build_config):
+            with self.assertRaises(KeyboardInterrupt):
+                self.watch.run(ScriptedWatcher(batches))
+
+    def test_ignored(self):
+        for f in [".P0.camkes.swp", "P0.camkes~", "P0.camkes.swx", "4913", ".hidden"]:
+            self.assertTrue(watch.ignored(os.path.join("src", f)), f)
+        self.assertFalse(watch.ignored(os.path.join("src", "P0.camkes")))
+
+    def test_rebuilds_on_changes(self):
+        self.run_watch([[self.path("src", "a.c")], [self.path("src", ".a.c.swp")], [self.path("configs", "x86")]],
+                       [])
+        # the first build, then one per batch with changes that matter
+        self.assertEqual(self.builds, ["x86"] * 3)
+
+    def test_error_ends_only_the_cycle(self):
+        with self.assertLogs(self.logger, "ERROR") as logs:
+            self.run_watch([[self.path("src", "a.c")]], [OSError("disk full"), None])
+        self.assertEqual(self.builds, ["x86"] * 2)
+        self.assertEqual(logs.output, ["ERROR:tests:Building x86 failed: disk full"])
+
+    def test_boot_error(self):
+        self.watch.boot = True
+        with support.mock.patch.object(self.watch, "boot_once", side_effect=OSError("no qemu")):
+            with self.assertLogs(self.logger, "ERROR") as logs:
+                self.run_watch([], [])
+        self.assertEqual(logs.output, ["ERROR:tests:Booting x86 failed: no qemu"])
+
+class PollingWatcherTest(support.ProjectTestCase):
+
+    def test_changes(self):
+        with support.mock.patch.object(watch, "POLL_INTERVAL", 0.01):
+            watcher = watch.PollingWatcher([self.path("src")])
+            self.assertEqual(watcher.wait(0.05), [])
+            self.write("src/new.camkes", "procedure New {}\n")
+            self.assertEqual(watcher.wait(1), [self.path("src", "new.camkes")])